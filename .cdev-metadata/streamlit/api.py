@@ -0,0 +1,146 @@
+"""What the app does, without Streamlit: render, push, watch and merge.
+
+interface.py only collects widget values and shows results; the steps
+themselves live here so scripts can drive the same flow:
+
+    from api import push_configuration, watch_workflow, merge_and_find_run
+    from models import ProjectConfig, StackConfig
+
+    result = push_configuration("my-org/infra", token, ProjectConfig(), StackConfig())
+    statuses = watch_workflow("my-org/infra", token, result["branch"])
+
+Every step is recorded in the run-state store (run_state.py), so resume()
+lets any session pick up a bootstrap where another one left it. Pushing and
+merging run as checkpointed stages (pipeline.py): calling them again after a
+failure continues where the last attempt stopped.
+
+Importing this module only loads models (and PyYAML). The GitHub client,
+requests, PyNaCl and NumPy are imported by the functions that need them,
+so a script that only renders never pays for them.
+"""
+import re
+
+import pipeline
+from models import render_files
+from run_state import APPLY, PLAN, RunStateStore
+
+BASE_BRANCH = "main"
+# How long watching a workflow or waiting for the apply run goes on before giving up
+WORKFLOW_TIMEOUT = 1500
+APPLY_RUN_TIMEOUT = 600
+
+
+def _store():
+    return RunStateStore()
+
+
+def push_configuration(repo, token, project, stack, base_branch=BASE_BRANCH):
+    """Render and push one project as a branch and PR, unless that is a no-op.
+
+    Returns {"status", "pr_url", "branch", "message", "commit", "resumed_from", "jobs"}
+    where status is "unchanged" (base_branch already has these files), "reused"
+    (an open PR has the same render), "created" or "failed", and commit is the
+    commit_files() result when a commit was attempted. A push that failed
+    half-way continues from its checkpoint: resumed_from names the last stage
+    that was already done and jobs the plan outcome, if known (see pipeline.py).
+    """
+    return pipeline.push(repo, token, render_files(project, stack), base_branch, store=_store())
+
+
+def save_aws_secrets(repo, token, access_key_id, secret_access_key):
+    """Store the AWS credentials as Actions secrets; returns the error messages (empty on success)."""
+    from secret_sync import SecretTarget, sync_secrets
+
+    secrets = {"AWS_ACCESS_KEY_ID": access_key_id, "AWS_SECRET_ACCESS_KEY": secret_access_key}
+    return list(sync_secrets(token, [SecretTarget(repo=repo)], secrets)[repo]["failed"].values())
+
+
+def plan_run_id(status):
+    """Run id of a job status returned by watch_workflow."""
+    return re.search(r'/runs/(\d+)/job', status['url']).group(1)
+
+
+def watch_workflow(repo, token, branch, timeout=WORKFLOW_TIMEOUT, callback=None):
+    """Wait for the branch's workflow run and return its job statuses [{"name", "status", "url"}].
+
+    When the plan job succeeded its summary is computed as well and kept with
+    the run's state, where stored_plan_summary() reads it.
+    """
+    from github_utils import get_workflow_status
+
+    job_statuses = get_workflow_status(repo, token, branch, timeout=timeout, callback=callback)
+    if job_statuses:
+        finished = all(status['status'] in ('success', 'skipped') for status in job_statuses)
+        _store().record(repo, branch, job_statuses[0]['head_sha'], kind=PLAN, run_id=str(job_statuses[0]['run_id']),
+                        jobs=job_statuses, conclusion='success' if finished else 'failure')
+    for status in job_statuses:
+        if status['name'] == 'plan' and status['status'] == 'success':
+            if callback:
+                callback(1, "Summarizing the plan")
+            plan_summary(repo, plan_run_id(status), token)
+    return job_statuses
+
+
+def plan_summary(repo, run_id, token):
+    """Per-unit summary of the run's plan log, kept with the run's state (see plan_summary.py)."""
+    from plan_summary import summarize_run
+
+    store = _store()
+    row = store.find(repo, run_id=str(run_id))
+    if row and row['summary'] is not None:
+        return row['summary']
+    summary = summarize_run(repo, run_id, token)
+    if row and summary is not None:
+        store.record(repo, row['branch'], row['sha'], summary=summary)
+    return summary
+
+
+def stored_plan_summary(repo, run_id):
+    """The summary watch_workflow() kept for the run, or None; never downloads anything."""
+    row = _store().find(repo, run_id=str(run_id))
+    return row['summary'] if row else None
+
+
+def merge_and_find_run(repo, pr_number, token, timeout=APPLY_RUN_TIMEOUT, callback=None):
+    """Merge the PR and wait for the apply run it triggers; returns (success, message, apply check run).
+
+    A merge or run already in the PR's checkpoint is not done again.
+    """
+    return pipeline.merge(repo, token, pr_number, BASE_BRANCH, timeout, callback=callback, store=_store())
+
+
+def record_apply_result(repo, run_id, conclusion, log_lines):
+    """Keep a finished apply's conclusion and log tail, so no session polls that run again."""
+    store = _store()
+    row = store.find(repo, kind=APPLY, run_id=str(run_id))
+    if row:
+        store.record(repo, row['branch'], row['sha'], conclusion=conclusion, log_tail=list(log_lines))
+
+
+def resume(repo, fingerprint):
+    """{"plan": row, "apply": row} of the latest bootstrap of this render, from the run-state store."""
+    return _store().resume(repo, fingerprint)
+
+
+def pull_request_state(repo, pr_url, token):
+    """"open", "merged" or "closed" (without merging) for the PR at pr_url; None when GitHub does not answer."""
+    from github_utils import get_pull_request
+
+    pr = get_pull_request(repo, pipeline.pr_number(pr_url), token)
+    if pr is None:
+        return None
+    return "merged" if pr.get("merged") else pr["state"]
+
+
+def profile_and_record(repo, run_id, token, label=None):
+    """Profile the finished apply run and add it to the timing store; returns the profile (None if no logs)."""
+    from timings import TimingStore, profile_run_logs
+
+    profile = profile_run_logs(repo, run_id, token)
+    if profile:
+        TimingStore().record(repo, run_id, profile, label=label)
+        store = _store()
+        row = store.find(repo, kind=APPLY, run_id=str(run_id))
+        if row:
+            store.record(repo, row['branch'], row['sha'], profiled=1)
+    return profile
@@ -0,0 +1,415 @@
+"""Benchmarks for the GitHub helpers, run against the local fake API.
+
+    python benchmark.py client [--polls 30] [--latency 0.005] [--handshake 0.03]
+    python benchmark.py render [--reruns 200]
+    python benchmark.py template [--renders 200] [--stacks 64]
+    python benchmark.py flows [--latency 0.02] [--errors] [--check]
+    python benchmark.py sessions [--sessions 10] [--polls 30] [--rate-limit 150]
+    python benchmark.py imports [--repeat 5] [--check]
+    python benchmark.py metrics [--calls 2000]
+
+flows runs the push, secrets, watch and merge flows the app uses end to end
+against fake_github in a separate process and reports API calls, wall time
+and peak Python memory of this (client) process per flow. --check exits
+non-zero when a flow goes over FLOW_BUDGETS; test_budgets.py checks the
+same budgets under pytest.
+
+imports times importing the library modules, and the app's first run, in
+fresh interpreters. It also lists heavy dependencies a module loaded
+although they should only load on first use. --check exits non-zero when
+one goes over IMPORT_BUDGETS, and so does test_budgets.py.
+
+metrics measures what the instrumentation costs: a bare span and counter,
+and GitHub requests against the fake with recording on and off.
+"""
+import argparse
+import os
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+import yaml
+
+from fake_github import FakeGitHub, start_subprocess
+import commit_engine
+import github_utils
+from github_utils import GitHubClient
+import metrics
+import models
+from ratelimit import BACKGROUND
+import template_renderer
+import watcher
+
+# Upper bounds per flow for --check, at the default --latency and without --errors
+FLOW_BUDGETS = {
+    "push": {"api_calls": 6, "wall_s": 1.0, "peak_kib": 2048},
+    "secrets": {"api_calls": 3, "wall_s": 1.0, "peak_kib": 1024},
+    "watch": {"api_calls": 12, "wall_s": 3.0, "peak_kib": 1024},
+    "merge": {"api_calls": 8, "wall_s": 3.0, "peak_kib": 1024},
+}
+
+# Median import time in a fresh interpreter, and how many LAZY_MODULES it may load
+IMPORT_BUDGETS = {
+    "models": {"ms": 150, "eager": 0},
+    "github_utils": {"ms": 60, "eager": 0},
+    "api": {"ms": 150, "eager": 0},
+    # streamlit, and numpy, which streamlit itself imports
+    "app_first_run": {"ms": 8000, "eager": 2},
+}
+# Loaded on first use only
+LAZY_MODULES = ("requests", "nacl", "numpy", "streamlit", "multiprocessing")
+_IMPORT_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, {here!r})
+start = time.perf_counter()
+{code}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+sys.stdout.flush()
+os._exit(0)
+"""
+_APP_FIRST_RUN = "from streamlit.testing.v1 import AppTest\nAppTest.from_file({path!r}, default_timeout=60).run()"
+
+
+class _BareHTTP:
+    # What every helper did before GitHubClient: one unpooled request per call.
+
+    def __init__(self, token, base_url):
+        self.base_url = base_url
+        self.headers = {"Authorization": f"token {token}", "Accept": "application/vnd.github+json"}
+
+    def request(self, method, path, **kwargs):
+        return requests.request(method, f"{self.base_url}/{path}", headers=self.headers, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+
+def _push_and_poll(http, repo, polls):
+    base = f"repos/{repo}"
+    sha = http.get(f"{base}/git/ref/heads/main").json()["object"]["sha"]
+    tree = http.get(f"{base}/git/commits/{sha}").json()["tree"]["sha"]
+    files = [{"path": f".cluster.dev/demo/{n}.yaml", "mode": "100644", "type": "blob", "content": n * 50}
+             for n in ("project", "backend", "stack_eks")]
+    new_tree = http.post(f"{base}/git/trees", json={"base_tree": tree, "tree": files}).json()["sha"]
+    commit = http.post(f"{base}/git/commits", json={"message": "bench", "tree": new_tree, "parents": [sha]}).json()["sha"]
+    http.patch(f"{base}/git/refs/heads/main", json={"sha": commit})
+    for _ in range(polls):
+        http.get(f"{base}/actions/runs")
+
+
+def bench_client(polls=30, latency=0.005, handshake=0.03):
+    results = {}
+    for label, make in (("bare requests", _BareHTTP), ("GitHubClient", GitHubClient)):
+        fake = FakeGitHub(latency=latency, handshake_latency=handshake)
+        url = fake.start()
+        for i in range(20):
+            fake.add_run(f"cluster.dev-{i:08x}", status="completed", conclusion="success")
+        http = make("bench-token", base_url=url)
+        start = time.perf_counter()
+        _push_and_poll(http, fake.repo, polls)
+        elapsed = time.perf_counter() - start
+        results[label] = {
+            "requests": sum(fake.calls.values()),
+            "connections": fake.connections,
+            "not_modified": fake.not_modified,
+            "wall_s": round(elapsed, 3),
+        }
+        fake.stop()
+    return results
+
+
+def _flows(repo, token):
+    # The same calls interface.py makes, in the same order
+    state = {}
+
+    def push():
+        branch = "cluster.dev-bench"
+        files = models.render_files(models.ProjectConfig(), models.StackConfig())
+        head = github_utils.branch_head(repo, "main", token)
+        commit = commit_engine.commit_files(repo, token, files, branch, base_branch="main", parent=head)
+        assert commit["success"], commit["error"]
+        state["branch"] = branch
+        state["pr_url"] = github_utils.create_pull_request(repo, branch, "main", token)
+        assert state["pr_url"]
+
+    def secrets():
+        for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            ok, error = github_utils.create_or_update_github_secret(repo, name, "bench-secret", token)
+            assert ok, error
+
+    def watch():
+        statuses = github_utils.get_workflow_status(repo, token, state["branch"], timeout=30)
+        assert statuses and all(s["status"] == "success" for s in statuses), statuses
+
+    def merge():
+        ok, message, sha = github_utils.merge_pr(repo, state["pr_url"].rsplit("/", 1)[-1], token)
+        assert ok, message
+        assert github_utils.get_run_id_for_commit(repo, token, sha, "apply", timeout=30)
+
+    return {"push": push, "secrets": secrets, "watch": watch, "merge": merge}
+
+
+def bench_flows(latency=0.02, errors=False):
+    url, server = start_subprocess(latency=latency, run_duration=(0.2, 0.5))
+    # Pointed at the fake for the flows only; tests run this in-process
+    saved = github_utils.API_URL, watcher.POLL_INITIAL, watcher.POLL_MAXIMUM
+    github_utils.API_URL = url
+    watcher.POLL_INITIAL, watcher.POLL_MAXIMUM = 0.1, 0.5
+    control = requests.Session()
+    results = {}
+    try:
+        if errors:
+            # One transient 5xx on reading the base branch (retried, it is a GET) and a secondary rate limit on the PR
+            control.post(f"{url}/_fake/errors", json={"method": "GET", "path_pattern": "/git/ref/heads/main$",
+                                                      "status": 502})
+            control.post(f"{url}/_fake/errors", json={"method": "POST", "path_pattern": "/pulls$", "status": 403,
+                                                      "retry_after": 1, "message": "You have exceeded a secondary rate limit"})
+        for name, flow in _flows("octo/cluster", "bench-token").items():
+            control.post(f"{url}/_fake/reset")
+            tracemalloc.start()
+            start = time.perf_counter()
+            flow()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            stats = control.get(f"{url}/_fake/stats").json()
+            results[name] = {"api_calls": stats["calls"], "not_modified": stats["not_modified"],
+                             "wall_s": round(elapsed, 3), "peak_kib": round(peak / 1024)}
+    finally:
+        server.terminate()
+        control.close()
+        github_utils.API_URL, watcher.POLL_INITIAL, watcher.POLL_MAXIMUM = saved
+    return results
+
+
+def check_budgets(results, budgets=FLOW_BUDGETS):
+    """Return a message for every metric over its budget."""
+    return [f"{flow}: {metric} {results[flow][metric]} > {limit}"
+            for flow, limits in budgets.items() if flow in results
+            for metric, limit in limits.items() if results[flow][metric] > limit]
+
+
+def _session(client, repo, index, polls, interactive_every, latencies):
+    # One Streamlit session: polls the runs of one of a few branches, now and then a user action
+    for i in range(polls):
+        client.get(f"repos/{repo}/actions/runs", params={"branch": f"cluster.dev-{index % 3}"}, priority=BACKGROUND)
+        if i % interactive_every == 0:
+            start = time.perf_counter()
+            client.get(f"repos/{repo}/git/ref/heads/main")
+            latencies.append(time.perf_counter() - start)
+        time.sleep(0.02)
+
+
+def bench_sessions(sessions=10, polls=30, rate_limit=150, window=5.0, interactive_every=10):
+    results = {}
+    for label, limiter in (("unscheduled", False), ("scheduled", None)):
+        fake = FakeGitHub(latency=0.005, rate_limit=rate_limit, rate_limit_window=window)
+        url = fake.start()
+        # Every poll counts, like list endpoints whose ETag changes between polls
+        client = GitHubClient("bench-token", base_url=url, cache_size=0, limiter=limiter)
+        latencies = []
+        threads = [threading.Thread(target=_session, args=(client, fake.repo, i, polls, interactive_every, latencies))
+                   for i in range(sessions)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[label] = {
+            "api_calls": sum(fake.calls.values()) + fake.rate_limited,
+            "answered_403": fake.rate_limited,
+            "shared": client.stats["shared"],
+            "ui_p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "ui_max_ms": round(max(latencies) * 1000, 1),
+            "wall_s": round(time.perf_counter() - start, 2),
+        }
+        fake.stop()
+    return results
+
+
+def _legacy_rerun(project, stack):
+    # The generators before the typed model: each one re-parsed the project YAML dumped just before.
+    project_yaml = yaml.dump(project.to_dict())
+    yaml.safe_load(project_yaml)  # generate_backend_yaml
+    backend_yaml = yaml.dump(project.backend_dict())
+    yaml.safe_load(project_yaml)  # generate_stack_eks_yaml
+    stack_yaml = yaml.dump(stack.to_dict(project))
+    yaml.safe_load(project_yaml)  # generate_workflow_file
+    workflow = models.render_workflow_file.__wrapped__(project)
+    return project_yaml, backend_yaml, stack_yaml, workflow
+
+
+def _model_rerun(project, stack):
+    # Widgets rebuild equal configs on every rerun, so the renders are cache hits.
+    return models.render_files(models.ProjectConfig(**vars(project)), models.StackConfig(**vars(stack)))
+
+
+def _model_cold_rerun(project, stack, counter=iter(range(10 ** 9))):
+    # A different cluster name every rerun, so every stack render misses the cache.
+    return models.render_files(project, models.StackConfig(cluster_name=f"c{next(counter)}"))
+
+
+def bench_render(reruns=200):
+    project, stack = models.ProjectConfig(), models.StackConfig()
+    results = {}
+    for label, rerun in (("legacy yaml", _legacy_rerun), ("model cold", _model_cold_rerun), ("model warm", _model_rerun)):
+        start = time.perf_counter()
+        for _ in range(reruns):
+            rerun(project, stack)
+        elapsed = time.perf_counter() - start
+        results[label] = {"reruns": reruns, "ms_per_rerun": round(elapsed / reruns * 1000, 3)}
+    return results
+
+
+def bench_template(renders=200, stacks=64):
+    template_path = os.path.join(template_renderer.REPO_ROOT, "template.yaml")
+    with open(template_path) as f:
+        text = f.read()
+    data = {"variables": models.StackConfig().to_dict(models.ProjectConfig())["variables"]}
+    results = {}
+
+    start = time.perf_counter()
+    for _ in range(renders):
+        nodes = template_renderer.parse_template.__wrapped__(text)
+        template_renderer.render(nodes, data, template_renderer.REPO_ROOT)
+    results["parse + render"] = {"count": renders, "ms_each": round((time.perf_counter() - start) / renders * 1000, 3)}
+
+    start = time.perf_counter()
+    for _ in range(renders):
+        template_renderer.render(template_renderer.load_template(template_path), data, template_renderer.REPO_ROOT)
+    results["cached render"] = {"count": renders, "ms_each": round((time.perf_counter() - start) / renders * 1000, 3)}
+
+    stack_path = os.path.join(template_renderer.REPO_ROOT, "examples", "stack-eks.yaml")
+    project = template_renderer.load_project(os.path.dirname(stack_path))
+    start = time.perf_counter()
+    for _ in range(stacks):
+        template_renderer.render_stack_file(stack_path, project)
+    results["stacks serial"] = {"count": stacks, "ms_each": round((time.perf_counter() - start) / stacks * 1000, 3)}
+
+    with ProcessPoolExecutor() as pool:
+        list(pool.map(template_renderer.render_stack_file, [stack_path] * os.cpu_count()))  # warm up workers
+        start = time.perf_counter()
+        list(pool.map(template_renderer.render_stack_file, [stack_path] * stacks, [project] * stacks, chunksize=4))
+    results["stacks pool"] = {"count": stacks, "ms_each": round((time.perf_counter() - start) / stacks * 1000, 3)}
+    return results
+
+
+def _time_import(code, cwd):
+    script = _IMPORT_SCRIPT.format(here=cwd, code=code, lazy=LAZY_MODULES)
+    output = subprocess.run([sys.executable, "-c", script], cwd=cwd, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def bench_imports(repeat=5):
+    here = os.path.dirname(os.path.abspath(__file__))
+    targets = {name: f"import {name}" for name in ("models", "github_utils", "api")}
+    targets["app_first_run"] = _APP_FIRST_RUN.format(path=os.path.join(here, "interface.py"))
+    results = {}
+    for name, code in targets.items():
+        runs = [_time_import(code, here) for _ in range(repeat if name != "app_first_run" else 1)]
+        loaded = runs[0]["loaded"]
+        results[name] = {"ms": round(statistics.median(run["ms"] for run in runs), 1),
+                         "eager": len(loaded), "loaded": ",".join(loaded) or "-"}
+    return results
+
+
+def bench_metrics(calls=2000):
+    results = {}
+    start = time.perf_counter()
+    for _ in range(calls):
+        with metrics.span("bench_span", kind="bench"):
+            pass
+    results["span"] = {"us_per_call": round((time.perf_counter() - start) / calls * 1e6, 2)}
+    start = time.perf_counter()
+    for _ in range(calls):
+        metrics.inc("bench_counter", kind="bench")
+    results["counter"] = {"us_per_call": round((time.perf_counter() - start) / calls * 1e6, 2)}
+
+    with FakeGitHub() as fake:
+        client = GitHubClient("bench-metrics", base_url=fake.url, limiter=False)
+        requests_count = max(calls // 10, 50)
+        for enabled in (False, True, False, True):  # interleaved, the second pair is measured
+            metrics.ENABLED = enabled
+            start = time.perf_counter()
+            for i in range(requests_count):
+                client.get(f"repos/{fake.repo}/git/ref/heads/main", params={"n": i})
+            results[f"request, metrics {'on' if enabled else 'off'}"] = {
+                "us_per_call": round((time.perf_counter() - start) / requests_count * 1e6, 2)}
+        metrics.ENABLED = True
+        client.close()
+    metrics.REGISTRY.reset()
+    return results
+
+
+def _print_table(results):
+    columns = list(next(iter(results.values())))
+    print(f"{'':16}" + "".join(f"{c:>14}" for c in columns))
+    for label, row in results.items():
+        print(f"{label:16}" + "".join(f"{row[c]:>14}" for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("client", help="pooled/conditional client vs bare requests")
+    p.add_argument("--polls", type=int, default=30)
+    p.add_argument("--latency", type=float, default=0.005)
+    p.add_argument("--handshake", type=float, default=0.03)
+    p = sub.add_parser("render", help="typed model + cached rendering vs YAML round trips per rerun")
+    p.add_argument("--reruns", type=int, default=200)
+    p = sub.add_parser("template", help="stack template rendering: parse cache and process pool")
+    p.add_argument("--renders", type=int, default=200)
+    p.add_argument("--stacks", type=int, default=64)
+    p = sub.add_parser("flows", help="push/secrets/watch/merge end to end against the fake API")
+    p.add_argument("--latency", type=float, default=0.02)
+    p.add_argument("--errors", action="store_true", help="inject a 502 and a secondary rate limit")
+    p.add_argument("--check", action="store_true", help="exit 1 when a flow exceeds FLOW_BUDGETS")
+    p = sub.add_parser("imports", help="import time and cold start of the app in fresh interpreters")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--check", action="store_true", help="exit 1 when an import exceeds IMPORT_BUDGETS")
+    p = sub.add_parser("metrics", help="cost of timing spans and counters, alone and per GitHub request")
+    p.add_argument("--calls", type=int, default=2000)
+    p = sub.add_parser("sessions", help="many sessions sharing one token: rate-limit scheduler on and off")
+    p.add_argument("--sessions", type=int, default=10)
+    p.add_argument("--polls", type=int, default=30)
+    p.add_argument("--rate-limit", type=int, default=150, help="fake budget per 5s window")
+    args = parser.parse_args()
+    if args.bench == "client":
+        _print_table(bench_client(args.polls, args.latency, args.handshake))
+    elif args.bench == "render":
+        _print_table(bench_render(args.reruns))
+    elif args.bench == "template":
+        _print_table(bench_template(args.renders, args.stacks))
+    elif args.bench == "sessions":
+        _print_table(bench_sessions(args.sessions, args.polls, args.rate_limit))
+    elif args.bench == "metrics":
+        _print_table(bench_metrics(args.calls))
+    elif args.bench == "flows":
+        results = bench_flows(args.latency, args.errors)
+        _print_table(results)
+        if args.check:
+            failures = check_budgets(results)
+            for failure in failures:
+                print(failure)
+            sys.exit(1 if failures else 0)
+    elif args.bench == "imports":
+        results = bench_imports(args.repeat)
+        _print_table(results)
+        if args.check:
+            failures = check_budgets(results, IMPORT_BUDGETS)
+            for failure in failures:
+                print(failure)
+            sys.exit(1 if failures else 0)
@@ -0,0 +1,149 @@
+"""Commit a set of files to a branch in as few round trips as possible.
+
+REST path ("rest"):
+  - files over INLINE_LIMIT are uploaded as blobs concurrently, while the
+    parent commit is looked up;
+  - one tree (small files inlined, large ones by blob SHA), one commit;
+  - the branch is created at the new commit, or moved to it.
+  A new branch therefore needs no separate create_branch call. When the
+  caller already knows the parent (commit SHA, tree SHA), a push is three
+  sequential requests.
+
+GraphQL path ("graphql"): createCommitOnBranch writes all files in one
+request and GitHub signs the commit. The mutation needs an existing branch,
+so a new one is created at the parent first.
+
+commit_files() reports the path it took and the API calls it made, so the
+app can show them.
+"""
+import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from github_utils import branch_head, get_client
+
+COMMIT_MODES = ("rest", "graphql")
+COMMIT_MODE = os.environ.get("CDEV_COMMIT_MODE", "rest")
+INLINE_LIMIT = 16 * 1024  # bytes; larger files go up as separate blobs, in parallel
+BLOB_WORKERS = 8
+
+_CREATE_COMMIT_ON_BRANCH = """
+mutation($input: CreateCommitOnBranchInput!) {
+  createCommitOnBranch(input: $input) { commit { oid url } }
+}
+"""
+
+
+def _encoded(content):
+    return content.encode() if isinstance(content, str) else content
+
+
+def _result(path, calls, sha=None, error=None):
+    return {"success": error is None, "sha": sha, "path": path, "calls": calls, "error": error}
+
+
+def _error(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {"message": response.text or f"HTTP {response.status_code}"}
+
+
+def _upload_blob(client, repo, content):
+    r = client.post(f"repos/{repo}/git/blobs",
+                    json={"content": base64.b64encode(_encoded(content)).decode(), "encoding": "base64"})
+    return r.json()["sha"] if r.status_code == 201 else _error(r)
+
+
+def _commit_rest(token, repo, files, branch, base_branch, message, parent):
+    client = get_client(token)
+    calls = 0
+    large = [path for path, content in files.items() if len(_encoded(content)) > INLINE_LIMIT]
+    pool = ThreadPoolExecutor(max_workers=min(BLOB_WORKERS, len(large)), thread_name_prefix="cdev-blobs") if large else None
+    try:
+        blobs = {path: pool.submit(_upload_blob, client, repo, files[path]) for path in large}
+        if parent is None:
+            parent = branch_head(repo, base_branch or branch, token)
+            calls += 2
+            if parent is None:
+                return _result("rest", calls, error={"message": f"Branch {base_branch or branch} not found."})
+        tree = []
+        for path, content in files.items():
+            if path in blobs:
+                sha = blobs[path].result()
+                calls += 1
+                if isinstance(sha, dict):
+                    return _result("rest", calls, error=sha)
+                tree.append({"path": path, "mode": "100644", "type": "blob", "sha": sha})
+            else:
+                tree.append({"path": path, "mode": "100644", "type": "blob", "content": content})
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    parent_sha, parent_tree = parent
+    r = client.post(f"repos/{repo}/git/trees", json={"base_tree": parent_tree, "tree": tree})
+    calls += 1
+    if r.status_code != 201:
+        return _result("rest", calls, error=_error(r))
+    r = client.post(f"repos/{repo}/git/commits",
+                    json={"message": message, "tree": r.json()["sha"], "parents": [parent_sha]})
+    calls += 1
+    if r.status_code != 201:
+        return _result("rest", calls, error=_error(r))
+    sha = r.json()["sha"]
+    if base_branch:
+        # Creating the branch at the new commit is the branch and the commit in one step
+        r = client.post(f"repos/{repo}/git/refs", json={"ref": f"refs/heads/{branch}", "sha": sha})
+    else:
+        r = client.patch(f"repos/{repo}/git/refs/heads/{branch}", json={"sha": sha})
+    calls += 1
+    if r.status_code not in (200, 201):
+        return _result("rest", calls, error=_error(r))
+    return _result("rest+blobs" if large else "rest", calls, sha=sha)
+
+
+def _commit_graphql(token, repo, files, branch, base_branch, message, parent):
+    client = get_client(token)
+    calls = 0
+    if parent is None:
+        parent = branch_head(repo, base_branch or branch, token)
+        calls += 2
+        if parent is None:
+            return _result("graphql", calls, error={"message": f"Branch {base_branch or branch} not found."})
+    parent_sha = parent[0]
+    if base_branch:
+        r = client.post(f"repos/{repo}/git/refs", json={"ref": f"refs/heads/{branch}", "sha": parent_sha})
+        calls += 1
+        # A branch left at the parent by an earlier attempt is fine: expectedHeadOid checks it didn't move
+        if r.status_code not in (200, 201) and "already exists" not in _error(r).get("message", ""):
+            return _result("graphql", calls, error=_error(r))
+    variables = {"input": {
+        "branch": {"repositoryNameWithOwner": repo, "branchName": branch},
+        "message": {"headline": message},
+        "expectedHeadOid": parent_sha,
+        "fileChanges": {"additions": [{"path": path, "contents": base64.b64encode(_encoded(content)).decode()}
+                                      for path, content in files.items()]},
+    }}
+    r = client.post("graphql", json={"query": _CREATE_COMMIT_ON_BRANCH, "variables": variables})
+    calls += 1
+    data = r.json() if r.status_code == 200 else {"errors": [_error(r)]}
+    if data.get("errors"):
+        return _result("graphql", calls, error={"message": "; ".join(e.get("message", "") for e in data["errors"])})
+    return _result("graphql", calls, sha=data["data"]["createCommitOnBranch"]["commit"]["oid"])
+
+
+def commit_files(repo, token, files, branch, base_branch=None, message="Cluster.dev push configuration",
+                 mode=None, parent=None):
+    """Commit {path: content} on branch.
+
+    With base_branch, branch is new and starts from base_branch. parent is
+    the (commit SHA, tree SHA) to build on when the caller already has it.
+    Returns {"success", "sha", "path", "calls", "error"}: path is "rest",
+    "rest+blobs" or "graphql", and error is GitHub's error JSON.
+    """
+    mode = mode or COMMIT_MODE
+    if mode not in COMMIT_MODES:
+        raise ValueError(f"unknown commit mode {mode!r}, expected one of {', '.join(COMMIT_MODES)}")
+    commit = _commit_graphql if mode == "graphql" else _commit_rest
+    return commit(token, repo, files, branch, base_branch, message, parent)
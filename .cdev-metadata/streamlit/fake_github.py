@@ -0,0 +1,583 @@
+"""Local stand-in for the parts of the GitHub REST API used by github_utils
+(plus the createCommitOnBranch GraphQL mutation).
+
+Start it with FakeGitHub().start() (or start_subprocess() to keep its memory
+and CPU out of measurements), point GITHUB_API_URL (or get_client's base_url)
+at the returned URL and every helper talks to it instead of api.github.com.
+
+Knobs:
+- latency is added to every request, handshake_latency once per TCP
+  connection to mimic the TCP+TLS setup cost of a real HTTPS endpoint;
+- list endpoints paginate (per_page/page, Link header) like GitHub;
+- every answer carries X-RateLimit-* headers, 304s are free, and an
+  exhausted budget answers 403 until the reset time;
+- inject_error() makes matching requests fail (optionally with Retry-After),
+  or with lost=True lets them take effect and only loses the answer;
+- run_duration=(queued, in_progress) seconds lets runs progress on their own.
+
+GET /_fake/stats returns call counters, POST /_fake/reset clears them and
+POST /_fake/errors takes inject_error() arguments as JSON, for a fake
+running in another process.
+
+    python fake_github.py --port 8080 --latency 0.05 --run-duration 5 60
+"""
+import argparse
+import base64
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import re
+import threading
+import time
+import zipfile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode
+
+
+def _sha(*parts):
+    return hashlib.sha1("\0".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _blob_sha(content):
+    data = content.encode()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class FakeGitHub:
+
+    def __init__(self, repo="octo/cluster", latency=0.0, handshake_latency=0.0, rate_limit=5000,
+                 rate_limit_window=3600, run_duration=None, max_per_page=100):
+        self.repo = repo
+        self.latency = latency
+        self.handshake_latency = handshake_latency
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.run_duration = run_duration
+        self.max_per_page = max_per_page
+        self.lock = threading.RLock()
+        self.errors = []
+        self._run_started = {}
+        self._ids = itertools.count(1)
+        self.reset_stats()
+
+        root_tree = _sha("tree")
+        root_commit = _sha("commit", root_tree)
+        self.trees = {root_tree: {}}
+        self.commits = {root_commit: {"sha": root_commit, "tree": {"sha": root_tree}, "parents": []}}
+        self.refs = {"main": root_commit}
+        self.pulls = {}
+        self.runs = []
+        self.jobs = {}
+        self.secrets = {}  # (scope, name) -> request body; scope is repo:, env: or org:
+        self.key_versions = {}
+        self.job_logs = {}
+        self._server = None
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = Counter()
+            self.connections = 0
+            self.not_modified = 0
+            self.bytes_sent = 0
+            self.rate_limited = 0
+            self.rate_remaining = self.rate_limit
+            self.rate_reset = time.time() + self.rate_limit_window
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": sum(self.calls.values()),
+                "by_route": {f"{method} {pattern}": count for (method, pattern), count in self.calls.items()},
+                "connections": self.connections,
+                "not_modified": self.not_modified,
+                "bytes_sent": self.bytes_sent,
+                "rate_limited": self.rate_limited,
+                "rate_remaining": self.rate_remaining,
+            }
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def start(self, host="127.0.0.1", port=0):
+        fake = self
+
+        class Handler(_Handler):
+            github = fake
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -- scenario helpers ----------------------------------------------------
+
+    def add_run(self, head_branch, head_sha=None, status="queued", conclusion=None, event="pull_request",
+                jobs=("plan", "apply")):
+        with self.lock:
+            run_id = next(self._ids)
+            run = {
+                "id": run_id,
+                "name": "Cluster.dev",
+                "head_branch": head_branch,
+                "head_sha": head_sha or self.refs.get(head_branch, _sha(head_branch)),
+                "event": event,
+                "status": status,
+                "conclusion": conclusion,
+                "html_url": f"https://github.com/{self.repo}/actions/runs/{run_id}",
+                "jobs_url": f"{self.url}/repos/{self.repo}/actions/runs/{run_id}/jobs",
+            }
+            self.runs.insert(0, run)
+            self._run_started[run_id] = time.time()
+            self.jobs[run_id] = [
+                {
+                    "id": run_id * 100 + i,
+                    "run_id": run_id,
+                    "name": name,
+                    "status": status,
+                    "conclusion": conclusion,
+                    "html_url": f"https://github.com/{self.repo}/actions/runs/{run_id}/job/{run_id * 100 + i}",
+                }
+                for i, name in enumerate(jobs)
+            ]
+            return run
+
+    def inject_error(self, method, path_pattern, status=502, count=1, retry_after=None, message="Server Error",
+                     lost=False):
+        """Answer the next count requests matching method and path_pattern (regex) with status.
+
+        With lost=True the request is carried out first, like a timeout after GitHub did the work.
+        """
+        with self.lock:
+            self.errors.append({"method": method, "pattern": re.compile(path_pattern), "status": status,
+                                "count": count, "retry_after": retry_after, "message": message, "lost": lost})
+
+    def _injected_error(self, method, path):
+        with self.lock:
+            for error in self.errors:
+                if error["count"] > 0 and error["method"] == method and error["pattern"].search(path):
+                    error["count"] -= 1
+                    headers = {"Retry-After": str(error["retry_after"])} if error["retry_after"] is not None else {}
+                    return error["status"], {"message": error["message"]}, headers, error["lost"]
+        return None
+
+    def _advance_runs(self):
+        # With run_duration set, runs move queued -> in_progress -> completed by wall-clock age.
+        if not self.run_duration:
+            return
+        queued, running = self.run_duration
+        now = time.time()
+        for run in self.runs:
+            if run["status"] == "completed":
+                continue
+            age = now - self._run_started.setdefault(run["id"], now)
+            if age >= queued + running:
+                self.complete_run(run["id"])
+            elif age >= queued and run["status"] != "in_progress":
+                run["status"] = "in_progress"
+                for job in self.jobs.get(run["id"], []):
+                    job["status"] = "in_progress"
+
+    def complete_run(self, run_id, conclusion="success"):
+        with self.lock:
+            for run in self.runs:
+                if run["id"] == run_id:
+                    run.update(status="completed", conclusion=conclusion)
+            for job in self.jobs.get(run_id, []):
+                job.update(status="completed", conclusion=conclusion)
+
+    def append_job_log(self, job_id, text):
+        with self.lock:
+            self.job_logs[job_id] = self.job_logs.get(job_id, "") + text
+
+    def _job(self, job_id):
+        for jobs in self.jobs.values():
+            for job in jobs:
+                if job["id"] == job_id:
+                    return job
+        return None
+
+    # -- routing -------------------------------------------------------------
+
+    def routes(self):
+        repo = r"/repos/(?P<repo>[^/]+/[^/]+)"
+        return [
+            ("GET", repo + r"/git/refs?/heads/(?P<branch>.+)$", self.get_ref),
+            ("POST", repo + r"/git/refs$", self.create_ref),
+            ("PATCH", repo + r"/git/refs/heads/(?P<branch>.+)$", self.update_ref),
+            ("GET", repo + r"/git/commits/(?P<sha>\w+)$", self.get_commit),
+            ("POST", repo + r"/git/commits$", self.create_commit),
+            ("POST", repo + r"/git/trees$", self.create_tree),
+            ("POST", repo + r"/git/blobs$", self.create_blob),
+            ("POST", r"/graphql$", self.graphql),
+            ("GET", repo + r"/git/trees/(?P<sha>\w+)$", self.get_tree),
+            ("GET", repo + r"/pulls$", self.list_pulls),
+            ("POST", repo + r"/pulls$", self.create_pull),
+            ("GET", repo + r"/pulls/(?P<number>\d+)$", self.get_pull),
+            ("PUT", repo + r"/pulls/(?P<number>\d+)/merge$", self.merge_pull),
+            ("GET", repo + r"/actions/secrets/public-key$", self.get_public_key),
+            ("PUT", repo + r"/actions/secrets/(?P<name>\w+)$", self.put_secret),
+            ("GET", repo + r"/environments/(?P<environment>[^/]+)/secrets/public-key$", self.get_public_key),
+            ("PUT", repo + r"/environments/(?P<environment>[^/]+)/secrets/(?P<name>\w+)$", self.put_secret),
+            ("GET", r"/orgs/(?P<org>[^/]+)/actions/secrets/public-key$", self.get_public_key),
+            ("PUT", r"/orgs/(?P<org>[^/]+)/actions/secrets/(?P<name>\w+)$", self.put_secret),
+            ("GET", repo + r"/actions/runs$", self.list_runs),
+            ("GET", repo + r"/actions/runs/(?P<run_id>\d+)/jobs$", self.list_jobs),
+            ("GET", repo + r"/commits/(?P<sha>\w+)/check-runs$", self.list_check_runs),
+            ("GET", repo + r"/actions/runs/(?P<run_id>\d+)/logs$", self.get_run_logs),
+            ("GET", repo + r"/actions/jobs/(?P<job_id>\d+)$", self.get_job),
+            ("GET", repo + r"/actions/jobs/(?P<job_id>\d+)/logs$", self.get_job_logs),
+        ]
+
+    def dispatch(self, method, path, query, body, headers=None):
+        """Route a request; returns (status, payload[, extra headers]). bytes payloads are sent as-is."""
+        injected = self._injected_error(method, path)
+        if injected:
+            *answer, lost = injected
+            if not lost:
+                with self.lock:
+                    self.calls[(method, "injected error")] += 1
+                return tuple(answer)
+        for route_method, pattern, handler in self.routes():
+            if route_method != method:
+                continue
+            m = re.match(pattern, path)
+            if m:
+                with self.lock:
+                    self.calls[(method, pattern)] += 1
+                    self._advance_runs()
+                    result = handler(query=query, body=body, headers=headers or {}, path=path, **m.groupdict())
+                    return tuple(answer) if injected else result
+        return 404, {"message": "Not Found"}
+
+    # -- endpoints -----------------------------------------------------------
+
+    def get_ref(self, repo, branch, **_):
+        if branch not in self.refs:
+            return 404, {"message": "Not Found"}
+        return 200, {"ref": f"refs/heads/{branch}", "object": {"sha": self.refs[branch], "type": "commit"}}
+
+    def create_ref(self, repo, body, **_):
+        branch = body["ref"].split("refs/heads/", 1)[1]
+        if branch in self.refs:
+            return 422, {"message": "Reference already exists"}
+        self.refs[branch] = body["sha"]
+        return 201, {"ref": body["ref"], "object": {"sha": body["sha"]}}
+
+    def update_ref(self, repo, branch, body, **_):
+        if branch not in self.refs:
+            return 422, {"message": "Reference does not exist"}
+        self.refs[branch] = body["sha"]
+        return 200, {"ref": f"refs/heads/{branch}", "object": {"sha": body["sha"]}}
+
+    def get_commit(self, repo, sha, **_):
+        if sha not in self.commits:
+            return 404, {"message": "Not Found"}
+        return 200, self.commits[sha]
+
+    def create_commit(self, repo, body, **_):
+        sha = _sha("commit", body["tree"], *body.get("parents", []), body.get("message"))
+        self.commits[sha] = {"sha": sha, "tree": {"sha": body["tree"]}, "parents": [{"sha": p} for p in body.get("parents", [])]}
+        return 201, self.commits[sha]
+
+    def create_tree(self, repo, body, **_):
+        entries = dict(self.trees.get(body.get("base_tree"), {}))
+        for item in body["tree"]:
+            entries[item["path"]] = item.get("sha") or _blob_sha(item.get("content", ""))
+        sha = _sha("tree", *sorted(entries.items()))
+        self.trees[sha] = entries
+        return 201, {"sha": sha}
+
+    def create_blob(self, repo, body, **_):
+        content = body["content"]
+        if body.get("encoding") == "base64":
+            content = base64.b64decode(content).decode()
+        return 201, {"sha": _blob_sha(content)}
+
+    def graphql(self, body, **_):
+        # Only the createCommitOnBranch mutation the commit engine sends
+        if "createCommitOnBranch" not in body.get("query", ""):
+            return 200, {"errors": [{"message": "Unsupported query"}]}
+        spec = body["variables"]["input"]
+        repo, branch = spec["branch"]["repositoryNameWithOwner"], spec["branch"]["branchName"]
+        if branch not in self.refs:
+            return 200, {"errors": [{"message": f"A ref named \"{branch}\" does not exist"}]}
+        head = self.refs[branch]
+        if spec.get("expectedHeadOid") != head:
+            return 200, {"errors": [{"message": f"Expected branch to point to \"{spec.get('expectedHeadOid')}\" "
+                                                f"but it did not. Pull and try again."}]}
+        entries = dict(self.trees.get(self.commits[head]["tree"]["sha"], {}))
+        for addition in spec["fileChanges"].get("additions", []):
+            entries[addition["path"]] = _blob_sha(base64.b64decode(addition["contents"]).decode())
+        for deletion in spec["fileChanges"].get("deletions", []):
+            entries.pop(deletion["path"], None)
+        tree = _sha("tree", *sorted(entries.items()))
+        self.trees[tree] = entries
+        sha = _sha("commit", tree, head, spec["message"]["headline"])
+        self.commits[sha] = {"sha": sha, "tree": {"sha": tree}, "parents": [{"sha": head}]}
+        self.refs[branch] = sha
+        return 200, {"data": {"createCommitOnBranch": {"commit": {"oid": sha, "url": f"https://github.com/{repo}/commit/{sha}"}}}}
+
+    def get_tree(self, repo, sha, **_):
+        if sha not in self.trees:
+            return 404, {"message": "Not Found"}
+        tree = [{"path": path, "mode": "100644", "type": "blob", "sha": blob} for path, blob in sorted(self.trees[sha].items())]
+        return 200, {"sha": sha, "tree": tree, "truncated": False}
+
+    def list_pulls(self, repo, query, path, **_):
+        pulls = [self._pull_json(p) for p in self.pulls.values()
+                 if p["state"] == query.get("state", "open") and p["base"] == query.get("base", p["base"])]
+        page, headers = self._page(pulls, query, path)
+        return 200, page, headers
+
+    def _pull_json(self, pull):
+        return {**pull, "head": {"ref": pull["head"], "sha": self.refs.get(pull["head"])}, "base": {"ref": pull["base"]}}
+
+    def get_pull(self, repo, number, **_):
+        pull = self.pulls.get(int(number))
+        if pull is None:
+            return 404, {"message": "Not Found"}
+        return 200, self._pull_json(pull)
+
+    def create_pull(self, repo, body, **_):
+        if any(p["state"] == "open" and p["head"] == body["head"] and p["base"] == body["base"]
+               for p in self.pulls.values()):
+            return 422, {"message": "Validation Failed",
+                         "errors": [{"message": f"A pull request already exists for {body['head']}."}]}
+        number = next(self._ids)
+        self.pulls[number] = {"number": number, "head": body["head"], "base": body["base"], "state": "open",
+                              "merged": False, "merge_commit_sha": None, "body": body.get("body"),
+                              "html_url": f"https://github.com/{repo}/pull/{number}"}
+        self.add_run(body["head"], jobs=("plan", "apply"))
+        return 201, self._pull_json(self.pulls[number])
+
+    def merge_pull(self, repo, number, **_):
+        pull = self.pulls.get(int(number))
+        if pull is None:
+            return 404, {"message": "Not Found"}
+        if pull["state"] != "open":
+            return 405, {"message": "Pull Request is not mergeable"}
+        base_sha = self.refs[pull["base"]]
+        head_sha = self.refs[pull["head"]]
+        sha = _sha("merge", base_sha, head_sha)
+        self.commits[sha] = {"sha": sha, "tree": self.commits[head_sha]["tree"],
+                             "parents": [{"sha": base_sha}, {"sha": head_sha}]}
+        self.refs[pull["base"]] = sha
+        pull.update(state="closed", merged=True, merge_commit_sha=sha)
+        self.add_run(pull["base"], head_sha=sha, event="push", jobs=("plan", "apply"))
+        return 200, {"sha": sha, "merged": True, "message": "Pull Request successfully merged"}
+
+    @staticmethod
+    def _secret_scope(repo=None, environment=None, org=None):
+        if org is not None:
+            return f"org:{org}"
+        return f"env:{repo}/{environment}" if environment is not None else f"repo:{repo}"
+
+    def _key_id(self, scope):
+        return f"fake-key-{_sha(scope, str(self.key_versions.get(scope, 0)))[:8]}"
+
+    def rotate_key(self, repo=None, environment=None, org=None):
+        """Give a scope a new key_id; PUTs sealed for the old one then fail with 422 like GitHub's."""
+        scope = self._secret_scope(repo, environment, org)
+        self.key_versions[scope] = self.key_versions.get(scope, 0) + 1
+
+    def get_public_key(self, repo=None, environment=None, org=None, **_):
+        # Every scope has its own key_id, but all use the public half of PrivateKey(bytes(range(32)))
+        # so sealed values can be opened again.
+        scope = self._secret_scope(repo, environment, org)
+        return 200, {"key_id": self._key_id(scope), "key": "j0DFrbaPJWJK5bIU6nZ6bslNgp09e14a0bpvPiE4KF8="}
+
+    def put_secret(self, name, body, repo=None, environment=None, org=None, **_):
+        scope = self._secret_scope(repo, environment, org)
+        if body.get("key_id") != self._key_id(scope):
+            return 422, {"message": "Bad request - key_id does not match the current public key"}
+        key = (scope, name)
+        created = key not in self.secrets
+        self.secrets[key] = body
+        return (201 if created else 204), None
+
+    def _page(self, items, query, path):
+        """Slice items like GitHub pagination; returns (page, headers with Link)."""
+        per_page = min(int(query.get("per_page", 30)), self.max_per_page)
+        page = int(query.get("page", 1))
+        last = max(1, -(-len(items) // per_page))
+        links = []
+        for rel, number in (("next", page + 1), ("last", last)):
+            if page < last:
+                links.append(f'<{self.url}{path}?{urlencode({**query, "page": number})}>; rel="{rel}"')
+        headers = {"Link": ", ".join(links)} if links else {}
+        return items[(page - 1) * per_page:page * per_page], headers
+
+    def list_runs(self, repo, query, path, **_):
+        filters = {"branch": "head_branch", "head_sha": "head_sha", "event": "event", "status": "status"}
+        runs = [r for r in self.runs if all(r[field] == query[k] for k, field in filters.items() if k in query)]
+        page, headers = self._page(runs, query, path)
+        return 200, {"total_count": len(runs), "workflow_runs": page}, headers
+
+    def list_jobs(self, repo, run_id, query, path, **_):
+        jobs = self.jobs.get(int(run_id), [])
+        page, headers = self._page(jobs, query, path)
+        return 200, {"total_count": len(jobs), "jobs": page}, headers
+
+    def list_check_runs(self, repo, sha, query, path, **_):
+        check_runs = [job for run in self.runs if run["head_sha"] == sha for job in self.jobs[run["id"]]]
+        page, headers = self._page(check_runs, query, path)
+        return 200, {"total_count": len(check_runs), "check_runs": page}, headers
+
+
+    def get_run_logs(self, repo, run_id, **_):
+        # Same layout as GitHub: one directory per job, one text file per step.
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+            for i, job in enumerate(self.jobs.get(int(run_id), [])):
+                step = "Run ClusterDev " + job["name"].capitalize()
+                archive.writestr(f"{job['name']}/{i + 1}_{step}.txt", self.job_logs.get(job["id"], ""))
+        return 200, buf.getvalue(), {"Content-Type": "application/zip"}
+
+    def get_job(self, repo, job_id, **_):
+        job = self._job(int(job_id))
+        if job is None:
+            return 404, {"message": "Not Found"}
+        return 200, job
+
+    def get_job_logs(self, repo, job_id, headers, **_):
+        if self._job(int(job_id)) is None:
+            return 404, {"message": "Not Found"}
+        data = self.job_logs.get(int(job_id), "").encode()
+        m = re.match(r"bytes=(\d+)-$", headers.get("Range", ""))
+        if m:
+            start = int(m.group(1))
+            if start >= len(data):
+                return 416, b"", {"Content-Type": "text/plain"}
+            return 206, data[start:], {"Content-Type": "text/plain",
+                                       "Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"}
+        return 200, data, {"Content-Type": "text/plain"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    github = None
+
+    def setup(self):
+        super().setup()
+        with self.github.lock:
+            self.github.connections += 1
+        if self.github.handshake_latency:
+            time.sleep(self.github.handshake_latency)
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        path, _, qs = self.path.partition("?")
+        query = dict(parse_qsl(qs))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        github = self.github
+        if path.startswith("/_fake/"):
+            if path == "/_fake/reset":
+                github.reset_stats()
+            elif path == "/_fake/errors":
+                github.inject_error(**body)
+            self._send(200, json.dumps(github.stats()).encode(), {"Content-Type": "application/json"})
+            return
+        if github.latency:
+            time.sleep(github.latency)
+
+        with github.lock:
+            if time.time() >= github.rate_reset:
+                github.rate_remaining = github.rate_limit
+                github.rate_reset = time.time() + github.rate_limit_window
+            exhausted = github.rate_remaining <= 0
+        if exhausted:
+            with github.lock:
+                github.rate_limited += 1
+            status, payload, *extra = 403, {"message": "API rate limit exceeded"}
+        else:
+            status, payload, *extra = github.dispatch(self.command, path, query, body, dict(self.headers))
+        headers = {"Content-Type": "application/json"}
+        headers.update(extra[0] if extra else {})
+        if isinstance(payload, bytes):
+            data = payload
+        else:
+            data = json.dumps(payload).encode() if payload is not None else b""
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.command == "GET" and status == 200:
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                with github.lock:
+                    github.not_modified += 1
+                status, data = 304, b""
+
+        with github.lock:
+            # Conditional requests answered with 304 do not count against the limit
+            if status != 304 and not exhausted:
+                github.rate_remaining -= 1
+            headers.update({
+                "X-RateLimit-Limit": str(github.rate_limit),
+                "X-RateLimit-Remaining": str(max(github.rate_remaining, 0)),
+                "X-RateLimit-Reset": str(int(github.rate_reset)),
+                "X-RateLimit-Used": str(github.rate_limit - max(github.rate_remaining, 0)),
+                "X-RateLimit-Resource": "graphql" if path.rstrip("/") == "/graphql" else "core",
+            })
+            github.bytes_sent += len(data)
+        self._send(status, data, headers)
+
+    def _send(self, status, data, headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+
+def _serve(ready, kwargs, port):
+    fake = FakeGitHub(**kwargs)
+    ready.put(fake.start(port=port))
+    threading.Event().wait()
+
+
+def start_subprocess(port=0, **kwargs):
+    """Run a FakeGitHub(**kwargs) in a child process; returns (url, process). Stop with process.terminate()."""
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Queue()
+    process = ctx.Process(target=_serve, args=(ready, kwargs, port), daemon=True)
+    process.start()
+    return ready.get(timeout=30), process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--repo", default="octo/cluster")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--handshake-latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=5000)
+    parser.add_argument("--run-duration", type=float, nargs=2, metavar=("QUEUED", "RUNNING"))
+    args = parser.parse_args()
+    fake = FakeGitHub(repo=args.repo, latency=args.latency, handshake_latency=args.handshake_latency,
+                      rate_limit=args.rate_limit, run_duration=args.run_duration)
+    print(f"Fake GitHub API for {args.repo} on {fake.start(port=args.port)}")
+    threading.Event().wait()
@@ -0,0 +1,191 @@
+"""Render and commit a whole fleet of EKS clusters in one pass.
+
+A fleet spec lists projects and the regions each one runs in, plus node
+group settings. Every project x region pair becomes one cluster.dev project
+(.cluster.dev/<name>-<region>/ and its workflow). All files are rendered in
+parallel and pushed as a single commit on one branch with one PR.
+
+YAML spec:
+
+    repo: my-org/infrastructure
+    base_branch: main
+    defaults:
+      organization: my-company
+      state_bucket_name: cdev-state
+      eks_version: "1.27"
+      instance_types: [t3.xlarge, m5.xlarge]
+      min_size: 2
+      max_size: 3
+    projects:
+      - name: payments
+        regions: [eu-central-1, us-east-1]
+        max_size: 6
+      - name: search
+        regions: [eu-west-1]
+
+CSV spec: one row per cluster with a header naming the same fields
+(name, region, organization, ...). List fields (instance_types, addons,
+subnets) are separated by spaces or semicolons.
+
+In both, a cluster without cluster_name is named after its project, so no
+two clusters of one account and region collide.
+
+    python fleet.py fleet.yaml --dry-run --out rendered/
+    GITHUB_TOKEN=... python fleet.py fleet.yaml --repo my-org/infrastructure
+"""
+import argparse
+import csv
+import os
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from ip_capacity import check_fleet
+from models import ProjectConfig, StackConfig, render_files
+from validation import validate_fleet
+
+PROJECT_FIELDS = ("organization", "region", "state_bucket_name")
+STACK_FIELDS = ("cluster_name", "domain", "eks_version", "instance_types", "min_size", "max_size", "addons",
+                "vpc_id", "public_subnets", "private_subnets", "database_subnets", "environment")
+LIST_FIELDS = ("instance_types", "addons", "public_subnets", "private_subnets", "database_subnets")
+INT_FIELDS = ("min_size", "max_size")
+
+
+def _normalize(settings):
+    settings = dict(settings)
+    for key in LIST_FIELDS:
+        value = settings.get(key)
+        if isinstance(value, str):
+            value = value.replace(";", " ").split()
+        if value is not None:
+            settings[key] = tuple(value)
+    for key in INT_FIELDS:
+        if settings.get(key) not in (None, ""):
+            settings[key] = int(settings[key])
+    return {key: value for key, value in settings.items() if value not in (None, "")}
+
+
+def _cluster(settings):
+    # Each project gets its own EKS cluster name unless the spec sets one (YAML and CSV alike)
+    settings = {"cluster_name": settings["name"], **settings}
+    project = ProjectConfig(name=settings["name"], **{k: settings[k] for k in PROJECT_FIELDS if k in settings})
+    stack = StackConfig(**{k: settings[k] for k in STACK_FIELDS if k in settings})
+    return project, stack
+
+
+def load_fleet_spec(path):
+    """Return (spec options, [(ProjectConfig, StackConfig), ...]) from a YAML or CSV fleet spec."""
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        return {}, [_cluster(_normalize(row)) for row in rows]
+
+    with open(path) as f:
+        spec = yaml.safe_load(f)
+    defaults = spec.get("defaults", {})
+    clusters = []
+    for entry in spec.get("projects", []):
+        regions = entry.get("regions") or [entry.get("region") or defaults.get("region", "eu-central-1")]
+        for region in regions:
+            settings = {**defaults, **entry, "region": region}
+            settings.pop("regions", None)
+            if "regions" in entry:
+                settings["name"] = f"{entry['name']}-{region}"
+            clusters.append(_cluster(_normalize(settings)))
+    options = {k: v for k, v in spec.items() if k not in ("defaults", "projects")}
+    return options, clusters
+
+
+def _render(cluster):
+    return render_files(*cluster)
+
+
+def render_fleet(clusters, workers=None):
+    """Render all clusters in a process pool and return one {path: content} dict for the whole fleet."""
+    names = Counter(project.name for project, _ in clusters)
+    duplicates = sorted(name for name, count in names.items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Duplicate project names in fleet spec: {', '.join(duplicates)}")
+    files = {}
+    if len(clusters) < 8:
+        # Not worth spawning processes for a handful of clusters
+        rendered = map(_render, clusters)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = list(pool.map(_render, clusters, chunksize=max(1, len(clusters) // 32)))
+    for cluster_files in rendered:
+        files.update(cluster_files)
+    return files
+
+
+def commit_fleet(files, repo, token, base_branch="main", branch_name=None):
+    """Push the whole fleet as one commit on a new branch and open one PR. Returns (pr_url, error)."""
+    from commit_engine import commit_files
+    from github_utils import create_pull_request
+
+    branch_name = branch_name or f"cluster.dev-fleet-{uuid.uuid4().hex[:8]}"
+    projects = sorted({path.split("/")[1] for path in files if path.startswith(".cluster.dev/")})
+
+    # The branch is created at the fleet commit, large files go up as parallel blob uploads
+    message = f"Cluster.dev fleet update ({len(projects)} projects)"
+    commit = commit_files(repo, token, files, branch_name, base_branch=base_branch, message=message)
+    if not commit["success"]:
+        return None, f"Failed to push files: {(commit['error'] or {}).get('message', 'Unknown error')}"
+    body = "Projects in this change:\n" + "\n".join(f"- {name}" for name in projects)
+    pr_url = create_pull_request(repo, branch_name, base_branch, token, title=message, body=body)
+    if not pr_url:
+        return None, "Failed to create pull request."
+    return pr_url, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("spec", help="fleet spec (.yaml or .csv)")
+    parser.add_argument("--repo", help="target repository, overrides repo in the spec")
+    parser.add_argument("--base-branch", help="branch to open the PR against (default: main)")
+    parser.add_argument("--token-env", default="GITHUB_TOKEN", help="environment variable holding the GitHub token")
+    parser.add_argument("--workers", type=int, help="render processes (default: CPU count)")
+    parser.add_argument("--dry-run", action="store_true", help="render only, do not push")
+    parser.add_argument("--out", help="with --dry-run, write the rendered files under this directory")
+    args = parser.parse_args(argv)
+
+    options, clusters = load_fleet_spec(args.spec)
+    report = validate_fleet(clusters)
+    if report:
+        for name, errors in report.items():
+            for messages in errors.values():
+                for message in messages:
+                    print(f"{name}: {message}")
+        print(f"{len(report)} of {len(clusters)} clusters are invalid; nothing rendered.")
+        return 1
+    # Worth knowing, but a projection for full nodes at max_size: warn instead of refusing
+    for name, message in check_fleet(clusters).items():
+        print(f"{name}: warning: {message}")
+    files = render_fleet(clusters, workers=args.workers)
+    print(f"Rendered {len(files)} files for {len(clusters)} clusters.")
+
+    if args.dry_run:
+        if args.out:
+            for path, content in files.items():
+                target = os.path.join(args.out, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "w") as f:
+                    f.write(content)
+        return 0
+
+    repo = args.repo or options.get("repo")
+    token = os.environ.get(args.token_env)
+    if not repo or not token:
+        parser.error(f"a repository (--repo or 'repo' in the spec) and ${args.token_env} are required to push")
+    pr_url, error = commit_fleet(files, repo, token, base_branch=args.base_branch or options.get("base_branch", "main"))
+    if error:
+        print(error)
+        return 1
+    print(f"Fleet pushed: {pr_url}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,14 +1,250 @@
-from nacl import public
-import base64
-import requests
+import hashlib
+import os
+import threading
 import time
-import io
-import zipfile
+from collections import OrderedDict
+
+import metrics
+from ratelimit import INTERACTIVE, INTERACTIVE_MAX_WAIT, get_limiter
+
+API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+
+
+class GitHubClient:
+    """Keep-alive GitHub REST client shared by all helpers for one token.
+
+    GETs are cached by URL together with their ETag/Last-Modified validators,
+    so repeated polls of unchanged resources come back as 304s, which GitHub
+    does not count against the rate limit. 5xx answers are retried by urllib3,
+    primary/secondary rate-limit answers (403/429) are retried here honouring
+    Retry-After and X-RateLimit-Reset. Every request is timed and counted in
+    metrics.py: per route, status, bytes, retries and 304s, and the wait for
+    the rate limiter separately.
+
+    Every request first goes through the token's shared RateLimiter for the
+    budget it counts against (core or graphql, as X-RateLimit-Resource says),
+    with priority=BACKGROUND for polling. Identical GETs already in flight from
+    other threads are not sent again; they wait for and share that answer.
+    Pass limiter=False to send without any scheduling.
+
+    Only idempotent methods are retried on 5xx: a POST/PATCH/PUT that failed
+    may have gone through, and the pipeline's checkpoints and lookups recover
+    those. Interactive calls wait at most max_interactive_wait seconds for the
+    rate limit: past that, the 403/429 answer is returned as is, and a limiter
+    that is still blocked raises RateLimitExceeded.
+    """
+
+    def __init__(self, token, base_url=API_URL, pool_size=10, max_retries=3, backoff_factor=0.5, cache_size=256,
+                 limiter=None, max_interactive_wait=INTERACTIVE_MAX_WAIT):
+        # requests/urllib3 are only imported once a client is needed
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_interactive_wait = max_interactive_wait
+        self.cache_size = cache_size
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"token {token}",
+            "Accept": "application/vnd.github+json",
+        })
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            # urllib3's default set includes PUT; merges and secret writes are not re-sent
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            # 403/429 waits are scheduled below, where interactive calls can be cut short
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.limiter = get_limiter(token, self.base_url) if limiter is None else limiter
+        self._token = token if limiter is None else None  # set while limiters come from get_limiter
+        self._resources = {}  # route -> X-RateLimit-Resource of its last answer
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "not_modified": 0, "rate_limited": 0, "shared": 0}
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def limiter_for(self, api_route, resource=None):
+        """The limiter of the budget api_route counts against; resource overrides what was seen for it."""
+        if self._token is None:
+            return self.limiter
+        resource = resource or self._resources.get(api_route) or ("graphql" if api_route == "graphql" else "core")
+        return self.limiter if resource == "core" else get_limiter(self._token, self.base_url, resource)
+
+    def request(self, method, path, priority=INTERACTIVE, **kwargs):
+        if method != "GET" or kwargs.get("stream") or not self.limiter:
+            return self._request(method, path, priority, **kwargs)
+        # Single flight: one thread sends, the others asking for the same thing share its answer
+        key = (self.url(path), tuple(sorted((kwargs.get("params") or {}).items())),
+               tuple(sorted((kwargs.get("headers") or {}).items())))
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            with self._lock:
+                self.stats["shared"] += 1
+            metrics.inc("github_shared", route=metrics.route(path))
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+        try:
+            flight.response = self._request(method, path, priority, **kwargs)
+            return flight.response
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def _request(self, method, path, priority, **kwargs):
+        url = self.url(path)
+        cacheable = method == "GET" and not kwargs.get("stream")
+        cache_key = (url, tuple(sorted((kwargs.get("params") or {}).items())))
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cacheable:
+            with self._lock:
+                cached = self._cache.get(cache_key)
+            if cached is not None:
+                if cached.headers.get("ETag"):
+                    headers["If-None-Match"] = cached.headers["ETag"]
+                if cached.headers.get("Last-Modified"):
+                    headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        api_route = metrics.route(path)
+        max_wait = self.max_interactive_wait if priority == INTERACTIVE else None
+        for attempt in range(self.max_retries + 1):
+            limiter = self.limiter_for(api_route)
+            if limiter:
+                with metrics.span("github_limiter_wait", priority=priority):
+                    limiter.acquire(priority, max_wait)
+            with metrics.span("github_request", method=method, route=api_route, status="error") as labels:
+                r = self.session.request(method, url, headers=headers, **kwargs)
+                labels["status"] = r.status_code
+            self._count(method, api_route, r)
+            resource = r.headers.get("X-RateLimit-Resource")
+            if limiter and resource and self._token is not None:
+                with self._lock:
+                    self._resources[api_route] = resource
+                limiter = self.limiter_for(api_route, resource)
+            if limiter:
+                limiter.update(r.headers)
+                if r.status_code == 304:
+                    limiter.refund()
+            if r.status_code in (403, 429) and attempt < self.max_retries:
+                delay = self._rate_limit_delay(r, attempt)
+                if delay is not None:
+                    with self._lock:
+                        self.stats["rate_limited"] += 1
+                    metrics.inc("github_rate_limited", route=api_route)
+                    metrics.observe("github_rate_limit_delay", delay)
+                    if limiter:
+                        # Everyone on this token and resource waits, not just this caller
+                        limiter.block(delay)
+                    if max_wait is not None and delay > max_wait:
+                        # Too long for a user to wait: hand back GitHub's answer
+                        break
+                    r.close()
+                    if not limiter:
+                        time.sleep(delay)
+                    continue
+            break
+
+        if cacheable:
+            with self._lock:
+                if r.status_code == 304 and cached is not None:
+                    self.stats["not_modified"] += 1
+                    self._cache.move_to_end(cache_key)
+                    return cached
+                if r.status_code == 200 and (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+                    r.content  # read the body now so the cached response stays usable
+                    self._cache[cache_key] = r
+                    self._cache.move_to_end(cache_key)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return r
+
+    def _count(self, method, api_route, r):
+        with self._lock:
+            self.stats["requests"] += 1
+        metrics.inc("github_requests", method=method, route=api_route, status=r.status_code)
+        # Content-Length only: streamed bodies are not read here
+        metrics.inc("github_response_bytes", int(r.headers.get("Content-Length") or 0), route=api_route)
+        retries = getattr(getattr(r.raw, "retries", None), "history", ())
+        if retries:
+            metrics.inc("github_retries", len(retries), route=api_route)
+        if r.status_code == 304:
+            metrics.inc("github_not_modified", route=api_route)
+
+    def _rate_limit_delay(self, r, attempt):
+        # Secondary limits come with Retry-After, primary ones with an exhausted X-RateLimit-Remaining.
+        if r.headers.get("Retry-After"):
+            return float(r.headers["Retry-After"])
+        if r.headers.get("X-RateLimit-Remaining") == "0" and r.headers.get("X-RateLimit-Reset"):
+            return max(0.0, float(r.headers["X-RateLimit-Reset"]) - time.time())
+        if "secondary rate limit" in r.text.lower():
+            return self.backoff_factor * (2 ** attempt) * 60
+        return None
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class _Flight:
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token, base_url=None):
+    """Return the process-wide client for token, creating it on first use."""
+    base_url = base_url or API_URL
+    with _clients_lock:
+        client = _clients.get((token, base_url))
+        if client is None:
+            client = _clients[(token, base_url)] = GitHubClient(token, base_url=base_url)
+        return client
+
 
 def create_branch(repo, new_branch_name, base_branch, token):
-    url = f"https://api.github.com/repos/{repo}/git/refs/heads/{base_branch}"
-    headers = {"Authorization": f"token {token}"}
-    r = requests.get(url, headers=headers)
+    client = get_client(token)
+    r = client.get(f"repos/{repo}/git/refs/heads/{base_branch}")
     if r.status_code != 200:
         print(f"Failed to get base branch ref. Response: {r.text}")
         return False, r.json()
@@ -18,100 +254,113 @@ def create_branch(repo, new_branch_name, base_branch, token):
         "ref": f"refs/heads/{new_branch_name}",
         "sha": ref_sha
     }
-    url = f"https://api.github.com/repos/{repo}/git/refs"
-    r = requests.post(url, json=data, headers=headers)
+    r = client.post(f"repos/{repo}/git/refs", json=data)
     success = r.status_code in [200, 201]
     return success, r.json() if not success else None
 
-def push_multiple_files_to_github(files, repo, branch, token):
-    base_url = f"https://api.github.com/repos/{repo}"
-    headers = {"Authorization": f"token {token}"}
+def push_multiple_files_to_github(files, repo, branch, token, message="Cluster.dev push configuration", mode=None):
+    """Commit files on an existing branch; returns (success, GitHub's error JSON or None)."""
+    from commit_engine import commit_files
 
-    # Step 1: Get the latest commit SHA of the branch
-    r = requests.get(f"{base_url}/git/ref/heads/{branch}", headers=headers)
-    if r.status_code != 200:
-        return False, r.json()
-    latest_commit_sha = r.json()["object"]["sha"]
+    result = commit_files(repo, token, files, branch, message=message, mode=mode)
+    return result["success"], result["error"]
 
-    # Step 2: Get the tree SHA of the latest commit
-    r = requests.get(f"{base_url}/git/commits/{latest_commit_sha}", headers=headers)
-    if r.status_code != 200:
-        return False, r.json()
-    base_tree_sha = r.json()["tree"]["sha"]
-
-    # Step 3: Create a new tree object
-    tree_data = []
-    for filename, content in files.items():
-        tree_data.append({"path": filename, "mode": "100644", "type": "blob", "content": content})
-
-    tree_payload = {
-        "base_tree": base_tree_sha,
-        "tree": tree_data
-    }
-    r = requests.post(f"{base_url}/git/trees", json=tree_payload, headers=headers)
-    if r.status_code != 201:
-        return False, r.json()
-    new_tree_sha = r.json()["sha"]
-
-    # Step 4: Create a new commit object
-    commit_payload = {
-        "message": "Cluster.dev push configuration",
-        "tree": new_tree_sha,
-        "parents": [latest_commit_sha]
-    }
-    r = requests.post(f"{base_url}/git/commits", json=commit_payload, headers=headers)
-    if r.status_code != 201:
-        return False, r.json()
-    new_commit_sha = r.json()["sha"]
-
-    # Step 5: Update the reference
-    ref_payload = {
-        "sha": new_commit_sha
-    }
-    r = requests.patch(f"{base_url}/git/refs/heads/{branch}", json=ref_payload, headers=headers)
-    success = r.status_code in [200, 201]
-    # Return both the success status and the response content (if not successful)
-    return success, r.json() if not success else None
-
-def create_pull_request(repo, new_branch_name, base_branch, token):
-    url = f"https://api.github.com/repos/{repo}/pulls"
-    headers = {"Authorization": f"token {token}"}
+def create_pull_request(repo, new_branch_name, base_branch, token, title=None, body=None):
     data = {
-        "title": f"Add/update files from {new_branch_name}",
+        "title": title or f"Add/update files from {new_branch_name}",
         "head": new_branch_name,
         "base": base_branch
     }
-    r = requests.post(url, json=data, headers=headers)
+    if body:
+        data["body"] = body
+    r = get_client(token).post(f"repos/{repo}/pulls", json=data)
     if r.status_code != 201:
         print(f"Failed to create pull request. Response: {r.text}")
         return None
     return r.json().get("html_url")
 
-def create_or_update_github_secret(repo_name, secret_name, secret_value, token):
-    # Get the public key
-    url = f"https://api.github.com/repos/{repo_name}/actions/secrets/public-key"
-    headers = {"Authorization": f"token {token}", "Accept": "application/vnd.github+json"}
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        error_message = f"Failed to get public key. GitHub says: {response.json().get('message', 'Unknown error')}"
-        print(error_message)
-        return False, error_message
+# Git trees are immutable, so a tree fetched once by SHA never needs fetching again
+_tree_cache = OrderedDict()
+_tree_cache_lock = threading.Lock()
+TREE_CACHE_SIZE = 64
+RENDER_MARKER = "cdev-render:"
+
+def git_blob_sha(content):
+    """SHA git assigns to a blob with this content (what a tree entry would reference)."""
+    data = content.encode() if isinstance(content, str) else content
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def render_fingerprint(files):
+    """Content address of a set of rendered files, independent of dict order."""
+    digest = hashlib.sha1()
+    for path in sorted(files):
+        digest.update(f"{path}\0{git_blob_sha(files[path])}\n".encode())
+    return digest.hexdigest()
+
+def get_tree_blobs(repo, tree_sha, token):
+    """Return {path: blob sha} for the whole tree (one recursive fetch, cached by tree SHA)."""
+    with _tree_cache_lock:
+        if tree_sha in _tree_cache:
+            _tree_cache.move_to_end(tree_sha)
+            return _tree_cache[tree_sha]
+    r = get_client(token).get(f"repos/{repo}/git/trees/{tree_sha}", params={"recursive": "1"})
+    if r.status_code != 200:
+        return None
+    data = r.json()
+    if data.get("truncated"):
+        # Too large for one response; let the caller treat everything as changed
+        return None
+    blobs = {entry["path"]: entry["sha"] for entry in data.get("tree", []) if entry["type"] == "blob"}
+    with _tree_cache_lock:
+        _tree_cache[tree_sha] = blobs
+        while len(_tree_cache) > TREE_CACHE_SIZE:
+            _tree_cache.popitem(last=False)
+    return blobs
+
+def branch_head(repo, branch, token):
+    """(commit SHA, tree SHA) at the tip of branch, or None."""
+    client = get_client(token)
+    r = client.get(f"repos/{repo}/git/ref/heads/{branch}")
+    if r.status_code != 200:
+        return None
+    commit_sha = r.json()['object']['sha']
+    r = client.get(f"repos/{repo}/git/commits/{commit_sha}")
+    if r.status_code != 200:
+        return None
+    return commit_sha, r.json()["tree"]["sha"]
+
+def get_branch_tree_sha(repo, branch, token):
+    head = branch_head(repo, branch, token)
+    return head[1] if head else None
 
-    public_key = response.json()['key']
-    key_id = response.json()['key_id']
+def changed_files(files, repo, branch, token, head=None):
+    """Return the paths in files whose content differs from branch, or None if the tree can't be read.
 
-    # Encrypt the secret using the public key
-    public_key_bytes = base64.b64decode(public_key)
-    sealed_box = public.SealedBox(public.PublicKey(public_key_bytes))
-    encrypted_value = base64.b64encode(sealed_box.encrypt(secret_value.encode())).decode()
+    head is branch's (commit SHA, tree SHA) if the caller already fetched it.
+    """
+    tree_sha = head[1] if head else get_branch_tree_sha(repo, branch, token)
+    blobs = get_tree_blobs(repo, tree_sha, token) if tree_sha else None
+    if blobs is None:
+        return None
+    return [path for path, content in files.items() if blobs.get(path) != git_blob_sha(content)]
+
+def find_render_pull_request(repo, base_branch, fingerprint, token):
+    """Return the open PR (dict) whose body records this render fingerprint, if any."""
+    r = get_client(token).get(f"repos/{repo}/pulls", params={"state": "open", "base": base_branch, "per_page": 100})
+    if r.status_code != 200:
+        return None
+    for pr in r.json():
+        if f"{RENDER_MARKER} {fingerprint}" in (pr.get("body") or ""):
+            return pr
+    return None
 
-    # Create or update the secret
-    url = f"https://api.github.com/repos/{repo_name}/actions/secrets/{secret_name}"
-    data = {"encrypted_value": encrypted_value, "key_id": key_id}
-    response = requests.put(url, json=data, headers=headers)
+def create_or_update_github_secret(repo_name, secret_name, secret_value, token):
+    from secret_sync import SecretTarget, sync_secrets
 
-    if response.status_code not in [201, 204]:
-        error_message = f"Failed to create/update secret. GitHub says: {response.json().get('message', 'Unknown error')}"
+    # The repository's public key is cached, so a second secret costs only the PUT
+    result = sync_secrets(token, [SecretTarget(repo=repo_name)], {secret_name: secret_value})[repo_name]
+    if result["failed"]:
+        error_message = result["failed"][secret_name]
         print(error_message)
         return False, error_message
 
@@ -119,55 +368,32 @@ def create_or_update_github_secret(repo_name, secret_name, secret_value, token):
     return True, None
 
 def get_workflow_status(repo, token, branch_name, timeout=1500, callback=None):
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    end_time = time.time() + timeout
-    job_statuses = []  # Initialize as an empty list
-
-    while time.time() < end_time:
-        # Get the workflow runs for the repository
-        url = f"https://api.github.com/repos/{repo}/actions/runs"
-        response = requests.get(url, headers=headers)
-        response_data = response.json()
-
-        # Find the workflow run for the given branch
-        for run in response_data.get('workflow_runs', []):
-            if run['head_branch'] == branch_name:
-                if run['status'] == 'completed':
-                    # Fetch the jobs for this workflow run
-                    jobs_url = run['jobs_url']
-                    jobs_response = requests.get(jobs_url, headers=headers)
-
-                    for job in jobs_response.json().get('jobs', []):
-                        job_statuses.append({
-                            'name': job['name'],
-                            'status': job['conclusion'],
-                            'url': job['html_url']
-                        })
-                    return job_statuses  # Return the list of dictionaries
-                break
-
-        # Invoke the callback if provided
-        if callback:
-            elapsed_time = time.time() - (end_time - timeout)
-            progress = elapsed_time / timeout
-            callback(progress)
-
-        # Sleep for a while before polling again
-        time.sleep(10)
-
+    from watcher import RunWatcher, default_webhook_receiver
+
+    watcher = RunWatcher(repo, token, webhook=default_webhook_receiver())
+    # A push to the PR branch starts a run of its own; the plan is the pull_request one
+    run = watcher.wait_for_run(branch=branch_name, event="pull_request", timeout=timeout, callback=callback)
+    if run is None:
+        return []
+
+    job_statuses = []
+    for job in watcher.jobs(run):
+        job_statuses.append({
+            'name': job['name'],
+            'status': job['conclusion'],
+            'url': job['html_url'],
+            'run_id': run['id'],
+            'head_sha': run['head_sha'],
+        })
     return job_statuses  # Return the list of dictionaries
 
-def merge_pr(repo, pr_number, token):
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/merge"
+def get_pull_request(repo, pr_number, token):
+    """The PR as GitHub returns it (state, merged, merge_commit_sha, head...), or None."""
+    r = get_client(token).get(f"repos/{repo}/pulls/{pr_number}")
+    return r.json() if r.status_code == 200 else None
 
-    response = requests.put(url, headers=headers)
+def merge_pr(repo, pr_number, token):
+    response = get_client(token).put(f"repos/{repo}/pulls/{pr_number}/merge")
 
     if response.status_code == 200:
         # Fetch the merged commit SHA
@@ -177,50 +403,17 @@ def merge_pr(repo, pr_number, token):
         return False, f"Failed to merge PR. GitHub says: {response.json()['message']}", None
 
 def get_run_id_for_commit(repo, token, commit_sha, workflow_name, timeout=60):
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    url = f"https://api.github.com/repos/{repo}/commits/{commit_sha}/check-runs"
-
-    end_time = time.time() + timeout
-    while time.time() < end_time:
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            print(f"Unsuccessful request. Status code: {response.status_code}. Response: {response.json()}")
-            time.sleep(5)  # Wait for 5 seconds before polling again
-            continue
-
-        check_runs = response.json().get('check_runs', [])
-        if check_runs:
-            for run in check_runs:
-                if "apply" in run['name'].lower():
-                    print(f"Successful request. Check runs: {check_runs}")
-                    return run
-            # If no matching run found, sleep for a short duration before polling again
-            time.sleep(5)
-        else:
-            print("Successful request but no check runs found yet.")
-            time.sleep(5)
-
-    return None
+    from watcher import RunWatcher, default_webhook_receiver
 
-def fetch_run_logs(repo, run_id, token):
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    logs_url = f"https://api.github.com/repos/{repo}/actions/runs/{run_id}/logs"
+    watcher = RunWatcher(repo, token, webhook=default_webhook_receiver())
+    run = watcher.wait_for_check_run(commit_sha, lambda check_run: "apply" in check_run['name'].lower(), timeout=timeout)
+    if run is None:
+        print(f"No apply check run found for {commit_sha} within {timeout}s.")
+    else:
+        print(f"Found check run {run['name']}: {run['html_url']}")
+    return run
 
-    response = requests.get(logs_url, headers=headers, stream=True)
+def fetch_run_logs(repo, run_id, token, max_lines=None):
+    from logs import read_run_logs
 
-    if response.status_code == 200:
-        content_type = response.headers.get('content-type')
-        if 'zip' in content_type:
-            with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-                with z.open('apply/4_Run_ClusterDev_Apply.txt') as f:
-                    return f.read().decode('utf-8')
-        else:
-            return response.text
-    else:
-        return None
\ No newline at end of file
+    return read_run_logs(repo, run_id, token, max_lines=max_lines)
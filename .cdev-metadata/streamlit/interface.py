@@ -1,223 +1,200 @@
+import json
+import time
 import streamlit as st
-import yaml
-import uuid
-import re
-from github_utils import create_branch, push_multiple_files_to_github, create_pull_request, create_or_update_github_secret, get_workflow_status, merge_pr, get_run_id_for_commit,fetch_run_logs
-
-def generate_project_yaml():
-
-    regions = [
-        "us-east-1", "us-east-2", "us-west-1", "us-west-2",
-        "af-south-1", "ap-east-1", "ap-south-1", "ap-northeast-1",
-        "ap-northeast-2", "ap-northeast-3", "ap-southeast-1", "ap-southeast-2",
-        "ca-central-1", "eu-central-1", "eu-west-1", "eu-west-2",
-        "eu-west-3", "eu-north-1", "eu-south-1", "me-south-1",
-        "sa-east-1"
-    ]
-
-    project_yaml = {
-        "name":  st.text_input("Name", "my-project"),
-        "kind": "Project",
-        "backend": "aws-backend",
-        "variables": {
-            "organization": st.text_input("Organization", "my-company"),
-            "region": st.selectbox("Region", regions, index=regions.index("eu-central-1")),
-            "state_bucket_name": st.text_input("State Bucket Name", "cdev-state"),
-        },
-    }
-    return yaml.dump(project_yaml)
-
-def generate_backend_yaml(project_yaml):
-    project_yaml = yaml.safe_load(project_yaml)
-
-    backend_yaml = {
-        "name": "aws-backend",
-        "kind": "Backend",
-        "provider": "s3",
-        "spec": {
-            "bucket": project_yaml["variables"]["state_bucket_name"],
-            "region": project_yaml["variables"]["region"],
-        }
-    }
-    return yaml.dump(backend_yaml)
+import api
+import metrics
+from github_utils import render_fingerprint
+from jobs import completed_job, submit_job
+from logs import LogTail
+from ip_capacity import check_stack as check_ip_capacity
+from planner import evaluate as evaluate_node_group, recommend as recommend_node_group
+from models import EKS_ADDONS, EKS_VERSIONS, INSTANCE_TYPES, REGIONS, ProjectConfig, StackConfig, render_backend_yaml, render_project_yaml, render_stack_eks_yaml, render_files, preview_stack
+from template_renderer import TemplateError
+from timings import TimingStore
+from unit_graph import parse_units, schedule, waves
+from validation import validate_config
+
+rerun_started = time.perf_counter()
+
+@metrics.timed()
+def generate_project_config():
+    return ProjectConfig(
+        name=st.text_input("Name", "my-project"),
+        organization=st.text_input("Organization", "my-company"),
+        region=st.selectbox("Region", REGIONS, index=REGIONS.index("eu-central-1")),
+        state_bucket_name=st.text_input("State Bucket Name", "cdev-state"),
+    )
 
-def generate_stack_eks_yaml(project_yaml):
+@metrics.timed()
+def generate_stack_eks_config():
     st.subheader("Configuration for EKS")
 
-    project = yaml.safe_load(project_yaml)
-
     create_vpc = st.checkbox("Create VPC", value=True)
 
-    vpc_config = None
+    vpc_config = {}
     if not create_vpc:
-        vpc_id = st.text_input("VPC ID")
-        public_subnets = st.text_area("Public Subnets (comma-separated)").split(",")
-        private_subnets = st.text_area("Private Subnets (comma-separated)").split(",")
-        database_subnets = st.text_area("Database Subnets (comma-separated)").split(",")
         vpc_config = {
-            "vpc_id": vpc_id,
-            "public_subnets": public_subnets,
-            "private_subnets": private_subnets,
-            "database_subnets": database_subnets,
+            "vpc_id": st.text_input("VPC ID"),
+            "public_subnets": tuple(s.strip() for s in st.text_area("Public Subnets (comma-separated)").split(",")),
+            "private_subnets": tuple(s.strip() for s in st.text_area("Private Subnets (comma-separated)").split(",")),
+            "database_subnets": tuple(s.strip() for s in st.text_area("Database Subnets (comma-separated)").split(",")),
         }
+        # Not part of the stack: only used to check pod IP capacity, subnet IDs do not tell their size
+        st.text_input("Private Subnet CIDRs (comma-separated, optional)", key="private_subnet_cidrs",
+                      help="e.g. 10.0.16.0/20, 10.0.32.0/20 - checks the node group against the subnet size")
 
     cluster_name = st.text_input("Cluster Name", "demo")
     domain = st.text_input("Domain Name", "cluster.dev")
 
-    eks_version = st.selectbox("EKS Version", ["1.27", "1.26", "1.25"])
-    instance_types = st.multiselect(
-        "Instance Types",
-        [
-            "t3.xlarge", "t3a.xlarge", "m5.xlarge", "m5n.xlarge",
-            "t3.medium", "t3.large", "m6i.large", "m5.large",
-            "m5n.large", "t3a.medium", "t3a.large", "m6a.large",
-            "m5a.large"
-        ],
-        default=["t3.xlarge", "m5.xlarge"]
-    )
-    min_size = st.slider("Min Size", min_value=1, max_value=10, value=2)
-    max_size = st.slider("Max Size", min_value=min_size, max_value=10, value=3)
-
-    stack_eks_yaml = {
-        "name": "cluster",
-        "template": "https://github.com/shalb/cdev-aws-eks?ref=main",
-        "kind": "Stack",
-        "backend": "aws-backend",
-        "cliVersion": ">= 0.7.14",
-        "variables": {
-            "region": project["variables"]["region"],
-            "organization": project["variables"]["organization"],
-            "cluster_name": cluster_name,
-            "domain": domain,
-            "eks_version": eks_version,
-            "environment": "demo-env",
-            "eks_managed_node_groups": {
-                "workers": {
-                    "capacity_type": "SPOT",
-                    "desired_size": 2,
-                    "disk_size": 80,
-                    "force_update_version": True,
-                    "instance_types": instance_types,
-                    "labels": {},
-                    "max_size": max_size,
-                    "min_size": min_size,
-                    "name": "spot-workers",
-                    "subnet_ids": '{{ remoteState "cluster.vpc.private_subnets" }}',
-                    "taints": [],
-                    "update_config": {
-                        "max_unavailable": 1
-                    },
-                    "iam_role_additional_policies": {
-                        "ebspolicy": "arn:aws:iam::aws:policy/service-role/AmazonEBSCSIDriverPolicy"
-                    },
-                }
-            },
-        }
-    }
-    eks_addons_list = [
-        ("ArgoCD", True),
-        ("NGINX", True),
-        ("External Secrets", True),
-        ("Cluster Autoscaler", True),
-        ("AWS LB Controller", True),
-        ("External DNS", True),
-        ("Cert Manager", True),
-        ("EFS", False),
-        ("Cert Manager HTTP Issuers", False),
-        ("Metrics Server", True),
-        ("Reloader", True)
-    ]
+    eks_version = st.selectbox("EKS Version", EKS_VERSIONS)
+    # Node group widgets keep their values in session state so the planner can fill them in
+    for key, default in (("instance_types", ["t3.xlarge", "m5.xlarge"]), ("min_size", 2), ("max_size", 3)):
+        if key not in st.session_state:
+            st.session_state[key] = default
+    instance_types = st.multiselect("Instance Types", INSTANCE_TYPES, key="instance_types")
+    min_size = st.slider("Min Size", min_value=1, max_value=10, key="min_size")
+    if st.session_state.max_size < min_size:
+        st.session_state.max_size = min_size
+    if min_size < 10:
+        max_size = st.slider("Max Size", min_value=min_size, max_value=10, key="max_size")
+    else:
+        # A slider cannot have min_value == max_value
+        max_size = st.session_state.max_size = min_size
 
     selected_addons = st.multiselect(
         "Select EKS Addons",
-        options=[name for name, _ in eks_addons_list],
-        default=[name for name, state in eks_addons_list if state]
+        options=[name for name, _ in EKS_ADDONS],
+        default=[name for name, state in EKS_ADDONS if state]
     )
-    eks_addons = {f"enable_{name.lower().replace(' ', '_')}": (name in selected_addons) for name, _ in eks_addons_list}
-    stack_eks_yaml["variables"]["eks_addons"] = eks_addons
 
-    if not create_vpc:
-        stack_eks_yaml["variables"].update(vpc_config)
-
-    return yaml.dump(stack_eks_yaml)
-
-def generate_workflow_file(project_yaml):
-    # Assuming the project name is part of the project YAML
-    project_yaml = yaml.safe_load(project_yaml)
-    project_name = project_yaml['name']
-    region = project_yaml['variables']['region']
-    state_bucket_name =  project_yaml["variables"]["state_bucket_name"]
-    workflow_yaml = f"""
-name: Cluster.dev for {project_name}
-
-on:
-  push:
-    branches:
-      - 'cluster.dev-*'
-      - main
-    paths:
-      - '.cluster.dev/{project_name}/**'
-  pull_request:
-    branches:
-      - main
-    paths:
-      - '.cluster.dev/{project_name}/**'
-
-jobs:
-  plan:
-    if: github.event_name == 'pull_request'
-    runs-on: ubuntu-latest
-    container: clusterdev/cluster.dev:v0.7.18
-    steps:
-    - name: Check out code
-      uses: actions/checkout@v3
-
-    - name: Run ClusterDev Plan
-      run: |
-        cd .cluster.dev/{project_name}
-        aws s3 mb s3://{state_bucket_name} || true
-        cdev plan
-      env:
-        AWS_ACCESS_KEY_ID: ${{{{ secrets.AWS_ACCESS_KEY_ID }}}}
-        AWS_SECRET_ACCESS_KEY: ${{{{ secrets.AWS_SECRET_ACCESS_KEY }}}}
-        AWS_DEFAULT_REGION: {region}
-  apply:
-    if: github.event_name == 'push' && contains(github.ref, 'refs/heads/main')  # Runs only on push to main branch
-    runs-on: ubuntu-latest
-    container: clusterdev/cluster.dev:v0.7.18
-    steps:
-    - name: Check out code
-      uses: actions/checkout@v3
-
-    - name: Run ClusterDev Apply
-      run: |
-        cd .cluster.dev/{project_name}
-        cdev apply --force
-      env:
-        AWS_ACCESS_KEY_ID: ${{{{ secrets.AWS_ACCESS_KEY_ID }}}}
-        AWS_SECRET_ACCESS_KEY: ${{{{ secrets.AWS_SECRET_ACCESS_KEY }}}}
-        AWS_DEFAULT_REGION: {region}
-    """
-
-    return workflow_yaml
+    return StackConfig(
+        cluster_name=cluster_name,
+        domain=domain,
+        eks_version=eks_version,
+        instance_types=tuple(instance_types),
+        min_size=min_size,
+        max_size=max_size,
+        addons=tuple(selected_addons),
+        **vpc_config
+    )
+
+def use_node_group_plan(plan):
+    st.session_state.instance_types = list(plan["instance_types"])
+    st.session_state.min_size = plan["min_size"]
+    st.session_state.max_size = plan["max_size"]
+
+def show_node_group_plan(project, stack):
+    summary = evaluate_node_group(stack.instance_types, stack.min_size, stack.max_size, project.region)
+    if summary is None:
+        st.info("No price data for the selected instance types.")
+    else:
+        st.write(
+            f"**{summary['vcpu'][0]:g}-{summary['vcpu'][1]:g} vCPU, {summary['memory_gib'][0]:g}-{summary['memory_gib'][1]:g} GiB.** "
+            f"Spot about ${summary['spot_monthly'][0]:,.0f}-{summary['spot_monthly'][1]:,.0f}/month "
+            f"(on-demand ${summary['on_demand_monthly'][0]:,.0f}-{summary['on_demand_monthly'][1]:,.0f}, "
+            f"{summary['spot_savings']:.0%} saved); ${summary['spot_per_vcpu_hour']:.4f} per vCPU-hour, "
+            f"${summary['spot_per_gib_hour']:.4f} per GiB-hour."
+        )
+        if not summary["uniform"]:
+            st.warning("The instance types differ in vCPU or memory; Cluster Autoscaler sizes the group from one of them.")
+        if summary["spot_pools"] < 2:
+            st.warning("A single spot pool: one interruption wave can take out the whole group. Add a second type of the same size.")
+        if summary["unknown_types"]:
+            st.info("No price data for: " + ", ".join(summary["unknown_types"]))
+
+    col1, col2 = st.columns(2)
+    target_vcpu = col1.number_input("Target vCPU", min_value=1, value=8)
+    target_memory = col2.number_input("Target memory (GiB)", min_value=1, value=32)
+    plans = recommend_node_group(target_vcpu, target_memory, project.region)
+    if not plans:
+        st.warning("No node group of up to 10 nodes covers that target; raise Max Size in the template or pick larger types.")
+        return
+    st.dataframe([{**plan, "instance_types": ", ".join(plan["instance_types"])} for plan in plans], hide_index=True)
+    st.button("Use the recommended node group", on_click=use_node_group_plan, args=(plans[0],))
+
+def show_ip_capacity(report):
+    rows = [{**subnet, "status": "exhausted" if subnet["nodes"] > subnet["max_nodes"]
+             else "exhausted with one AZ down" if subnet["nodes_one_az_down"] > subnet["max_nodes"] else "ok"}
+            for subnet in report["subnets"]]
+    st.dataframe(rows, hide_index=True)
+    pods = ", ".join(f"{name}: {count}" for name, count in report["max_pods"].items())
+    mode = f"prefix delegation, {report['warm_prefixes']} warm prefix" if report["prefix_delegation"] else "secondary IPs"
+    st.caption(f"Max pods per node ({mode}): {pods}. A full node takes up to {report['addresses_per_node']} addresses.")
+
+def show_unit_graph(graph, durations=None):
+    destroy = st.toggle("Destroy order", key="graph_destroy")
+    plan = schedule(graph, durations, destroy=destroy)
+    st.dataframe([{
+        "wave": number,
+        "unit": name,
+        "needs": ", ".join(sorted(graph.deps[name])),
+        "start_s": plan["start"][name],
+        "duration_s": plan["duration"][name],
+        "slack_s": plan["slack"][name],
+    } for number, wave in enumerate(waves(graph, destroy), 1) for name in wave], hide_index=True)
+    st.write(f"Critical path: {' → '.join(plan['critical_path'])}, about {plan['total'] / 60:.0f} min.")
+    if plan["lost_to_waves"] > 0:
+        st.caption(f"Running wave by wave would add {plan['lost_to_waves'] / 60:.0f} min waiting on the slowest unit of each wave.")
 
 st.set_page_config(page_title="Cluster.dev AWS-EKS Configuration")
 st.title("Cluster.dev AWS-EKS Configuration")
+metrics_server = metrics.default_metrics_server()
 
-project_yaml_content = generate_project_yaml()
+# Build the typed configs once per rerun; YAML is rendered (and memoized) only for display and commit
+project = generate_project_config()
 st.subheader("Project YAML")
-st.code(project_yaml_content, language="yaml")
+st.code(render_project_yaml(project), language="yaml")
 
-backend_yaml_content = generate_backend_yaml(project_yaml_content)
 st.subheader("Backend YAML")
-st.code(backend_yaml_content, language="yaml")
+st.code(render_backend_yaml(project), language="yaml")
 
-stack_eks_yaml_content = generate_stack_eks_yaml(project_yaml_content)
+stack = generate_stack_eks_config()
 st.subheader("Stack EKS YAML")
-st.code(stack_eks_yaml_content, language="yaml")
+st.code(render_stack_eks_yaml(project, stack), language="yaml")
+
+# Catch invalid settings here instead of in the plan job minutes later
+config_errors = validate_config(project, stack)
+for field, messages in config_errors.items():
+    for message in messages:
+        st.error(message)
+
+with st.expander("Node group cost and capacity"):
+    show_node_group_plan(project, stack)
+
+# Worst case: every node at max_size filled with pods, ENI addresses fragmenting /28 blocks
+private_cidrs = tuple(c.strip() for c in st.session_state.get("private_subnet_cidrs", "").split(",") if c.strip())
+try:
+    ip_report = check_ip_capacity(project, stack, private_cidrs)
+except ValueError as e:
+    ip_report = None
+    st.error(f"Invalid private subnet CIDR: {e}")
+if ip_report and ip_report["exhausted"]:
+    st.error(f"The private subnets run out of pod IPs before the node group reaches Max Size {stack.max_size}.")
+elif ip_report and ip_report["exhausted_one_az_down"]:
+    st.warning(f"With one AZ down the remaining private subnets cannot hold Max Size {stack.max_size} nodes.")
+with st.expander("Pod IP capacity"):
+    if ip_report:
+        show_ip_capacity(ip_report)
+    else:
+        st.info("Enter the private subnet CIDRs of the existing VPC to check pod IP capacity.")
+
+with st.expander("Expanded stack template"):
+    try:
+        preview = preview_stack(project, stack)
+    except (TemplateError, OSError) as e:
+        preview = None
+        st.error(f"Failed to render the stack template: {e}")
+    else:
+        if preview.missing:
+            st.warning("The template reads variables this stack does not set: " + ", ".join(preview.missing))
+        st.code(preview.text, language="yaml")
 
-# Generate GitHub workflow file to push to repo
-workflow_file_content = generate_workflow_file(project_yaml_content)
+if preview is not None:
+    with st.expander("Unit dependency graph"):
+        try:
+            show_unit_graph(parse_units(preview.text))
+        except ValueError as e:
+            st.error(f"Cannot order the units: {e}")
 
 st.subheader("Repository and Cloud Access")
 # Inputs for GitHub repository and token
@@ -230,14 +207,11 @@ aws_secret_access_key = st.text_input("AWS Secret Access Key:", type="password")
 
 if st.button('Save AWS Secrets to GitHub'):
     if aws_access_key_id and aws_secret_access_key:
-        success1, error_message1 = create_or_update_github_secret(repo, "AWS_ACCESS_KEY_ID", aws_access_key_id, token)
-        success2, error_message2 = create_or_update_github_secret(repo, "AWS_SECRET_ACCESS_KEY", aws_secret_access_key, token)
-        if success1 and success2:
+        error_messages = api.save_aws_secrets(repo, token, aws_access_key_id, aws_secret_access_key)
+        if not error_messages:
             st.success("AWS secrets saved successfully!")
-        else:
-            error_messages = [msg for msg in [error_message1, error_message2] if msg]
-            for msg in error_messages:
-                st.error(msg)
+        for msg in error_messages:
+            st.error(msg)
     else:
         st.warning("Please provide both AWS Access Key ID and Secret Access Key.")
 
@@ -248,103 +222,289 @@ if 'latest_run_url' not in st.session_state:
     st.session_state.latest_run_url = ''
 if 'latest_run_id' not in st.session_state:
     st.session_state.latest_run_id = ''
-# If PR is merged, display the action triggered message
+# Background jobs watching the plan run and merging the PR
+if 'watch_job' not in st.session_state:
+    st.session_state.watch_job = None
+if 'merge_job' not in st.session_state:
+    st.session_state.merge_job = None
+if 'pr_url' not in st.session_state:
+    st.session_state.pr_url = ''
+# Which commit path the last push took (commit_engine.commit_files result)
+if 'commit_report' not in st.session_state:
+    st.session_state.commit_report = None
+# Live tail of the apply job log, bounded to LOG_TAIL_LINES lines per session
+if 'latest_job_id' not in st.session_state:
+    st.session_state.latest_job_id = None
+if 'log_tail' not in st.session_state:
+    st.session_state.log_tail = None
+# Per-unit timings of the finished apply run, recorded once into the local timing store
+if 'profile_job' not in st.session_state:
+    st.session_state.profile_job = None
+
+LOG_TAIL_LINES = 500
+DIAGNOSTIC_SPANS = (("github_request", "GitHub requests"), ("github_limiter_wait", "Rate-limit waits"),
+                    ("watcher_sleep", "Watcher sleeps"), ("streamlit_rerun", "Page reruns"))
+DIAGNOSTIC_ROWS = 15
+PIPELINE_STAGES = {"commit": "commit", "pull_request": "pull request", "plan": "plan run"}
+COMMIT_PATHS = {"rest": "REST (inline tree)", "rest+blobs": "REST (blobs uploaded in parallel)",
+                "graphql": "GraphQL createCommitOnBranch"}
+
+def watch_workflow(job, repo, token, branch_name):
+    # The plan summary is computed here too, so it shows up together with the Merge PR button
+    return api.watch_workflow(repo, token, branch_name, callback=job.set_progress)
+
+def merge_and_find_run(job, repo, pr_id, token):
+    return api.merge_and_find_run(repo, pr_id, token, callback=job.set_progress)
+
+def resume_bootstrap(state, repo, token):
+    # Restore what the run-state store knows; only unfinished steps are polled again
+    plan, apply = state["plan"], state["apply"]
+    if plan is None or plan["pr_url"] is None:
+        # Nothing pushed yet, or the PR is still to be opened: the push button continues from the checkpoint
+        return
+    merged = bool(plan["merged_sha"])
+    if not merged:
+        pr_state = api.pull_request_state(repo, plan["pr_url"], token)
+        if pr_state == "closed":
+            # Closed without merging: the push button starts this render over
+            return
+        merged = pr_state == "merged"
+    st.session_state.pr_url = plan["pr_url"]
+    st.session_state.pr_merged = merged
+    # A successful plan without its summary is watched again: the run is finished, the job only summarizes it
+    if plan["conclusion"] and (plan["summary"] is not None or plan["conclusion"] != "success"):
+        st.session_state.watch_job = completed_job("watch", plan["jobs"])
+    else:
+        st.session_state.watch_job = submit_job("watch", watch_workflow, repo, token, plan["branch"])
+    if apply is None:
+        if merged:
+            # Merged, but the apply run is not known yet: the merge job skips the merge and looks for the run
+            merge_and_fetch_latest_run(repo, plan["pr_url"].split('/')[-1], token)
+        return
+    st.session_state.pr_merged = True
+    st.session_state.latest_run_url = apply["run_url"]
+    st.session_state.latest_run_id = apply["run_id"]
+    st.session_state.latest_job_id = int(apply["job_id"])
+    if apply["conclusion"]:
+        tail = LogTail(repo, st.session_state.latest_job_id, token, max_lines=LOG_TAIL_LINES)
+        tail.restore(apply["log_tail"] or [], apply["conclusion"])
+        st.session_state.log_tail = tail
+    if apply["profiled"]:
+        st.session_state.profile_job = completed_job("profile", None)
 
 # Function to be executed on "Merge PR" click
 def merge_and_fetch_latest_run(repo, pr_id, token):
-    success, message, merge_commit_sha = merge_pr(repo, pr_id, token)
-    if success:
-        st.session_state.pr_merged = True
-        st.success(message)
-        # Fetch the GitHub Action run triggered by the PR merge using the commit SHA
-        latest_run = get_run_id_for_commit(repo, token, merge_commit_sha, "Cluster.dev")
-        if latest_run:
-            st.session_state.latest_run_url = latest_run['html_url']
-            st.session_state.latest_run_id = re.search(r'/runs/(\d+)/job', latest_run['html_url']).group(1)
-        else:
+    st.session_state.merge_job = submit_job("merge", merge_and_find_run, repo, pr_id, token)
+
+@metrics.timed("fragment", fragment="background_jobs")
+def show_background_jobs(repo, token, polling):
+    merge_job = st.session_state.merge_job
+    if merge_job is not None:
+        if not merge_job.done():
+            st.info(f"{merge_job.message} ({int(merge_job.elapsed)}s)")
+            return
+        if polling:
+            # Re-run the whole page once so the fragment stops auto-refreshing.
+            st.rerun()
+        st.session_state.merge_job = None
+        try:
+            success, message, latest_run = merge_job.result()
+        except Exception as e:
+            success, message, latest_run = False, f"Failed to merge PR: {e}", None
+        if success:
+            st.session_state.pr_merged = True
+            if latest_run:
+                st.session_state.latest_run_url = latest_run['html_url']
+                st.session_state.latest_run_id = api.plan_run_id({'url': latest_run['html_url']})
+                st.session_state.latest_job_id = latest_run['id']
+                st.rerun()
+            st.success(message)
             st.warning("Unable to fetch the latest GitHub Action run.")
+        else:
+            st.error(message)
+
+    watch_job = st.session_state.watch_job
+    if watch_job is None:
+        return
+    if not watch_job.done():
+        st.progress(watch_job.progress, text=f"Executing Workflow ({int(watch_job.elapsed)}s)")
+        return
+    if polling:
+        st.rerun()
+
+    try:
+        job_statuses = watch_job.result()
+    except Exception as e:
+        st.error(f"Failed to fetch workflow status: {e}")
+        return
+    if not job_statuses:
+        st.warning("No job statuses returned.")
+        return
+    all_successful = all(job['status'] in ['success', 'skipped'] for job in job_statuses)
+    # Display the workflow status
+    if all_successful:
+        for job in job_statuses:
+            if job['name'] == 'plan':
+                st.success(f"All checks have passed for [Plan job]({job['url']})! Now you can review the plan and merge the PR to bootstrap the cluster.")
+                show_plan_summary(api.stored_plan_summary(repo, api.plan_run_id(job)))
+        # If PR is not yet merged, show the button
+        if not st.session_state.pr_merged and st.session_state.merge_job is None:
+            st.button(
+                "Merge PR",
+                on_click=merge_and_fetch_latest_run,
+                args=(repo, st.session_state.pr_url.split('/')[-1], token)
+            )
     else:
-        st.error(message)
+        for job in job_statuses:
+            if job['status'] == 'failure':
+                st.error(f"Check failed for [job {job['name']}]({job['url']}).")
+
+def show_plan_summary(summary):
+    if summary is None:
+        st.warning("Unable to download the plan log for a summary.")
+        return
+    totals = summary['totals']
+    if not any(totals[action] for action in ("add", "change", "destroy", "replace")):
+        st.info("The plan has no resource changes.")
+        return
+    st.write(f"Plan: {totals['add']} to add, {totals['change']} to change, {totals['destroy']} to destroy, "
+             f"{totals['replace']} to replace.")
+    st.dataframe([{"unit": unit, **{action: counts[action] for action in ("add", "change", "destroy", "replace")}}
+                  for unit, counts in summary['units'].items() if any(counts.values())], hide_index=True)
+    for unit, address, label, action in summary['callouts']:
+        verb = "replaces" if action == "replace" else "destroys"
+        st.warning(f"Unit {unit} {verb} the {label} `{address}`.")
+
+def profile_and_record(job, repo, run_id, token, label):
+    job.set_progress(0, "Reading the apply log")
+    return api.profile_and_record(repo, run_id, token, label=label)
+
+def show_apply_timings(repo, graph):
+    store = TimingStore()
+    stats = store.percentiles(repo)
+    if not stats:
+        st.info("No apply timings recorded for this repository yet.")
+        return
+    st.dataframe([{"unit": unit, **row} for unit, row in sorted(stats.items(), key=lambda item: -item[1]["p50"])],
+                 hide_index=True)
+    history = store.history(repo)
+    if len(history) > 1:
+        st.caption("Minutes per unit, last runs")
+        st.line_chart([{unit: round(seconds / 60, 1) for unit, seconds in units.items()} for _, _, _, units in history])
+    slowest = store.slowest_resources(repo, top=10)
+    if slowest:
+        st.caption("Slowest resources (median)")
+        st.dataframe([{"unit": unit, "resource": address, "action": action, "median_s": seconds, "runs": runs}
+                      for unit, address, action, seconds, runs in slowest], hide_index=True)
+    if graph is not None:
+        measured = {unit: row["p50"] for unit, row in stats.items()}
+        plan = schedule(graph, measured)
+        st.write(f"Critical path at the median: {' → '.join(plan['critical_path'])}, about {plan['total'] / 60:.0f} min.")
+
+@metrics.timed("fragment", fragment="apply_logs")
+def show_apply_logs(polling):
+    tail = st.session_state.log_tail
+    if polling:
+        tail.poll()
+    if tail.completed:
+        status = f"Apply job finished: {tail.conclusion}"
+    else:
+        status = "Apply job running..."
+    st.caption(f"{status} (last {LOG_TAIL_LINES} lines)")
+    st.code(tail.text() or "Waiting for log output...", language="log")
+    if polling and tail.completed:
+        api.record_apply_result(tail.repo, st.session_state.latest_run_id, tail.conclusion, tail.lines)
+        st.rerun()
+
+def show_diagnostics(server):
+    # Where this process spends its time: GitHub, rate-limit waits, watcher sleeps or reruns
+    snapshot = metrics.snapshot()
+    spent = {}
+    for row in snapshot["spans"]:
+        spent[row["name"]] = spent.get(row["name"], 0.0) + row["sum"]
+    counters = {}
+    for row in snapshot["counters"]:
+        counters[row["name"]] = counters.get(row["name"], 0) + row["value"]
+    st.caption(f"This server process, last {snapshot['uptime'] / 60:.0f} min.")
+    st.dataframe([{"where": label, "seconds": round(spent.get(name, 0.0), 2)} for name, label in DIAGNOSTIC_SPANS],
+                 hide_index=True)
+    st.write(f"{counters.get('github_requests', 0)} API calls, {counters.get('github_response_bytes', 0) / 1024:.0f} KiB, "
+             f"{counters.get('github_not_modified', 0)} 304s, {counters.get('github_retries', 0)} retries, "
+             f"{counters.get('github_rate_limited', 0)} rate limited.")
+    st.dataframe([{"span": row["name"], "labels": ", ".join(f"{k}={v}" for k, v in row["labels"].items()),
+                   "count": row["count"], "total_s": round(row["sum"], 2),
+                   **{f"{p}_ms": round(row[p] * 1000, 1) for p in ("p50", "p90", "p99")}}
+                  for row in sorted(snapshot["spans"], key=lambda row: -row["sum"])[:DIAGNOSTIC_ROWS]],
+                 hide_index=True)
+    if server is not None:
+        st.caption(f"Prometheus: http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    st.download_button("Download metrics (JSON)", json.dumps(snapshot), file_name="cdev-metrics.json",
+                       mime="application/json")
+
+# Pick up a bootstrap of this configuration started by another session, or by this one before a reload
+if 'resumed_for' not in st.session_state:
+    st.session_state.resumed_for = None
+fingerprint = render_fingerprint(render_files(project, stack))
+if (repo and token and st.session_state.resumed_for != (repo, fingerprint)
+        and not st.session_state.pr_url and st.session_state.watch_job is None):
+    st.session_state.resumed_for = (repo, fingerprint)
+    resume_bootstrap(api.resume(repo, fingerprint), repo, token)
 
 if st.session_state.pr_merged and st.session_state.latest_run_url:
     st.success(f"EKS bootstaping triggered: [View Action]({st.session_state.latest_run_url})")
-    #logs = fetch_run_logs(repo, st.session_state.latest_run_id, token)
-    #if logs:
-    #    st.text_area("Logs:", value=logs, height=400)
-    #else:
-    #    st.error("Failed to fetch logs.")
+    if st.session_state.log_tail is None and st.session_state.latest_job_id:
+        st.session_state.log_tail = LogTail(repo, st.session_state.latest_job_id, token, max_lines=LOG_TAIL_LINES)
+    if st.session_state.log_tail is not None:
+        polling = not st.session_state.log_tail.completed
+        st.fragment(show_apply_logs, run_every=3 if polling else None)(polling)
+        if not polling and st.session_state.profile_job is None and st.session_state.latest_run_id:
+            label = fingerprint[:12]
+            st.session_state.profile_job = submit_job("profile", profile_and_record, repo,
+                                                      st.session_state.latest_run_id, token, label)
 else:
     # Add a button in Streamlit to trigger the push
-    if st.button('Push Configuration to GitHub'):
+    if st.button('Push Configuration to GitHub', disabled=bool(config_errors), help="Fix the configuration errors above first" if config_errors else None):
         if repo and token:
-            base_branch = "main"
-            new_branch_name = f"cluster.dev-{uuid.uuid4().hex[:8]}"
-            project = yaml.safe_load(project_yaml_content)
-            subdirectory = ".cluster.dev/"+project["name"]
-            workflow_path = ".github/workflows/clusterdev-"+project["name"]+".yaml"
-
-            files_to_commit = {
-                f"{subdirectory}/project.yaml": project_yaml_content,
-                f"{subdirectory}/backend.yaml": backend_yaml_content,
-                f"{subdirectory}/stack_eks.yaml": stack_eks_yaml_content,
-                workflow_path: workflow_file_content
-            }
-
-            # Create a new branch
-            branch_success, branch_error_response = create_branch(repo, new_branch_name, base_branch, token)
-            if not branch_success:
-                if branch_error_response and "message" in branch_error_response:
-                    st.error(f"Failed to create branch. GitHub says: {branch_error_response['message']}")
-                else:
-                    st.error("Failed to create branch.")
-            else:
-                # Push the files to the new branch
-                push_success, push_error_response = push_multiple_files_to_github(files_to_commit, repo, new_branch_name, token)
-
-                if push_success:
-                    # Create a pull request
-                    pr_url = create_pull_request(repo, new_branch_name, base_branch, token)
-                    if pr_url:
-                        st.success(f"Files pushed successfully! [Check Pull Request]({pr_url})")
-
-                        # Create a progress bar in Streamlit
-                        progress_bar = st.progress(0,text="Executing Workflow")
-
-                        # Define a callback to update the progress bar
-                        def update_progress(progress):
-                            progress_bar.progress(progress)
-
-                        job_statuses = get_workflow_status(repo, token, new_branch_name, timeout=60, callback=update_progress)
-                        # Check the workflow status with the callback
-                        if job_statuses:
-                            all_successful = all(job['status'] in ['success', 'skipped'] for job in job_statuses)
-                        else:
-                            st.warning("No job statuses returned.")
-                            exit
-                        # Clear the progress bar once done
-                        progress_bar.empty()
-                        # Display the workflow status
-                        if all_successful:
-                            for job in job_statuses:
-                                if job['name'] == 'plan':
-                                    st.success(f"All checks have passed for [Plan job]({job['url']})! Now you can review the plan and merge the PR to bootstrap the cluster.")
-                            # If PR is not yet merged, show the button
-                            if not st.session_state.pr_merged:
-                                merge_button = st.button(
-                                    "Merge PR",
-                                    on_click=merge_and_fetch_latest_run,
-                                    args=(repo, pr_url.split('/')[-1], token)
-                                )
-                        else:
-                            for job in job_statuses:
-                                if job['status'] == 'failure':
-                                    st.error(f"Check failed for [job {job['name']}]({job['url']}).")
+            result = api.push_configuration(repo, token, project, stack)
+            if result["status"] in ("unchanged", "reused"):
+                st.info(result["message"])
+            elif result["status"] == "failed":
+                st.error(result["message"])
+            if result["resumed_from"]:
+                st.caption(f"Continued after the {PIPELINE_STAGES[result['resumed_from']]} of an earlier push.")
+            if result["commit"]:
+                st.session_state.commit_report = result["commit"]
+            if result["pr_url"]:
+                st.session_state.pr_url = result["pr_url"]
+                if result["jobs"]:
+                    # The plan run already finished; its outcome comes from the checkpoint
+                    st.session_state.watch_job = completed_job("watch", result["jobs"])
                 else:
-                    if push_error_response and "message" in push_error_response:
-                        st.error(f"Failed to push files. GitHub says: {push_error_response['message']}")
-                    else:
-                        st.error("Failed to push files.")
+                    # Follow the plan run in the background; the page refreshes itself meanwhile
+                    st.session_state.watch_job = submit_job("watch", watch_workflow, repo, token, result["branch"])
         else:
             st.warning("Please provide both repository and token.")
 
-
+    if st.session_state.pr_url:
+        st.success(f"Files pushed successfully! [Check Pull Request]({st.session_state.pr_url})")
+    commit = st.session_state.commit_report
+    if commit is not None:
+        st.caption(f"Commit {(commit['sha'] or '')[:7]} via {COMMIT_PATHS[commit['path']]}, {commit['calls']} API calls.")
+
+    polling = any(job is not None and not job.done() for job in (st.session_state.watch_job, st.session_state.merge_job))
+    st.fragment(show_background_jobs, run_every=2 if polling else None)(repo, token, polling)
+
+if repo:
+    with st.expander("Apply timings"):
+        profile_job = st.session_state.profile_job
+        if profile_job is not None and not profile_job.done():
+            st.caption(f"{profile_job.message} ({int(profile_job.elapsed)}s)")
+        try:
+            unit_graph = parse_units(preview.text) if preview is not None else None
+        except ValueError:
+            unit_graph = None
+        show_apply_timings(repo, unit_graph)
+
+with st.sidebar.expander("Diagnostics"):
+    show_diagnostics(metrics_server)
+metrics.observe("streamlit_rerun", time.perf_counter() - rerun_started)
@@ -0,0 +1,169 @@
+"""Pod IP and private subnet capacity of the EKS node group.
+
+The private subnets and the vpc-cni settings (ENABLE_PREFIX_DELEGATION,
+WARM_PREFIX_TARGET) are read from template.yaml itself by expanding it
+offline, once per region. For every instance type the catalog's ENI limits
+give the max pods per node and the worst-case subnet use of a full node: with
+prefix delegation every pod slot comes from /28 prefixes plus the warm ones,
+and every attached ENI takes one more address that can break up a /28 block.
+Subnet capacity is then plain array arithmetic, so a whole fleet checks in
+milliseconds.
+"""
+import ipaddress
+import json
+from functools import lru_cache
+
+import numpy as np
+import yaml
+
+from models import ProjectConfig, StackConfig, render_stack_eks_yaml
+from planner import load_catalog
+import template_renderer
+
+AWS_RESERVED_IPS = 5  # network, router, DNS, future use and broadcast addresses in every subnet
+PREFIX_SIZE = 16  # a /28 prefix
+# kubelet max pods for prefix delegation, as in the EKS max-pods calculator
+MAX_PODS_CAP = 110
+MAX_PODS_CAP_LARGE = 250
+LARGE_VCPU = 30
+HOST_NETWORK_PODS = 2  # aws-node and kube-proxy run without a pod IP
+
+
+@lru_cache(maxsize=64)
+def template_network(region):
+    """(private subnet CIDRs, prefix delegation, warm prefix target) of the VPC template.yaml creates in region."""
+    project, stack = ProjectConfig(region=region), StackConfig()
+    expanded = template_renderer.render_stack(render_stack_eks_yaml(project, stack), project.to_dict(),
+                                              template_renderer.REPO_ROOT)
+    units = {unit["name"]: unit for unit in yaml.safe_load(expanded.text)["units"]}
+    cni = units["eks"]["inputs"]["cluster_addons"].get("vpc-cni", {})
+    env = json.loads(cni.get("configuration_values") or "{}").get("env", {})
+    return (tuple(units["vpc"]["inputs"]["private_subnets"]),
+            env.get("ENABLE_PREFIX_DELEGATION") == "true",
+            int(env.get("WARM_PREFIX_TARGET", 0)))
+
+
+@lru_cache(maxsize=8)
+def type_limits(prefix_delegation=True, warm_prefixes=1):
+    """Per catalog type: max pods, and the addresses and /28 blocks one full node takes from its subnet."""
+    catalog = load_catalog()
+    enis, per_eni = catalog.max_enis, catalog.ipv4_per_eni
+    slots = enis * (per_eni - 1)  # secondary address (or prefix) slots over all ENIs
+    if prefix_delegation:
+        cap = np.where(catalog.vcpu < LARGE_VCPU, MAX_PODS_CAP, MAX_PODS_CAP_LARGE)
+        max_pods = np.minimum(slots * PREFIX_SIZE + HOST_NETWORK_PODS, cap)
+        prefixes = np.minimum(-(-(max_pods - HOST_NETWORK_PODS) // PREFIX_SIZE) + warm_prefixes, slots)
+        enis_used = -(-prefixes // (per_eni - 1))
+        addresses = enis_used + prefixes * PREFIX_SIZE
+    else:
+        max_pods = slots + HOST_NETWORK_PODS
+        prefixes = np.zeros_like(slots)
+        enis_used = enis
+        addresses = enis * per_eni  # without prefixes every attached ENI fills all its addresses
+    return {"max_pods": max_pods, "prefixes": prefixes, "enis": enis_used, "addresses": addresses}
+
+
+def subnet_capacity(prefixlen, prefixes, enis, addresses, prefix_delegation=True):
+    """How many full nodes fit in subnets of these prefix lengths (all arguments broadcast)."""
+    size = 2 ** (32 - np.asarray(prefixlen))
+    if prefix_delegation:
+        # Prefixes need whole aligned /28 blocks. The first and last block hold the reserved
+        # addresses, and in the worst case every ENI address lands in a block of its own.
+        blocks = size // PREFIX_SIZE - 2
+        return np.maximum(blocks // np.maximum(prefixes + enis, 1), 0)
+    return np.maximum((size - AWS_RESERVED_IPS) // np.maximum(addresses, 1), 0)
+
+
+def _node_cost(limits, prefix_delegation):
+    # What one full node takes from the subnet: /28 blocks (plus ENI addresses) or single addresses
+    return limits["prefixes"] + limits["enis"] if prefix_delegation else limits["addresses"]
+
+
+def _nodes_per_subnet(max_size, subnets):
+    # Balanced across all subnets, and squeezed into the rest when one AZ is down
+    balanced = -(-max_size // np.maximum(subnets, 1))
+    az_down = -(-max_size // np.maximum(subnets - 1, 1))
+    return balanced, az_down
+
+
+def check_stack(project, stack, private_cidrs=None):
+    """Capacity report for one stack; None if the private subnet CIDRs are unknown (existing VPC)."""
+    template_cidrs, prefix_delegation, warm_prefixes = template_network(project.region)
+    cidrs = private_cidrs if stack.vpc_id is not None else template_cidrs
+    if not cidrs:
+        return None
+    catalog = load_catalog()
+    limits = type_limits(prefix_delegation, warm_prefixes)
+    index = catalog.index(stack.instance_types)
+    if not len(index):
+        return None
+    # Any of the group's types may be launched: count on the fewest pods and the hungriest node
+    worst = index[np.argmax(_node_cost(limits, prefix_delegation)[index])]
+    networks = [ipaddress.ip_network(cidr, strict=False) for cidr in cidrs]
+    prefixlen = np.array([network.prefixlen for network in networks])
+    capacity = subnet_capacity(prefixlen, limits["prefixes"][worst], limits["enis"][worst],
+                               limits["addresses"][worst], prefix_delegation)
+    balanced, az_down = _nodes_per_subnet(stack.max_size, len(networks))
+    per_node = limits["addresses"][worst]
+    return {
+        "prefix_delegation": prefix_delegation,
+        "warm_prefixes": warm_prefixes,
+        "max_pods": {catalog.types[i]: int(limits["max_pods"][i]) for i in index},
+        "addresses_per_node": int(per_node),
+        "subnets": [{
+            "subnet": str(network),
+            "usable_ips": int(network.num_addresses - AWS_RESERVED_IPS),
+            "max_nodes": int(capacity[i]),
+            "nodes": int(balanced),
+            "nodes_one_az_down": int(az_down),
+            "ips_at_max_size": int(balanced * per_node),
+        } for i, network in enumerate(networks)],
+        "exhausted": bool((balanced > capacity).any()),
+        "exhausted_one_az_down": bool((az_down > capacity).any()),
+    }
+
+
+def check_fleet(clusters):
+    """Check [(ProjectConfig, StackConfig), ...] in one vectorized pass over clusters.
+
+    Returns {project name: message} for clusters whose private subnets run
+    out of addresses at max_size. Clusters in an existing VPC are skipped,
+    their subnet sizes are not known offline.
+    """
+    clusters = [(project, stack) for project, stack in clusters if stack.vpc_id is None]
+    if not clusters:
+        return {}
+    catalog = load_catalog()
+    regions = sorted({project.region for project, _ in clusters})
+    networks = {region: template_network(region) for region in regions}
+    # Per region: subnet count and the smallest subnet, then spread over clusters by region index
+    region_of = np.array([regions.index(project.region) for project, _ in clusters]) if len(regions) > 1 else 0
+    subnets = np.array([len(networks[region][0]) for region in regions])[region_of]
+    prefixlen = np.array([max(ipaddress.ip_network(c).prefixlen for c in networks[region][0])
+                          for region in regions])[region_of]
+    settings = {(pd, warm) for _, pd, warm in networks.values()}
+    if len(settings) > 1:
+        raise ValueError("vpc-cni settings differ between regions; check the clusters one by one")
+    prefix_delegation, warm_prefixes = settings.pop()
+    limits = type_limits(prefix_delegation, warm_prefixes)
+
+    # (clusters x types) membership, then the hungriest type each cluster may launch
+    positions = {name: i for i, name in enumerate(catalog.types)}
+    mask = np.zeros((len(clusters), len(catalog.types)), dtype=bool)
+    for row, (_, stack) in enumerate(clusters):
+        mask[row, [positions[t] for t in stack.instance_types if t in positions]] = True
+    cost = np.where(mask, _node_cost(limits, prefix_delegation), -1)
+    worst = cost.argmax(axis=1)
+    known = mask.any(axis=1)
+
+    capacity = subnet_capacity(prefixlen, limits["prefixes"][worst], limits["enis"][worst],
+                               limits["addresses"][worst], prefix_delegation)
+    max_size = np.array([stack.max_size for _, stack in clusters])
+    balanced, az_down = _nodes_per_subnet(max_size, subnets)
+    report = {}
+    for row in np.flatnonzero(known & (az_down > capacity)):
+        project, _ = clusters[row]
+        needed, when = (balanced[row], "at max_size") if balanced[row] > capacity[row] else (az_down[row], "with one AZ down")
+        report[project.name] = (f"private subnets fit {capacity[row]} {catalog.types[worst[row]]} nodes each, "
+                                f"{needed} needed {when}")
+    return report
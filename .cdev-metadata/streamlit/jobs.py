@@ -0,0 +1,88 @@
+"""Background jobs for long GitHub operations started from the Streamlit app.
+
+Watching a workflow or merging a PR can take many minutes. Running them in
+the script thread would freeze the session's worker for that time, so they
+run on a process-wide thread pool instead. The Job handle lives in
+st.session_state and the page polls it for progress.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_WORKERS = int(os.environ.get("CDEV_JOB_WORKERS", "32"))
+
+_executor = None
+_executor_lock = threading.Lock()
+# Jobs waiting for a worker and jobs on one, for pool_stats()
+_pool = {"queued": 0, "running": 0}
+_pool_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="cdev-job")
+        return _executor
+
+
+class Job:
+
+    def __init__(self, name):
+        self.name = name
+        self.progress = 0.0
+        self.message = ""
+        self.started = time.time()
+        self._future = None
+
+    def set_progress(self, progress, message=None):
+        self.progress = max(0.0, min(float(progress), 1.0))
+        if message is not None:
+            self.message = message
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def done(self):
+        return self._future.done()
+
+    def result(self):
+        """Return the job's result; re-raises whatever the job raised."""
+        return self._future.result()
+
+
+def _run(fn, job, *args, **kwargs):
+    with _pool_lock:
+        _pool["queued"] -= 1
+        _pool["running"] += 1
+    try:
+        return fn(job, *args, **kwargs)
+    finally:
+        with _pool_lock:
+            _pool["running"] -= 1
+
+
+def submit_job(name, fn, *args, **kwargs):
+    """Run fn(job, *args, **kwargs) in the background and return the Job handle."""
+    job = Job(name)
+    with _pool_lock:
+        _pool["queued"] += 1
+    job._future = _get_executor().submit(_run, fn, job, *args, **kwargs)
+    return job
+
+
+def pool_stats():
+    """{"workers", "running", "queued"} of the shared job pool; running == workers means it is saturated."""
+    with _pool_lock:
+        return {"workers": MAX_WORKERS, **_pool}
+
+
+def completed_job(name, result):
+    """A Job that is already done with result, for steps restored instead of run again."""
+    job = Job(name)
+    job.set_progress(1)
+    job._future = Future()
+    job._future.set_result(result)
+    return job
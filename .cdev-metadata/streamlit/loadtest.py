@@ -0,0 +1,259 @@
+"""Load test: many engineers using the configurator on one server at once.
+
+Every simulated session is a Streamlit AppTest of interface.py, driven like a
+user would: first load, fill in the project name, repository and token,
+push, then rerun every --poll seconds until the plan finished and Merge PR
+shows up. The sessions run concurrently in this process and share what
+the sessions of a real server share: imported modules, render caches, the
+GitHub client and the background job pool. The GitHub API is fake_github in
+a child process (its runs finish on their own after --run-duration), so
+its CPU and memory stay out of the numbers.
+
+AppTest is not thread-safe: each run swaps Streamlit's global Runtime. Script
+runs therefore take turns on one lock, like script threads on a GIL-bound
+server, while the background jobs (watching runs) and their GitHub I/O run
+concurrently. A rerun's latency is its wait for the lock plus its run. The
+share of time the lock is held is how busy the script runner is. Pushes do
+their GitHub calls inside the script run, so they are measured a little
+pessimistically.
+
+Reported:
+- rerun latency per phase (load, edit, push, watch): p50/p90/p99/max;
+- the script runner: share of time busy, and the p50/p99 wait for it;
+- process CPU per rerun;
+- memory: RSS after a warm-up session, peak RSS, and the growth per session;
+- the job pool (jobs.pool_stats): peak running and queued jobs and the share
+  of samples with every worker busy;
+- sessions that failed or timed out, and the API calls the fake answered.
+
+    python loadtest.py --sessions 10
+    python loadtest.py --sessions 40 --ramp 10 --run-duration 5 30 --json load-40.json
+
+Run the same command before and after a change to compare; --json keeps the
+whole result, including the raw percentiles, for that.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "interface.py")
+PHASES = ("load", "edit", "push", "watch")
+SAMPLE_INTERVAL = 0.1  # seconds between RSS/job pool samples
+
+_script_lock = threading.Lock()
+
+
+def _rss_kib():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # the peak, in KiB on Linux
+
+
+def _percentile(values, q):
+    # Nearest rank; exact enough for a few hundred reruns and defined for one
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+
+class _Sampler:
+    """Samples RSS and the job pool in the background while sessions run."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="loadtest-sampler")
+
+    def _run(self):
+        from jobs import pool_stats
+
+        while not self._stop.wait(self.interval):
+            self.samples.append((_rss_kib(), pool_stats()))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _rerun(at, phase, reruns):
+    # reruns gets (phase, seconds until the run finished, seconds it ran)
+    queued = time.perf_counter()
+    with _script_lock:
+        start = time.perf_counter()
+        at.run()
+        done = time.perf_counter()
+    reruns.append((phase, done - queued, done - start))
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def drive_session(index, repo, reruns, poll=1.0, watch_timeout=120.0, timeout=60.0):
+    """One user's load -> edit -> push -> watch; returns the seconds it took. Raises on failure."""
+    from streamlit.testing.v1 import AppTest
+
+    start = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    _rerun(at, "load", reruns)
+    for widget in at.text_input:
+        if widget.label == "Name":
+            # A project of its own, so every session renders and pushes something different
+            widget.set_value(f"load-{index}")
+        elif widget.label.startswith("GitHub Repository"):
+            widget.set_value(repo)
+        elif widget.label.startswith("GitHub Token"):
+            widget.set_value("loadtest-token")
+    _rerun(at, "edit", reruns)
+    next(button for button in at.button if button.label.startswith("Push")).click()
+    _rerun(at, "push", reruns)
+    if not at.session_state.pr_url:
+        raise RuntimeError("; ".join(error.value for error in at.error) or "push opened no pull request")
+    deadline = time.time() + watch_timeout
+    while not any(button.label == "Merge PR" for button in at.button):
+        if at.error:
+            raise RuntimeError("; ".join(error.value for error in at.error))
+        if time.time() > deadline:
+            raise TimeoutError(f"the plan did not finish within {watch_timeout:.0f}s")
+        time.sleep(poll)
+        _rerun(at, "watch", reruns)
+    return time.perf_counter() - start
+
+
+def run_load(sessions=10, ramp=0.0, run_duration=(1.0, 3.0), latency=0.02, poll=1.0, watch_timeout=120.0):
+    """Drive sessions concurrently against a fake GitHub; returns the report (see the module docstring)."""
+    from fake_github import start_subprocess
+
+    url, fake = start_subprocess(latency=latency, run_duration=run_duration)
+    state_dir = tempfile.mkdtemp(prefix="cdev-loadtest-")
+    # Read when the app's modules are first imported, which is in the warm-up session below
+    os.environ["GITHUB_API_URL"] = url
+    os.environ["CDEV_RUN_STATE_DB"] = os.path.join(state_dir, "run_state.sqlite3")
+    os.environ["CDEV_TIMINGS_DB"] = os.path.join(state_dir, "timings.sqlite3")
+    os.environ.setdefault("CDEV_POLL_INITIAL", "0.5")
+    os.environ.setdefault("CDEV_POLL_MAXIMUM", "2")
+    try:
+        from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+        from streamlit.testing.v1 import AppTest, app_test
+
+        # A server compiles the script once for all sessions; AppTest would compile it again on every rerun
+        shared_script_cache = ScriptCache()
+        app_test.ScriptCache = lambda: shared_script_cache
+        # Imports and first-render caches are paid once per server, not per session
+        AppTest.from_file(APP_PATH, default_timeout=60).run()
+        baseline_kib = _rss_kib()
+
+        reruns = []
+        outcomes = [None] * sessions
+
+        def session(index):
+            try:
+                outcomes[index] = ("ok", drive_session(index, "octo/cluster", reruns, poll, watch_timeout))
+            except Exception as e:
+                outcomes[index] = ("failed", f"{type(e).__name__}: {e}")
+
+        threads = [threading.Thread(target=session, args=(i,), name=f"loadtest-session-{i}") for i in range(sessions)]
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        with _Sampler() as sampler:
+            for i, thread in enumerate(threads):
+                thread.start()
+                if ramp and i < sessions - 1:
+                    time.sleep(ramp / (sessions - 1))
+            for thread in threads:
+                thread.join()
+        cpu_s, wall_s = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        with urllib.request.urlopen(f"{url}/_fake/stats") as r:
+            api = json.load(r)
+    finally:
+        fake.terminate()
+
+    latency_ms = {}
+    for phase in (*PHASES, "all"):
+        values = [seconds * 1000 for name, seconds, _ in reruns if phase in (name, "all")]
+        if values:
+            latency_ms[phase] = {"reruns": len(values),
+                                 **{f"p{q}": round(_percentile(values, q / 100), 1) for q in (50, 90, 99)},
+                                 "max": round(max(values), 1)}
+    waits = [(total - ran) * 1000 for _, total, ran in reruns]
+    pools = [pool for _, pool in sampler.samples]
+    peak_kib = max([baseline_kib] + [rss for rss, _ in sampler.samples])
+    finished = [outcome[1] for outcome in outcomes if outcome and outcome[0] == "ok"]
+    return {
+        "sessions": sessions,
+        "ok": len(finished),
+        "failures": [outcome[1] for outcome in outcomes if outcome and outcome[0] != "ok"],
+        "session_s": {"p50": round(statistics.median(finished), 2), "max": round(max(finished), 2)} if finished else {},
+        "rerun_ms": latency_ms,
+        "script_runner": {"busy": round(sum(ran for _, _, ran in reruns) / wall_s, 2),
+                          "wait_p50_ms": round(_percentile(waits, 0.5), 1) if waits else None,
+                          "wait_p99_ms": round(_percentile(waits, 0.99), 1) if waits else None},
+        "cpu_ms_per_rerun": round(cpu_s * 1000 / len(reruns), 1) if reruns else None,
+        "cpu_utilization": round(cpu_s / wall_s, 2),
+        "memory_mib": {"baseline": round(baseline_kib / 1024, 1), "peak": round(peak_kib / 1024, 1),
+                       "per_session": round((peak_kib - baseline_kib) / 1024 / sessions, 2)},
+        "job_pool": {"workers": pools[0]["workers"] if pools else None,
+                     "peak_running": max((pool["running"] for pool in pools), default=0),
+                     "peak_queued": max((pool["queued"] for pool in pools), default=0),
+                     "saturated": round(sum(pool["running"] >= pool["workers"] for pool in pools) / len(pools), 3)
+                     if pools else 0.0},
+        "api_calls": api["calls"],
+        "wall_s": round(wall_s, 2),
+    }
+
+
+def print_report(report):
+    print(f"{report['ok']} of {report['sessions']} sessions reached Merge PR in {report['wall_s']}s"
+          + (f", session p50 {report['session_s']['p50']}s, max {report['session_s']['max']}s"
+             if report["session_s"] else ""))
+    for failure in report["failures"]:
+        print(f"  failed: {failure}")
+    columns = ("reruns", "p50", "p90", "p99", "max")
+    print(f"{'rerun ms':10}" + "".join(f"{c:>10}" for c in columns))
+    for phase, row in report["rerun_ms"].items():
+        print(f"{phase:10}" + "".join(f"{row[c]:>10}" for c in columns))
+    memory, pool, runner = report["memory_mib"], report["job_pool"], report["script_runner"]
+    print(f"Script runner busy {runner['busy']:.0%} of the time, wait p50 {runner['wait_p50_ms']} ms, "
+          f"p99 {runner['wait_p99_ms']} ms")
+    print(f"CPU {report['cpu_ms_per_rerun']} ms per rerun, {report['cpu_utilization']:.0%} of one core")
+    print(f"Memory {memory['baseline']} MiB after warm-up, peak {memory['peak']} MiB, "
+          f"{memory['per_session']} MiB per session")
+    print(f"Job pool: peak {pool['peak_running']} of {pool['workers']} workers busy, {pool['peak_queued']} queued, "
+          f"saturated {pool['saturated']:.0%} of the time")
+    print(f"{report['api_calls']} GitHub API calls")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which the sessions start")
+    parser.add_argument("--run-duration", type=float, nargs=2, default=(1.0, 3.0), metavar=("QUEUED", "RUNNING"),
+                        help="seconds a fake workflow run stays queued and then in progress")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency per request, seconds")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between reruns while watching")
+    parser.add_argument("--watch-timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = run_load(args.sessions, args.ramp, tuple(args.run_duration), args.latency, args.poll, args.watch_timeout)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Memory-bounded access to GitHub Actions logs.
+
+Run log archives are spooled to a temporary file and read member by member,
+so a full EKS apply log never sits in memory at once. While a job is still
+running, LogTail follows its plain-text log through the jobs logs endpoint
+and only keeps the last max_lines lines.
+"""
+import fnmatch
+import io
+import tempfile
+import zipfile
+from collections import deque
+from contextlib import contextmanager
+
+from github_utils import get_client
+from metrics import timed
+from ratelimit import BACKGROUND
+
+# Step logs inside the run archive, e.g. apply/4_Run ClusterDev Apply.txt
+APPLY_LOG_PATTERN = "apply/*Run*ClusterDev*Apply.txt"
+PLAN_LOG_PATTERN = "plan/*Run*ClusterDev*Plan.txt"
+CHUNK_SIZE = 64 * 1024
+
+
+@contextmanager
+def spooled_run_logs(repo, run_id, token):
+    """Download the run's log archive to a temporary file and yield an open ZipFile (None if unavailable)."""
+    response = get_client(token).get(f"repos/{repo}/actions/runs/{run_id}/logs", stream=True)
+    if response.status_code != 200:
+        print(f"Failed to download logs for run {run_id}. Status code: {response.status_code}")
+        response.close()
+        yield None
+        return
+    with tempfile.TemporaryFile(prefix="cdev-run-logs-") as spool:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            spool.write(chunk)
+        response.close()
+        spool.seek(0)
+        if not zipfile.is_zipfile(spool):
+            yield None
+            return
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            yield archive
+
+
+def iter_log_members(archive, pattern="*"):
+    """Yield ZipInfo entries whose name matches the glob pattern, in archive order."""
+    for info in archive.infolist():
+        if not info.is_dir() and fnmatch.fnmatch(info.filename, pattern):
+            yield info
+
+
+def iter_log_lines(archive, pattern="*"):
+    """Yield (member name, line) for every line of every matching member, one line at a time."""
+    for info in iter_log_members(archive, pattern):
+        with archive.open(info) as raw:
+            for line in io.TextIOWrapper(raw, encoding="utf-8", errors="replace"):
+                yield info.filename, line.rstrip("\n")
+
+
+def read_run_logs(repo, run_id, token, pattern=APPLY_LOG_PATTERN, max_lines=None):
+    """Return the matching step logs of a finished run as text, keeping only the last max_lines lines."""
+    with spooled_run_logs(repo, run_id, token) as archive:
+        if archive is None:
+            return None
+        lines = deque((line for _, line in iter_log_lines(archive, pattern)), maxlen=max_lines)
+    return "\n".join(lines)
+
+
+class LogTail:
+    """Follow a running job's log incrementally, holding at most max_lines lines."""
+
+    def __init__(self, repo, job_id, token, max_lines=500):
+        self.repo = repo
+        self.job_id = job_id
+        self.client = get_client(token)
+        self.lines = deque(maxlen=max_lines)
+        self.offset = 0
+        self.completed = False
+        self.conclusion = None
+        self._partial = b""
+
+    @timed("log_tail_poll")
+    def poll(self):
+        """Fetch whatever was appended since the last poll; returns the number of new lines."""
+        if not self.completed:
+            r = self.client.get(f"repos/{self.repo}/actions/jobs/{self.job_id}", priority=BACKGROUND)
+            if r.status_code == 200:
+                job = r.json()
+                self.completed = job.get("status") == "completed"
+                self.conclusion = job.get("conclusion")
+
+        headers = {"Range": f"bytes={self.offset}-"} if self.offset else {}
+        r = self.client.get(f"repos/{self.repo}/actions/jobs/{self.job_id}/logs", headers=headers, stream=True,
+                            priority=BACKGROUND)
+        if r.status_code not in (200, 206):
+            r.close()
+            return 0
+        # Servers that ignore Range send everything again; skip what we already have.
+        skip = self.offset if r.status_code == 200 else 0
+        added = 0
+        for chunk in r.iter_content(CHUNK_SIZE):
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk, skip = chunk[dropped:], skip - dropped
+            if not chunk:
+                continue
+            self.offset += len(chunk)
+            *complete, self._partial = (self._partial + chunk).split(b"\n")
+            for line in complete:
+                self.lines.append(line.decode("utf-8", errors="replace").rstrip("\r"))
+                added += 1
+        r.close()
+        if self.completed and self._partial:
+            self.lines.append(self._partial.decode("utf-8", errors="replace").rstrip("\r"))
+            self._partial = b""
+            added += 1
+        return added
+
+    def restore(self, lines, conclusion):
+        """Fill in a finished job's saved lines, so it is not fetched again."""
+        self.lines.extend(lines)
+        self.completed = True
+        self.conclusion = conclusion
+
+    def text(self):
+        return "\n".join(self.lines)
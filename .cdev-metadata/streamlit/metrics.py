@@ -0,0 +1,282 @@
+"""Timing spans and counters for the app and its GitHub calls.
+
+Where does the time of a slow bootstrap go: GitHub's latency, waits for the
+rate limiter, watcher sleeps or Streamlit reruns? The helpers record into
+one process-wide Registry:
+
+    with span("render_stack", stack=name):   # histogram of durations
+        ...
+    inc("github_response_bytes", len(body), route=route)
+    @timed("render_files")                    # also times generators
+    def render_files(...): ...
+
+A histogram is a fixed list of bucket counters (Prometheus layout), so
+recording costs a perf_counter() pair, a bisect and a locked increment: a
+few microseconds, cheap enough to leave on. CDEV_METRICS=0 turns recording
+off. Keep label values low-cardinality: routes, not URLs.
+
+snapshot() returns everything as JSON-ready data and prometheus_text() in
+Prometheus text format. serve() (or CDEV_METRICS_PORT, see
+default_metrics_server) exposes both over HTTP at /metrics and
+/metrics.json. The Streamlit sidebar shows the same data under Diagnostics.
+"""
+import bisect
+import functools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("CDEV_METRICS", "1") != "0"
+PREFIX = "cdev_"
+CO_GENERATOR = 0x20  # inspect.CO_GENERATOR; inspect alone costs more to import than this module
+# Seconds; GitHub calls sit in the middle, watcher waits and applies at the top
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+_ROUTE_RES = (
+    (re.compile(r"^repos/[^/]+/[^/]+"), "repos/{repo}"),
+    (re.compile(r"^orgs/[^/]+"), "orgs/{org}"),
+    (re.compile(r"/git/refs?/heads/.+$"), "/git/ref/heads/{branch}"),
+    (re.compile(r"/[0-9a-f]{40}(?=/|$)"), "/{sha}"),
+    (re.compile(r"/\d+(?=/|$)"), "/{id}"),
+    (re.compile(r"/(secrets|environments)/(?!public-key)[^/]+"), r"/\1/{name}"),
+)
+
+
+def route(path):
+    """Low-cardinality label for an API path: repos/{repo}/actions/runs/{id}/jobs."""
+    path = re.sub(r"^https?://[^/]+", "", path).split("?", 1)[0].strip("/")
+    for pattern, replacement in _ROUTE_RES:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+class Histogram:
+    """Counts of observations per bucket upper bound, plus their sum."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate of the q quantile, interpolated within its bucket; None when empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels, extra=()):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in (*labels, *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        """{"uptime", "spans": [{name, labels, count, sum, p50, p90, p99, buckets}], "counters": [{name, labels, value}]}."""
+        with self._lock:
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()]
+            counters = list(self._counters.items())
+        spans = []
+        for (name, labels), counts, total, count in sorted(histograms):
+            h = Histogram(self.buckets)
+            h.counts, h.sum, h.count = counts, total, count
+            spans.append({"name": name, "labels": dict(labels), "count": count, "sum": round(total, 6),
+                          **{f"p{int(q * 100)}": h.quantile(q) for q in (0.5, 0.9, 0.99)},
+                          "buckets": dict(zip([*map(str, self.buckets), "+Inf"], counts))})
+        return {"uptime": round(time.time() - self.started, 3), "spans": spans,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(counters)]}
+
+    def prometheus_text(self):
+        """Everything in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = sorted((key, list(h.counts), h.sum, h.count) for key, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        declared = set()
+        for (name, labels), counts, total, count in histograms:
+            metric = f"{PREFIX}{name}_seconds"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_sum{_label_text(labels)} {total}")
+            lines.append(f"{metric}_count{_label_text(labels)} {count}")
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+@contextmanager
+def span(name, **labels):
+    """Time the block into the name histogram; labels can be added to the yielded dict before it ends."""
+    if not ENABLED:
+        yield labels
+        return
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - start, **labels)
+
+
+def observe(name, seconds, **labels):
+    if ENABLED:
+        REGISTRY.observe(name, seconds, **labels)
+
+
+def inc(name, value=1, **labels):
+    if ENABLED:
+        REGISTRY.inc(name, value, **labels)
+
+
+def timed(name=None, **labels):
+    """Decorator timing each call; for generator functions the time spent producing items, until exhausted."""
+
+    def decorator(fn):
+        metric = name or fn.__name__
+        if fn.__code__.co_flags & CO_GENERATOR:
+            @functools.wraps(fn)
+            def generator(*args, **kwargs):
+                gen = fn(*args, **kwargs)
+                elapsed = 0.0
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(gen)
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                except StopIteration:
+                    return
+                finally:
+                    gen.close()
+                    observe(metric, elapsed, **labels)
+            return generator
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(metric, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+
+def prometheus_text():
+    return REGISTRY.prometheus_text()
+
+
+def serve(port=0, host="127.0.0.1"):
+    """Serve /metrics and /metrics.json from a daemon thread; returns the server (server_address has the port)."""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, content_type = prometheus_text().encode(), "text/plain; version=0.0.4"
+            elif path == "/metrics.json":
+                body, content_type = json.dumps(snapshot()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="cdev-metrics").start()
+    return server
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def default_metrics_server():
+    """Start the shared endpoint when CDEV_METRICS_PORT is set, else return None."""
+    global _server
+    port = os.environ.get("CDEV_METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = serve(int(port), os.environ.get("CDEV_METRICS_HOST", "127.0.0.1"))
+        return _server
@@ -0,0 +1,397 @@
+"""Typed project/stack configuration and cached rendering of the generated files.
+
+The Streamlit widgets build a ProjectConfig and a StackConfig once per rerun.
+Everything downstream reads those objects directly; YAML text is produced
+only for display and commit, memoized on the (frozen, hashable) configs so
+an unchanged rerun costs a dictionary lookup instead of a dump.
+"""
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+import yaml
+
+from metrics import timed
+
+# libyaml's emitter is several times faster than the pure Python one
+YAML_DUMPER = getattr(yaml, "CDumper", yaml.Dumper)
+
+REGIONS = [
+    "us-east-1", "us-east-2", "us-west-1", "us-west-2",
+    "af-south-1", "ap-east-1", "ap-south-1", "ap-northeast-1",
+    "ap-northeast-2", "ap-northeast-3", "ap-southeast-1", "ap-southeast-2",
+    "ca-central-1", "eu-central-1", "eu-west-1", "eu-west-2",
+    "eu-west-3", "eu-north-1", "eu-south-1", "me-south-1",
+    "sa-east-1"
+]
+
+EKS_VERSIONS = ["1.27", "1.26", "1.25"]
+
+INSTANCE_TYPES = [
+    "t3.xlarge", "t3a.xlarge", "m5.xlarge", "m5n.xlarge",
+    "t3.medium", "t3.large", "m6i.large", "m5.large",
+    "m5n.large", "t3a.medium", "t3a.large", "m6a.large",
+    "m5a.large"
+]
+
+# (addon name, enabled by default)
+EKS_ADDONS = [
+    ("ArgoCD", True),
+    ("NGINX", True),
+    ("External Secrets", True),
+    ("Cluster Autoscaler", True),
+    ("AWS LB Controller", True),
+    ("External DNS", True),
+    ("Cert Manager", True),
+    ("EFS", False),
+    ("Cert Manager HTTP Issuers", False),
+    ("Metrics Server", True),
+    ("Reloader", True)
+]
+
+STACK_TEMPLATE = "https://github.com/shalb/cdev-aws-eks?ref=main"
+
+
+def addon_variable(name):
+    return f"enable_{name.lower().replace(' ', '_')}"
+
+
+@dataclass(frozen=True)
+class ProjectConfig:
+    name: str = "my-project"
+    organization: str = "my-company"
+    region: str = "eu-central-1"
+    state_bucket_name: str = "cdev-state"
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "kind": "Project",
+            "backend": "aws-backend",
+            "variables": {
+                "organization": self.organization,
+                "region": self.region,
+                "state_bucket_name": self.state_bucket_name,
+            },
+        }
+
+    def backend_dict(self):
+        return {
+            "name": "aws-backend",
+            "kind": "Backend",
+            "provider": "s3",
+            "spec": {
+                "bucket": self.state_bucket_name,
+                "region": self.region,
+            }
+        }
+
+
+@dataclass(frozen=True)
+class StackConfig:
+    cluster_name: str = "demo"
+    domain: str = "cluster.dev"
+    eks_version: str = "1.27"
+    instance_types: tuple = ("t3.xlarge", "m5.xlarge")
+    min_size: int = 2
+    max_size: int = 3
+    addons: tuple = tuple(name for name, enabled in EKS_ADDONS if enabled)
+    # Set vpc_id to reuse an existing VPC instead of creating one
+    vpc_id: str = None
+    public_subnets: tuple = ()
+    private_subnets: tuple = ()
+    database_subnets: tuple = ()
+    environment: str = "demo-env"
+
+    def to_dict(self, project):
+        stack_eks_yaml = {
+            "name": "cluster",
+            "template": STACK_TEMPLATE,
+            "kind": "Stack",
+            "backend": "aws-backend",
+            "cliVersion": ">= 0.7.14",
+            "variables": {
+                "region": project.region,
+                "organization": project.organization,
+                "cluster_name": self.cluster_name,
+                "domain": self.domain,
+                "eks_version": self.eks_version,
+                "environment": self.environment,
+                "eks_managed_node_groups": {
+                    "workers": {
+                        "capacity_type": "SPOT",
+                        # The old fixed 2, kept inside [min_size, max_size] so EKS accepts the group
+                        "desired_size": min(max(2, self.min_size), self.max_size),
+                        "disk_size": 80,
+                        "force_update_version": True,
+                        "instance_types": list(self.instance_types),
+                        "labels": {},
+                        "max_size": self.max_size,
+                        "min_size": self.min_size,
+                        "name": "spot-workers",
+                        "subnet_ids": '{{ remoteState "cluster.vpc.private_subnets" }}',
+                        "taints": [],
+                        "update_config": {
+                            "max_unavailable": 1
+                        },
+                        "iam_role_additional_policies": {
+                            "ebspolicy": "arn:aws:iam::aws:policy/service-role/AmazonEBSCSIDriverPolicy"
+                        },
+                    }
+                },
+                "eks_addons": {addon_variable(name): (name in self.addons) for name, _ in EKS_ADDONS},
+            }
+        }
+        if self.vpc_id is not None:
+            stack_eks_yaml["variables"].update({
+                "vpc_id": self.vpc_id,
+                "public_subnets": list(self.public_subnets),
+                "private_subnets": list(self.private_subnets),
+                "database_subnets": list(self.database_subnets),
+            })
+        return stack_eks_yaml
+
+
+def dump_yaml(data):
+    return yaml.dump(data, Dumper=YAML_DUMPER)
+
+
+@lru_cache(maxsize=256)
+def render_project_yaml(project):
+    return dump_yaml(project.to_dict())
+
+
+@lru_cache(maxsize=256)
+def render_backend_yaml(project):
+    return dump_yaml(project.backend_dict())
+
+
+@lru_cache(maxsize=256)
+def render_stack_eks_yaml(project, stack):
+    return dump_yaml(stack.to_dict(project))
+
+
+@lru_cache(maxsize=256)
+def preview_stack(project, stack):
+    """template.yaml expanded offline for this stack, as cdev would see it (a template_renderer.RenderResult)."""
+    from template_renderer import REPO_ROOT, render_stack
+
+    return render_stack(render_stack_eks_yaml(project, stack), project.to_dict(), REPO_ROOT)
+
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "template.yaml")
+CDEV_IMAGE = "clusterdev/cluster.dev:v0.7.18"
+# Where cdev keeps template clones, downloaded modules and the units' .terraform dirs, per project
+CDEV_WORK_DIR = ".cluster.dev"
+PLUGIN_CACHE_DIR = "/github/home/.terraform.d/plugin-cache"
+# Older plans may no longer match the infrastructure (drift); apply then runs
+PLAN_REUSE_MAX_AGE_HOURS = 24
+_MODULE_RE = re.compile(r"^\s*source:\s*\"?([^\s\"]+)\"?\s*\n(?:\s*version:\s*\"?([^\s\"]+)\"?)?", re.M)
+
+
+@lru_cache(maxsize=None)
+def module_versions(template_path=TEMPLATE_PATH):
+    """(source, version) of every module template.yaml pulls in; version is "" for git refs."""
+    with open(template_path) as f:
+        return tuple((source, version or "") for source, version in _MODULE_RE.findall(f.read()))
+
+
+def build_cache_key(project):
+    """Cache key of the providers and modules: changes with the image, the template and its module versions."""
+    versions = "\n".join([CDEV_IMAGE, STACK_TEMPLATE] + [f"{source}@{version}" for source, version in module_versions()])
+    return f"cdev-{project.name}-{hashlib.sha256(versions.encode()).hexdigest()[:16]}"
+
+
+@lru_cache(maxsize=256)
+def render_workflow_file(project):
+    """GitHub workflow for one project.
+
+    Both jobs restore the terraform plugin cache and cdev's working directory
+    under build_cache_key(). The plan job saves its output as an artifact
+    named after the git tree of the project directory and the commit the
+    stack template's ref resolved to, with plan.env holding cdev plan's exit
+    status and the number of changes it reported. Apply only reuses the plan
+    of the PR merged into its commit, made for that PR's last head within
+    PLAN_REUSE_MAX_AGE_HOURS; when that plan succeeded without changes, apply
+    is skipped. A new push to a PR cancels its running plan, and applies of
+    one project run one at a time.
+    """
+    project_name = project.name
+    region = project.region
+    state_bucket_name = project.state_bucket_name
+    cache_key = build_cache_key(project)
+    template_repo, _, template_ref = STACK_TEMPLATE.partition("?ref=")
+    plan_artifact = f"cdev-plan-{project_name}-${{{{ steps.tree.outputs.sha }}}}-${{{{ steps.tree.outputs.template }}}}"
+    workflow_yaml = f"""
+name: Cluster.dev for {project_name}
+
+on:
+  push:
+    branches:
+      - 'cluster.dev-*'
+      - main
+    paths:
+      - '.cluster.dev/{project_name}/**'
+  pull_request:
+    branches:
+      - main
+    paths:
+      - '.cluster.dev/{project_name}/**'
+
+permissions:
+  contents: read
+  actions: read
+  pull-requests: read
+
+env:
+  TF_PLUGIN_CACHE_DIR: {PLUGIN_CACHE_DIR}
+  AWS_DEFAULT_REGION: {region}
+
+jobs:
+  plan:
+    if: github.event_name == 'pull_request'
+    runs-on: ubuntu-latest
+    container: {CDEV_IMAGE}
+    concurrency:
+      group: cdev-plan-{project_name}-${{{{ github.event.pull_request.number }}}}
+      cancel-in-progress: true
+    steps:
+    - name: Check out code
+      uses: actions/checkout@v3
+
+    - name: Restore provider and module caches
+      uses: actions/cache@v3
+      with:
+        path: |
+          {PLUGIN_CACHE_DIR}
+          .cluster.dev/{project_name}/{CDEV_WORK_DIR}
+        key: {cache_key}
+        restore-keys: cdev-{project_name}-
+
+    - name: Find the project tree and template version
+      id: tree
+      run: |
+        git config --global --add safe.directory "$GITHUB_WORKSPACE"
+        mkdir -p {PLUGIN_CACHE_DIR}
+        echo "sha=$(git rev-parse HEAD:.cluster.dev/{project_name})" >> "$GITHUB_OUTPUT"
+        # cdev fetches the template by ref; a plan only stands for the template commit it saw
+        template=$(git ls-remote {template_repo} {template_ref} | head -n 1 | cut -c 1-12)
+        echo "template=${{template:-unresolved-$GITHUB_RUN_ID}}" >> "$GITHUB_OUTPUT"
+
+    - name: Run ClusterDev Plan
+      run: |
+        cd .cluster.dev/{project_name}
+        aws s3 mb s3://{state_bucket_name} || true
+        mkdir -p "$RUNNER_TEMP/cdev-plan"
+        cdev plan > "$RUNNER_TEMP/cdev-plan/plan.txt" 2>&1 || status=$?
+        cat "$RUNNER_TEMP/cdev-plan/plan.txt"
+        # What apply decides on, so it never has to read the log; colours and indentation must not hide a change
+        esc=$(printf '\\033')
+        changes=$(sed -e "s/${{esc}}\\[[0-9;]*m//g" -e 's/^[[:space:]]*//' "$RUNNER_TEMP/cdev-plan/plan.txt" \\
+          | grep -Ec "^Plan: [0-9]+ to add|will be (created|updated in-place|destroyed|replaced|deployed)|must be replaced" \\
+          || true)
+        printf 'status=%s\\nchanges=%s\\n' "${{status:-0}}" "${{changes:-0}}" > "$RUNNER_TEMP/cdev-plan/plan.env"
+        exit ${{status:-0}}
+      env:
+        AWS_ACCESS_KEY_ID: ${{{{ secrets.AWS_ACCESS_KEY_ID }}}}
+        AWS_SECRET_ACCESS_KEY: ${{{{ secrets.AWS_SECRET_ACCESS_KEY }}}}
+
+    - name: Save the plan
+      if: ${{{{ !cancelled() }}}}
+      uses: actions/upload-artifact@v4
+      with:
+        name: {plan_artifact}
+        path: ${{{{ runner.temp }}}}/cdev-plan
+        retention-days: 14
+  apply:
+    if: github.event_name == 'push' && contains(github.ref, 'refs/heads/main')  # Runs only on push to main branch
+    runs-on: ubuntu-latest
+    container: {CDEV_IMAGE}
+    concurrency:
+      group: cdev-apply-{project_name}
+      cancel-in-progress: false
+    steps:
+    - name: Check out code
+      uses: actions/checkout@v3
+
+    - name: Restore provider and module caches
+      uses: actions/cache@v3
+      with:
+        path: |
+          {PLUGIN_CACHE_DIR}
+          .cluster.dev/{project_name}/{CDEV_WORK_DIR}
+        key: {cache_key}
+        restore-keys: cdev-{project_name}-
+
+    - name: Find the project tree and template version
+      id: tree
+      run: |
+        git config --global --add safe.directory "$GITHUB_WORKSPACE"
+        mkdir -p {PLUGIN_CACHE_DIR}
+        echo "sha=$(git rev-parse HEAD:.cluster.dev/{project_name})" >> "$GITHUB_OUTPUT"
+        # cdev fetches the template by ref; a plan only stands for the template commit it saw
+        template=$(git ls-remote {template_repo} {template_ref} | head -n 1 | cut -c 1-12)
+        echo "template=${{template:-unresolved-$GITHUB_RUN_ID}}" >> "$GITHUB_OUTPUT"
+
+    - name: Find the plan of this tree
+      id: saved
+      uses: actions/github-script@v7
+      with:
+        script: |
+          const {{ owner, repo }} = context.repo;
+          // Only the plan of the PR merged into this commit, made for its last head, and recent
+          const {{ data: pulls }} = await github.rest.repos.listPullRequestsAssociatedWithCommit({{
+            owner, repo, commit_sha: context.sha}});
+          const pull = pulls.find(pull => pull.merged_at && pull.merge_commit_sha === context.sha);
+          let runId = '';
+          if (pull) {{
+            const {{ data }} = await github.rest.actions.listArtifactsForRepo({{
+              owner, repo, name: '{plan_artifact}'}});
+            const artifact = data.artifacts.find(artifact => !artifact.expired
+              && artifact.workflow_run.head_branch === pull.head.ref
+              && artifact.workflow_run.head_sha === pull.head.sha
+              && Date.now() - Date.parse(artifact.created_at) < {PLAN_REUSE_MAX_AGE_HOURS} * 3600 * 1000);
+            runId = artifact ? String(artifact.workflow_run.id) : '';
+          }}
+          core.setOutput('run-id', runId);
+
+    - name: Download the plan
+      if: steps.saved.outputs.run-id != ''
+      uses: actions/download-artifact@v4
+      with:
+        name: {plan_artifact}
+        path: ${{{{ runner.temp }}}}/cdev-plan
+        run-id: ${{{{ steps.saved.outputs.run-id }}}}
+        github-token: ${{{{ github.token }}}}
+
+    - name: Run ClusterDev Apply
+      run: |
+        cd .cluster.dev/{project_name}
+        saved="$RUNNER_TEMP/cdev-plan/plan.env"
+        if [ -f "$saved" ] && [ "$(sed -n 's/^status=//p' "$saved")" = 0 ] \\
+            && [ "$(sed -n 's/^changes=//p' "$saved")" = 0 ]; then
+          echo "The plan of this tree succeeded without changes, nothing to apply."
+          exit 0
+        fi
+        cdev apply --force
+      env:
+        AWS_ACCESS_KEY_ID: ${{{{ secrets.AWS_ACCESS_KEY_ID }}}}
+        AWS_SECRET_ACCESS_KEY: ${{{{ secrets.AWS_SECRET_ACCESS_KEY }}}}
+    """
+
+    return workflow_yaml
+
+
+@timed()
+def render_files(project, stack):
+    """Map repository paths to the rendered files for one project."""
+    subdirectory = ".cluster.dev/" + project.name
+    workflow_path = ".github/workflows/clusterdev-" + project.name + ".yaml"
+    return {
+        f"{subdirectory}/project.yaml": render_project_yaml(project),
+        f"{subdirectory}/backend.yaml": render_backend_yaml(project),
+        f"{subdirectory}/stack_eks.yaml": render_stack_eks_yaml(project, stack),
+        workflow_path: render_workflow_file(project)
+    }
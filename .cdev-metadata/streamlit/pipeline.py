@@ -0,0 +1,192 @@
+"""The bootstrap as a pipeline of idempotent, checkpointed stages.
+
+    commit -> pull_request -> plan -> merge -> apply_run
+
+Each stage records what it produced in the run-state store (run_state.py)
+as soon as it is done: the branch and commit, the PR, the plan run, the
+merge commit and the apply run. When a step fails (a 502, a timeout, a
+closed tab), the next attempt reads the checkpoint of its render and goes on
+after the last finished stage. It reuses the branch, commit and PR it
+already has, so a retry costs only the remaining API calls and never opens
+a second PR or starts a second plan run.
+
+The stages are idempotent on GitHub's side too, for requests that went
+through but whose answer was lost:
+- the branch name comes from the render and its parent commit, so a retry
+  picks the same branch and takes over an existing one with the same files;
+- "already exists" on the PR is resolved by finding the PR;
+- "not mergeable" on the merge is resolved by reading the PR.
+"""
+import hashlib
+import re
+
+from metrics import timed
+from run_state import APPLY, PLAN, RunStateStore
+
+STAGES = ("commit", "pull_request", "plan", "merge", "apply_run")
+
+
+def branch_name(fingerprint, parent_sha):
+    """Branch of a render on top of parent_sha; the same for every attempt."""
+    return f"cluster.dev-{hashlib.sha1(f'{fingerprint}:{parent_sha}'.encode()).hexdigest()[:8]}"
+
+
+def pr_number(pr_url):
+    return int(pr_url.rstrip('/').rsplit('/', 1)[-1])
+
+
+def finished_stage(plan, apply=None):
+    """Last stage the checkpoint rows (see RunStateStore.resume) have finished, or None."""
+    if apply is not None and apply["run_id"]:
+        return "apply_run"
+    if plan is None:
+        return None
+    if plan["merged_sha"]:
+        return "merge"
+    if plan["conclusion"]:
+        return "plan"
+    return "pull_request" if plan["pr_url"] else "commit"
+
+
+def _result(status, message, pr_url=None, branch=None, commit=None, resumed_from=None, jobs=None):
+    return {"status": status, "pr_url": pr_url, "branch": branch, "message": message, "commit": commit,
+            "resumed_from": resumed_from, "jobs": jobs}
+
+
+@timed("pipeline_stage", stage="commit")
+def commit_stage(repo, token, files, fingerprint, head, base_branch, store):
+    """Commit files on the render's branch off head; returns (branch, commit_files() result)."""
+    from commit_engine import commit_files
+    from github_utils import branch_head, changed_files
+
+    branch = branch_name(fingerprint, head[0])
+    commit = commit_files(repo, token, files, branch, base_branch=base_branch, parent=head)
+    if not commit["success"]:
+        # An earlier attempt may have created the branch and lost the answer: take it over if it has these files
+        existing = branch_head(repo, branch, token)
+        if existing is None or changed_files(files, repo, branch, token, head=existing) != []:
+            return branch, commit
+        commit = {**commit, "success": True, "sha": existing[0], "calls": commit["calls"] + 3, "error": None}
+    store.record(repo, branch, commit["sha"], kind=PLAN, fingerprint=fingerprint)
+    return branch, commit
+
+
+@timed("pipeline_stage", stage="pull_request")
+def pull_request_stage(repo, token, branch, sha, fingerprint, base_branch, store):
+    """Open the PR of the branch; returns its URL, or None."""
+    from github_utils import RENDER_MARKER, create_pull_request, find_render_pull_request
+
+    # The fingerprint lets a later identical render find this PR
+    pr_url = create_pull_request(repo, branch, base_branch, token, body=f"{RENDER_MARKER} {fingerprint}")
+    if not pr_url:
+        # "A pull request already exists" when an earlier attempt opened it
+        pr = find_render_pull_request(repo, base_branch, fingerprint, token)
+        pr_url = pr['html_url'] if pr and pr['head']['ref'] == branch else None
+    if pr_url:
+        store.record(repo, branch, sha, pr_url=pr_url)
+    return pr_url
+
+
+def push(repo, token, files, base_branch, store=None):
+    """Run or continue the commit and pull_request stages for the rendered files.
+
+    Returns {"status", "pr_url", "branch", "message", "commit", "resumed_from", "jobs"}:
+    status is "unchanged", "reused", "created" or "failed". resumed_from is the
+    checkpoint's last finished stage. jobs holds the plan job statuses when the
+    checkpoint already has the plan's outcome.
+    """
+    from github_utils import branch_head, changed_files, find_render_pull_request, get_pull_request, render_fingerprint
+
+    store = store or RunStateStore()
+    fingerprint = render_fingerprint(files)
+    plan = store.find(repo, kind=PLAN, fingerprint=fingerprint)
+    if plan is not None and not plan["merged_sha"]:
+        stage = finished_stage(plan)
+        if plan["pr_url"] is None:
+            pr_url = pull_request_stage(repo, token, plan["branch"], plan["sha"], fingerprint, base_branch, store)
+            if not pr_url:
+                return _result("failed", "Failed to create pull request.", branch=plan["branch"], resumed_from=stage)
+            return _result("created", "Files pushed successfully!", pr_url, plan["branch"], resumed_from=stage)
+        pr = get_pull_request(repo, pr_number(plan["pr_url"]), token)
+        if pr is not None and pr["state"] == "open":
+            return _result("reused", "Continuing the pull request of this configuration.", plan["pr_url"],
+                           plan["branch"], resumed_from=stage, jobs=plan["jobs"] if plan["conclusion"] else None)
+        if pr is not None and pr.get("merged"):
+            store.record(repo, plan["branch"], plan["sha"], merged_sha=pr["merge_commit_sha"])
+        # Merged or closed meanwhile: this render starts over
+
+    # The base branch head serves both the no-op check and, as the parent, the commit
+    head = branch_head(repo, base_branch, token)
+    if head is None:
+        return _result("failed", f"Failed to read branch {base_branch}.")
+    # Skip no-op pushes: compare blob SHAs with the base branch, then look for an open PR of the same render
+    if changed_files(files, repo, base_branch, token, head=head) == []:
+        return _result("unchanged", f"Nothing to push: {base_branch} already contains this configuration.")
+    existing_pr = find_render_pull_request(repo, base_branch, fingerprint, token)
+    if existing_pr:
+        store.record(repo, existing_pr['head']['ref'], existing_pr['head']['sha'], kind=PLAN,
+                     fingerprint=fingerprint, pr_url=existing_pr['html_url'])
+        return _result("reused", "An open pull request already contains this configuration, reusing it.",
+                       existing_pr['html_url'], existing_pr['head']['ref'])
+
+    branch, commit = commit_stage(repo, token, files, fingerprint, head, base_branch, store)
+    if not commit["success"]:
+        error = commit["error"]
+        message = f" GitHub says: {error['message']}" if error and "message" in error else ""
+        return _result("failed", "Failed to push files." + message, commit=commit)
+    pr_url = pull_request_stage(repo, token, branch, commit["sha"], fingerprint, base_branch, store)
+    if not pr_url:
+        return _result("failed", "Failed to create pull request.", branch=branch, commit=commit)
+    return _result("created", "Files pushed successfully!", pr_url, branch, commit)
+
+
+@timed("pipeline_stage", stage="merge")
+def merge_stage(repo, token, number, store):
+    """Merge PR number unless its checkpoint has the merge; returns (success, message, merge commit SHA)."""
+    from github_utils import get_pull_request, merge_pr
+
+    plan = store.find_pull_request(repo, number)
+    if plan is not None and plan["merged_sha"]:
+        return True, "PR merged successfully!", plan["merged_sha"]
+    success, message, merge_commit_sha = merge_pr(repo, number, token)
+    if not success:
+        # Merged by an earlier attempt whose answer was lost, or by someone else
+        pr = get_pull_request(repo, number, token)
+        if pr is None or not pr.get("merged"):
+            return False, message, None
+        success, message, merge_commit_sha = True, "PR merged successfully!", pr["merge_commit_sha"]
+    if plan is not None:
+        store.record(repo, plan["branch"], plan["sha"], merged_sha=merge_commit_sha)
+    return success, message, merge_commit_sha
+
+
+@timed("pipeline_stage", stage="apply_run")
+def apply_run_stage(repo, token, merge_commit_sha, base_branch, store, timeout, pr_url=None, fingerprint=None):
+    """The apply check run of the merge commit, {"id", "html_url"}, from its checkpoint or GitHub; None if not found."""
+    from github_utils import get_run_id_for_commit
+
+    apply = store.get(repo, base_branch, merge_commit_sha)
+    if apply is not None and apply["run_id"]:
+        return {"id": int(apply["job_id"]), "html_url": apply["run_url"]}
+    latest_run = get_run_id_for_commit(repo, token, merge_commit_sha, "Cluster.dev", timeout=timeout)
+    if latest_run:
+        run_id = re.search(r'/runs/(\d+)/job', latest_run['html_url']).group(1)
+        store.record(repo, base_branch, merge_commit_sha, kind=APPLY, pr_url=pr_url, fingerprint=fingerprint,
+                     run_id=run_id, job_id=str(latest_run['id']), run_url=latest_run['html_url'])
+    return latest_run
+
+
+def merge(repo, token, number, base_branch, timeout, callback=None, store=None):
+    """Run or continue the merge and apply_run stages of PR number; returns (success, message, apply check run)."""
+    store = store or RunStateStore()
+    if callback:
+        callback(0, "Merging PR")
+    success, message, merge_commit_sha = merge_stage(repo, token, number, store)
+    if not success:
+        return False, message, None
+    if callback:
+        callback(0, "PR merged, waiting for the apply run to start")
+    plan = store.find_pull_request(repo, number)
+    latest_run = apply_run_stage(repo, token, merge_commit_sha, base_branch, store, timeout,
+                                 pr_url=plan and plan['pr_url'], fingerprint=plan and plan['fingerprint'])
+    return True, message, latest_run
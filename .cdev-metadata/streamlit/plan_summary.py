@@ -0,0 +1,116 @@
+"""Compact summary of the plan job's Terraform output.
+
+summarize_lines() reads the plan step log one line at a time and only keeps
+counters per unit plus the few resources worth calling out, so even a huge
+plan log takes constant memory. Terraform's "# <address> will be created /
+updated in-place / destroyed / must be replaced" headers are counted for the
+unit cdev is planning at the time. Replacing or destroying expensive or
+disruptive resources (the EKS cluster, NAT gateways, node groups) is listed
+separately, since that is what a reviewer has to see before merging.
+Summaries are cached per run, so page reruns don't download the logs again.
+A run whose logs could not be downloaded is not asked again for
+MISSING_TTL seconds.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from logs import PLAN_LOG_PATTERN, iter_log_lines, spooled_run_logs
+from metrics import timed
+
+# Resource types whose replacement means downtime or a long apply
+EXPENSIVE_RESOURCES = {
+    "aws_eks_cluster": "EKS cluster",
+    "aws_eks_node_group": "node group",
+    "aws_autoscaling_group": "node group",
+    "aws_nat_gateway": "NAT gateway",
+    "aws_vpc": "VPC",
+}
+ACTIONS = ("add", "change", "destroy", "replace", "read")
+MAX_CALLOUTS = 50
+SUMMARY_CACHE_SIZE = 32
+MISSING_TTL = 60.0  # seconds
+NO_UNIT = "(no unit)"
+
+_STAMP_RE = re.compile(r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?Z ")
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+_UNIT_RE = re.compile(r"(?:Planning|Plan for) unit '?(?P<unit>[\w.-]+?)'?:?\s*$")
+_RESOURCE_RE = re.compile(r"^# (?P<address>[\w-]+\.\S+) (?P<what>.+)$")
+_PLAN_RE = re.compile(r"Plan: (\d+) to add, (\d+) to change, (\d+) to destroy")
+_WHAT = (("must be replaced", "replace"), ("will be replaced", "replace"), ("will be created", "add"),
+         ("updated in-place", "change"), ("will be destroyed", "destroy"), ("will be read", "read"))
+
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+_missing = {}  # (repo, run_id) -> time the logs could not be downloaded
+
+
+def resource_type(address):
+    """aws_eks_cluster for module.eks.module.eks.aws_eks_cluster.this[0]."""
+    parts = re.sub(r"\[[^\]]*\]", "", address).split(".")
+    while parts[:1] == ["module"]:
+        parts = parts[2:]
+    if parts[:1] == ["data"]:
+        parts = parts[1:]
+    return parts[0] if parts else ""
+
+
+def summarize_lines(lines):
+    """Return {"units": {unit: counts}, "totals": counts, "reported": {unit: (add, change, destroy)},
+    "callouts": [(unit, address, label, action)]} for plan log lines."""
+    units = {}
+    reported = {}
+    callouts = []
+    current = NO_UNIT
+    for line in lines:
+        line = _ANSI_RE.sub("", _STAMP_RE.sub("", line, count=1)).strip()
+        match = _UNIT_RE.search(line)
+        if match:
+            current = match.group("unit").rsplit(".", 1)[-1]  # cluster.vpc -> vpc
+            units.setdefault(current, dict.fromkeys(ACTIONS, 0))
+            continue
+        match = _PLAN_RE.search(line)
+        if match:
+            reported[current] = tuple(int(n) for n in match.groups())
+            continue
+        match = _RESOURCE_RE.match(line)
+        if not match:
+            continue
+        action = next((action for text, action in _WHAT if text in match.group("what")), None)
+        if action is None:
+            continue
+        units.setdefault(current, dict.fromkeys(ACTIONS, 0))[action] += 1
+        label = EXPENSIVE_RESOURCES.get(resource_type(match.group("address")))
+        if label and action in ("replace", "destroy") and len(callouts) < MAX_CALLOUTS:
+            callouts.append((current, match.group("address"), label, action))
+
+    totals = {action: sum(counts[action] for counts in units.values()) for action in ACTIONS}
+    return {"units": units, "totals": totals, "reported": reported, "callouts": callouts}
+
+
+@timed()
+def summarize_run(repo, run_id, token, pattern=PLAN_LOG_PATTERN):
+    """Summary of the plan step log of a finished run, cached per run; None if the logs are unavailable."""
+    key = (repo, str(run_id))
+    with _summaries_lock:
+        if key in _summaries:
+            _summaries.move_to_end(key)
+            return _summaries[key]
+        if time.time() - _missing.get(key, 0.0) < MISSING_TTL:
+            return None
+    with spooled_run_logs(repo, run_id, token) as archive:
+        if archive is None:
+            with _summaries_lock:
+                now = time.time()
+                for stale in [k for k, at in _missing.items() if now - at >= MISSING_TTL]:
+                    del _missing[stale]
+                _missing[key] = now
+            return None
+        summary = summarize_lines(line for _, line in iter_log_lines(archive, pattern))
+    with _summaries_lock:
+        _summaries[key] = summary
+        _missing.pop(key, None)
+        while len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+    return summary
@@ -0,0 +1,155 @@
+"""Cost and capacity planning for the SPOT workers node group.
+
+The offline catalog (instance_catalog.yaml) is loaded once into NumPy arrays.
+recommend() scores every combination of up to max_types instance types in one
+pass: the node size the group can count on (its smallest type, since SPOT may
+launch any of them), the expected hourly price (mean spot price of its
+types) and how diversified it is (spot pools and instance families). That is
+a few hundred rows and takes about a millisecond, so the UI recomputes it on
+every widget change.
+"""
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+import yaml
+
+CATALOG_PATH = os.path.join(os.path.dirname(__file__), "instance_catalog.yaml")
+HOURS_PER_MONTH = 730
+# Plans this much more expensive than the cheapest still win if they spread over more spot pools
+COST_TOLERANCE = 0.10
+
+
+@dataclass(frozen=True, eq=False)
+class Catalog:
+    types: tuple
+    vcpu: np.ndarray
+    memory_gib: np.ndarray
+    on_demand: np.ndarray
+    spot: np.ndarray
+    max_enis: np.ndarray
+    ipv4_per_eni: np.ndarray
+    family: np.ndarray  # family index per type; t3 and t3a count as different families
+    region_factor: dict
+
+    def index(self, instance_types):
+        """Catalog positions of the known types among instance_types."""
+        return np.array([self.types.index(t) for t in instance_types if t in self.types], dtype=np.intp)
+
+
+@lru_cache(maxsize=None)
+def load_catalog(path=CATALOG_PATH):
+    with open(path) as f:
+        data = yaml.safe_load(f)
+    specs = data["instance_types"]
+    types = tuple(specs)
+    families = sorted({t.split(".")[0] for t in types})
+
+    def column(key, dtype=float):
+        return np.array([specs[t][key] for t in types], dtype=dtype)
+
+    return Catalog(
+        types=types,
+        vcpu=column("vcpu"),
+        memory_gib=column("memory_gib"),
+        on_demand=column("on_demand"),
+        spot=column("spot"),
+        max_enis=column("max_enis", int),
+        ipv4_per_eni=column("ipv4_per_eni", int),
+        family=np.array([families.index(t.split(".")[0]) for t in types], dtype=np.intp),
+        region_factor=data["region_factor"],
+    )
+
+
+@lru_cache(maxsize=8)
+def combination_matrix(n_types, max_types):
+    """Boolean (combinations x types) membership matrix of every subset of 1..max_types types."""
+    rows = [c for k in range(1, max_types + 1) for c in combinations(range(n_types), k)]
+    matrix = np.zeros((len(rows), n_types), dtype=bool)
+    for i, row in enumerate(rows):
+        matrix[i, list(row)] = True
+    return matrix
+
+
+def _combination_stats(catalog, matrix, region):
+    factor = catalog.region_factor.get(region, 1.0)
+    count = matrix.sum(axis=1)
+    node_vcpu = np.where(matrix, catalog.vcpu, np.inf).min(axis=1)
+    node_memory = np.where(matrix, catalog.memory_gib, np.inf).min(axis=1)
+    # Cluster Autoscaler sizes a group from one of its types, so they should all have the same shape
+    uniform = ((np.where(matrix, catalog.vcpu, 0).max(axis=1) == node_vcpu)
+               & (np.where(matrix, catalog.memory_gib, 0).max(axis=1) == node_memory))
+    families = (matrix @ np.eye(catalog.family.max() + 1, dtype=int)[catalog.family] > 0).sum(axis=1)
+    return {
+        "count": count,
+        "node_vcpu": node_vcpu,
+        "node_memory": node_memory,
+        "uniform": uniform,
+        "families": families,
+        "spot": matrix @ catalog.spot / count * factor,
+        "spot_max": np.where(matrix, catalog.spot, 0).max(axis=1) * factor,
+        "on_demand": matrix @ catalog.on_demand / count * factor,
+    }
+
+
+def evaluate(instance_types, min_size, max_size, region):
+    """Capacity and cost of one node group; None if none of its types is in the catalog."""
+    catalog = load_catalog()
+    index = catalog.index(instance_types)
+    if not len(index):
+        return None
+    matrix = np.zeros((1, len(catalog.types)), dtype=bool)
+    matrix[0, index] = True
+    stats = {key: value[0].item() for key, value in _combination_stats(catalog, matrix, region).items()}
+    return {
+        "vcpu": (min_size * stats["node_vcpu"], max_size * stats["node_vcpu"]),
+        "memory_gib": (min_size * stats["node_memory"], max_size * stats["node_memory"]),
+        "spot_monthly": (min_size * stats["spot"] * HOURS_PER_MONTH, max_size * stats["spot_max"] * HOURS_PER_MONTH),
+        "on_demand_monthly": (min_size * stats["on_demand"] * HOURS_PER_MONTH,
+                              max_size * stats["on_demand"] * HOURS_PER_MONTH),
+        "spot_per_vcpu_hour": stats["spot"] / stats["node_vcpu"],
+        "spot_per_gib_hour": stats["spot"] / stats["node_memory"],
+        "spot_savings": 1 - stats["spot"] / stats["on_demand"],
+        "spot_pools": stats["count"],
+        "families": stats["families"],
+        "uniform": stats["uniform"],
+        "unknown_types": tuple(t for t in instance_types if t not in catalog.types),
+    }
+
+
+@lru_cache(maxsize=256)
+def recommend(target_vcpu, target_memory_gib, region, max_types=3, max_nodes=10, headroom=0.5, top=5):
+    """Cheapest well-diversified node groups covering the target; a tuple of plan dicts, best first.
+
+    min_size covers the target with the smallest type of the plan, max_size
+    adds headroom for scaling out. Plans with mixed vCPU/memory shapes or a
+    max_size over max_nodes are left out.
+    """
+    catalog = load_catalog()
+    matrix = combination_matrix(len(catalog.types), max_types)
+    stats = _combination_stats(catalog, matrix, region)
+    nodes = np.maximum(np.ceil(target_vcpu / stats["node_vcpu"]), np.ceil(target_memory_gib / stats["node_memory"]))
+    nodes = nodes.clip(min=1)
+    max_size = np.ceil(nodes * (1 + headroom))
+    monthly = nodes * stats["spot"] * HOURS_PER_MONTH
+    ok = stats["uniform"] & (max_size <= max_nodes)
+    if not ok.any():
+        return ()
+
+    # Close to the cheapest, more spot pools and families win: fewer simultaneous interruptions
+    close = ok & (monthly <= monthly[ok].min() * (1 + COST_TOLERANCE))
+    diversified = np.lexsort((monthly, -stats["families"], -stats["count"]))
+    by_cost = np.argsort(monthly, kind="stable")
+    order = np.concatenate([diversified[close[diversified]], by_cost[(ok & ~close)[by_cost]]])[:top]
+    return tuple({
+        "instance_types": tuple(catalog.types[i] for i in np.flatnonzero(matrix[row])),
+        "min_size": int(nodes[row]),
+        "max_size": int(max_size[row]),
+        "spot_monthly": round(float(monthly[row]), 2),
+        "on_demand_monthly": round(float(nodes[row] * stats["on_demand"][row] * HOURS_PER_MONTH), 2),
+        "spot_per_vcpu_hour": round(float(stats["spot"][row] / stats["node_vcpu"][row]), 4),
+        "spot_pools": int(stats["count"][row]),
+        "families": int(stats["families"][row]),
+    } for row in order)
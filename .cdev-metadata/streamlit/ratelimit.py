@@ -0,0 +1,147 @@
+"""Process-wide GitHub rate-limit scheduling, one limiter per token and resource.
+
+GitHub budgets REST ("core") and GraphQL calls separately, and names the
+budget an answer counted against in X-RateLimit-Resource. All Streamlit
+sessions using the same token share one RateLimiter per resource through
+their GitHubClient. It keeps a token bucket whose refill rate follows the
+X-RateLimit-Remaining/Reset headers of the latest answer (what is left of the
+budget spread over the time until the reset), holds every caller back after
+a Retry-After or an exhausted budget instead of letting each one run into a
+403, and serves interactive calls (push, PR, merge) before background polling:
+interactive calls may borrow from the bucket, polls wait while an interactive
+call is queued, and the last few percent of the budget are left to
+interactive calls only.
+
+Interactive calls wait at most max_wait seconds (CDEV_INTERACTIVE_MAX_WAIT):
+a user should get an error saying when the budget is back rather than a page
+that hangs until the hourly reset.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+INTERACTIVE = 0
+BACKGROUND = 1
+INTERACTIVE_MAX_WAIT = float(os.environ.get("CDEV_INTERACTIVE_MAX_WAIT", "30"))
+
+
+class RateLimitExceeded(Exception):
+    """An interactive call would have to wait longer than it may for the rate limit."""
+
+    def __init__(self, delay):
+        super().__init__(f"GitHub rate limit reached, try again in {int(delay) + 1}s.")
+        self.delay = delay
+
+
+class RateLimiter:
+    """Token bucket for one GitHub token, paced by the rate-limit headers GitHub returns."""
+
+    def __init__(self, burst=50, reserve=0.05):
+        self.burst = burst
+        self.reserve = reserve
+        self.tokens = float(burst)
+        self.rate = None  # tokens per second, None while no answer has said how much is left
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0.0
+        self.stats = {"acquired": 0, "waited_s": 0.0, "blocked": 0}
+        self._waiting = Counter()
+        self._last = time.time()
+        self._cond = threading.Condition()
+
+    def _reserved(self):
+        return max(1, int(self.limit * self.reserve)) if self.limit else 0
+
+    def _refill(self, now):
+        if self.reset_at is not None and now >= self.reset_at + 1:
+            # New window (Reset is in whole seconds): the budget is back, pace again from the next answer's headers
+            self.remaining = self.reset_at = self.rate = None
+        if self.rate is None:
+            self.tokens = max(self.tokens, float(self.burst))
+        else:
+            self.tokens = min(float(self.burst), self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def _delay(self, priority, now):
+        # Seconds to wait before a call of this priority may go, <= 0 when it may go now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if priority == INTERACTIVE:
+            return 0 if self.remaining is None or self.remaining > 0 else self.reset_at - now
+        if self._waiting[INTERACTIVE]:
+            return 0.05
+        if self.remaining is not None and self.remaining <= self._reserved():
+            return self.reset_at - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None):
+        """Block until a request of this priority may be sent; raise RateLimitExceeded past max_wait seconds."""
+        start = time.time()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._refill(now)
+                    delay = self._delay(priority, now)
+                    if delay <= 0:
+                        break
+                    if max_wait is not None and now + delay > start + max_wait:
+                        raise RateLimitExceeded(delay)
+                    self._cond.wait(min(delay, 1.0))
+                self.tokens -= 1
+                if self.remaining is not None:
+                    self.remaining -= 1
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+            self.stats["acquired"] += 1
+            self.stats["waited_s"] += time.time() - start
+
+    def refund(self):
+        """Give back a request GitHub did not count (a 304 answer)."""
+        with self._cond:
+            self.tokens = min(float(self.burst), self.tokens + 1)
+            self._cond.notify_all()
+
+    def update(self, headers):
+        """Re-pace from the X-RateLimit-* headers of an answer."""
+        if "X-RateLimit-Remaining" not in headers or "X-RateLimit-Reset" not in headers:
+            return
+        with self._cond:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset_at = float(headers["X-RateLimit-Reset"])
+            if reset_at == self.reset_at and self.remaining is not None:
+                # Answers to concurrent requests arrive out of order; the lowest count is the freshest
+                remaining = min(remaining, self.remaining)
+            self.limit = int(headers.get("X-RateLimit-Limit") or 0) or None
+            self.remaining = remaining
+            self.reset_at = reset_at
+            window = max(self.reset_at - time.time(), 1.0)
+            self.rate = max(self.remaining - self._reserved(), 0) / window or 1e-3
+            self._cond.notify_all()
+
+    def block(self, delay):
+        """Hold every caller back for delay seconds (Retry-After, exhausted budget)."""
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.time() + delay)
+            self.stats["blocked"] += 1
+            self._cond.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(token, base_url, resource="core"):
+    """Return the process-wide limiter for token's resource budget on the API at base_url, creating it on first use."""
+    key = (token, base_url, resource)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter()
+        return limiter
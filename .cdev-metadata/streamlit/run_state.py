@@ -0,0 +1,113 @@
+"""Progress of pushes, plans and applies, kept outside the Streamlit session.
+
+Every step of a bootstrap is recorded under (repo, branch, commit SHA).
+A plan row covers the PR branch head: its PR, render fingerprint, run, job
+conclusions and plan summary. An apply row covers the merge commit on the
+base branch: its run and job, and once finished the conclusion and the tail
+of the apply log. A session that reloads, a restarted server or a teammate
+with the same configuration picks up from here. resume() finds the latest
+plan of a render and the apply of its PR. Finished steps are served from
+the file and are never polled again.
+"""
+import json
+import os
+import sqlite3
+import time
+
+RUN_STATE_DB = os.environ.get(
+    "CDEV_RUN_STATE_DB", os.path.join(os.path.expanduser("~"), ".cache", "cdev-streamlit", "run_state.sqlite3"))
+PLAN, APPLY = "plan", "apply"
+_COLUMNS = ("kind", "fingerprint", "pr_url", "run_id", "job_id", "run_url", "jobs", "conclusion", "summary",
+            "merged_sha", "log_tail", "profiled")
+_JSON_COLUMNS = ("jobs", "summary", "log_tail")
+
+
+class RunStateStore:
+    """SQLite file of bootstrap progress per (repo, branch, commit SHA)."""
+
+    def __init__(self, path=RUN_STATE_DB):
+        self.path = path
+
+    def _connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        db.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS run_state (
+                repo TEXT, branch TEXT, sha TEXT, kind TEXT, fingerprint TEXT, pr_url TEXT,
+                run_id TEXT, job_id TEXT, run_url TEXT, jobs TEXT, conclusion TEXT, summary TEXT,
+                merged_sha TEXT, log_tail TEXT, profiled INTEGER DEFAULT 0, updated_at REAL,
+                PRIMARY KEY (repo, branch, sha));
+            CREATE INDEX IF NOT EXISTS run_state_fingerprint ON run_state (repo, fingerprint, updated_at);
+            CREATE INDEX IF NOT EXISTS run_state_run ON run_state (repo, run_id);
+        """)
+        return db
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        row = dict(row)
+        for column in _JSON_COLUMNS:
+            if row[column] is not None:
+                row[column] = json.loads(row[column])
+        return row
+
+    def record(self, repo, branch, sha, **fields):
+        """Create or update the row of (repo, branch, sha); only the given fields change."""
+        unknown = set(fields) - set(_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown run state fields: {', '.join(sorted(unknown))}")
+        values = {key: json.dumps(value) if key in _JSON_COLUMNS and value is not None else value
+                  for key, value in fields.items()}
+        values["updated_at"] = time.time()
+        columns = ", ".join(values)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in values)
+        db = self._connect()
+        try:
+            with db:
+                db.execute(f"INSERT INTO run_state (repo, branch, sha, {columns}) "
+                           f"VALUES (?, ?, ?, {', '.join('?' * len(values))}) "
+                           f"ON CONFLICT (repo, branch, sha) DO UPDATE SET {updates}",
+                           (repo, branch, sha, *values.values()))
+        finally:
+            db.close()
+
+    def get(self, repo, branch, sha):
+        db = self._connect()
+        try:
+            return self._row(db.execute("SELECT * FROM run_state WHERE repo = ? AND branch = ? AND sha = ?",
+                                        (repo, branch, sha)).fetchone())
+        finally:
+            db.close()
+
+    def find(self, repo, **where):
+        """The most recently updated row of repo matching all where fields exactly, or None."""
+        unknown = set(where) - set(_COLUMNS + ("branch", "sha"))
+        if unknown:
+            raise ValueError(f"unknown run state fields: {', '.join(sorted(unknown))}")
+        clauses = "".join(f" AND {column} = ?" for column in where)
+        db = self._connect()
+        try:
+            return self._row(db.execute(f"SELECT * FROM run_state WHERE repo = ?{clauses} "
+                                        f"ORDER BY updated_at DESC LIMIT 1", (repo, *where.values())).fetchone())
+        finally:
+            db.close()
+
+    def find_pull_request(self, repo, number):
+        """The latest plan row of PR number."""
+        db = self._connect()
+        try:
+            return self._row(db.execute("SELECT * FROM run_state WHERE repo = ? AND kind = ? AND pr_url LIKE ? "
+                                        "ORDER BY updated_at DESC LIMIT 1",
+                                        (repo, PLAN, f"%/pull/{int(number)}")).fetchone())
+        finally:
+            db.close()
+
+    def resume(self, repo, fingerprint):
+        """{"plan": row, "apply": row} of the latest bootstrap of this render; rows are None if unknown."""
+        plan = self.find(repo, kind=PLAN, fingerprint=fingerprint)
+        apply = self.find(repo, kind=APPLY, pr_url=plan["pr_url"]) if plan and plan["pr_url"] else None
+        return {"plan": plan, "apply": apply}
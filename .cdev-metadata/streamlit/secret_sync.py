@@ -0,0 +1,216 @@
+"""Push GitHub Actions secrets to many repositories, environments and organizations at once.
+
+Rotating the AWS credentials of dozens of cluster repositories used to cost
+a public-key GET per secret and one PUT after another. sync_secrets() works
+in three passes instead:
+
+1. fetch the public key of every target concurrently, cached process-wide
+   per target so later syncs skip the GET;
+2. seal every value once per key_id, so targets that share a key (all
+   secrets of one organization) share the ciphertext;
+3. PUT all secrets to all targets concurrently.
+
+A 422 on a PUT means the target's key was rotated: the key is fetched again,
+the value sealed again and the PUT retried once. The result is a report
+per target of what was written and what failed.
+
+    AWS_ACCESS_KEY_ID=... AWS_SECRET_ACCESS_KEY=... GITHUB_TOKEN=... \\
+        python secret_sync.py --repos-file repos.txt --secret AWS_ACCESS_KEY_ID --secret AWS_SECRET_ACCESS_KEY
+    python secret_sync.py --repo my-org/infra --environment production --secret AWS_ACCESS_KEY_ID
+    python secret_sync.py --org my-org --visibility private --secret AWS_ACCESS_KEY_ID=ROTATED_KEY_ID
+"""
+import argparse
+import base64
+import hashlib
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from github_utils import get_client
+
+MAX_WORKERS = 8
+ORG_VISIBILITIES = ("all", "private", "selected")
+
+_public_keys = {}  # (api url, key path) -> (key_id, base64 key)
+_public_keys_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class SecretTarget:
+    """Where secrets go: a repository, one of its environments, or an organization."""
+    repo: str = None
+    environment: str = None
+    org: str = None
+    visibility: str = "private"  # organization secrets only
+    selected_repository_ids: tuple = ()  # with visibility "selected"
+
+    @property
+    def label(self):
+        if self.org is not None:
+            return f"org {self.org}"
+        return f"{self.repo} ({self.environment})" if self.environment is not None else self.repo
+
+    @property
+    def secrets_path(self):
+        if self.org is not None:
+            return f"orgs/{self.org}/actions/secrets"
+        if self.environment is not None:
+            return f"repos/{self.repo}/environments/{self.environment}/secrets"
+        return f"repos/{self.repo}/actions/secrets"
+
+    def body(self, encrypted_value, key_id):
+        body = {"encrypted_value": encrypted_value, "key_id": key_id}
+        if self.org is not None:
+            body["visibility"] = self.visibility
+            if self.visibility == "selected":
+                body["selected_repository_ids"] = list(self.selected_repository_ids)
+        return body
+
+
+def _message(response):
+    try:
+        return response.json().get('message', 'Unknown error')
+    except ValueError:
+        return 'Unknown error'
+
+
+def public_key(client, target, refresh=False):
+    """(key_id, base64 key) of the target; cached until refresh. Returns (None, error message) on failure."""
+    cache_key = (client.base_url, target.secrets_path)
+    with _public_keys_lock:
+        if not refresh and cache_key in _public_keys:
+            return _public_keys[cache_key]
+    response = client.get(f"{target.secrets_path}/public-key")
+    if response.status_code != 200:
+        return None, f"Failed to get public key. GitHub says: {_message(response)}"
+    data = response.json()
+    with _public_keys_lock:
+        _public_keys[cache_key] = (data['key_id'], data['key'])
+    return data['key_id'], data['key']
+
+
+def seal(key, value):
+    from nacl import public
+
+    sealed_box = public.SealedBox(public.PublicKey(base64.b64decode(key)))
+    return base64.b64encode(sealed_box.encrypt(value.encode())).decode()
+
+
+class _Sealer:
+    # Ciphertext per (key_id, secret name, value digest), for one sync only: no sealed values outlive it
+
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.sealed = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, key_id, key, name):
+        value = self.secrets[name]
+        cache_key = (key_id, name, hashlib.sha256(value.encode()).digest())
+        with self.lock:
+            if cache_key not in self.sealed:
+                self.sealed[cache_key] = seal(key, value)
+            return self.sealed[cache_key]
+
+
+def _put(client, target, name, key, sealer):
+    key_id, encoded = key
+    for attempt in range(2):
+        body = target.body(sealer(key_id, encoded, name), key_id)
+        response = client.put(f"{target.secrets_path}/{name}", json=body)
+        if response.status_code in (201, 204):
+            return None
+        if response.status_code != 422 or attempt:
+            break
+        # The target's key was rotated since it was cached
+        key_id, encoded = public_key(client, target, refresh=True)
+        if key_id is None:
+            return encoded
+    return f"Failed to create/update secret. GitHub says: {_message(response)}"
+
+
+def sync_secrets(token, targets, secrets, max_workers=MAX_WORKERS):
+    """Write {name: value} to every target concurrently.
+
+    Returns {target label: {"ok": [names], "failed": {name: error message}}},
+    in the order of targets.
+    """
+    client = get_client(token)
+    targets = list(dict.fromkeys(targets))
+    report = {target.label: {"ok": [], "failed": {}} for target in targets}
+    sealer = _Sealer(secrets)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cdev-secrets") as pool:
+        keys = dict(zip(targets, pool.map(lambda target: public_key(client, target), targets)))
+        writes = []
+        for target in targets:
+            key_id, key_or_error = keys[target]
+            for name in secrets:
+                if key_id is None:
+                    report[target.label]["failed"][name] = key_or_error
+                else:
+                    writes.append((target, name, pool.submit(_put, client, target, name, keys[target], sealer)))
+        for target, name, future in writes:
+            try:
+                error = future.result()
+            except Exception as e:
+                error = f"Failed to create/update secret: {e}"
+            if error:
+                report[target.label]["failed"][name] = error
+            else:
+                report[target.label]["ok"].append(name)
+    return report
+
+
+def _read_secrets(specs):
+    # NAME takes the value of the environment variable NAME, NAME=VAR the value of VAR
+    secrets = {}
+    for spec in specs:
+        name, _, variable = spec.partition("=")
+        value = os.environ.get(variable or name)
+        if value is None:
+            raise SystemExit(f"Environment variable {variable or name} for secret {name} is not set.")
+        secrets[name] = value
+    return secrets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repo", action="append", default=[], help="target repository, repeatable")
+    parser.add_argument("--repos-file", help="file with one repository per line")
+    parser.add_argument("--environment", help="write to this environment of every repository instead")
+    parser.add_argument("--org", action="append", default=[], help="target organization, repeatable")
+    parser.add_argument("--visibility", choices=ORG_VISIBILITIES, default="private",
+                        help="organization secret visibility")
+    parser.add_argument("--secret", action="append", required=True,
+                        help="NAME or NAME=ENV_VAR, the value is read from the environment; repeatable")
+    parser.add_argument("--token-env", default="GITHUB_TOKEN", help="environment variable holding the GitHub token")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args(argv)
+
+    repos = list(args.repo)
+    if args.repos_file:
+        with open(args.repos_file) as f:
+            repos += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    targets = [SecretTarget(repo=repo, environment=args.environment) for repo in repos]
+    targets += [SecretTarget(org=org, visibility=args.visibility) for org in args.org]
+    if not targets:
+        parser.error("give at least one --repo, --repos-file or --org")
+    token = os.environ.get(args.token_env)
+    if not token:
+        parser.error(f"{args.token_env} is not set")
+
+    report = sync_secrets(token, targets, _read_secrets(args.secret), max_workers=args.workers)
+    failed = 0
+    for label, result in report.items():
+        print(f"{label}: {len(result['ok'])} written" + (f", {len(result['failed'])} failed" if result["failed"] else ""))
+        for name, message in result["failed"].items():
+            print(f"  {name}: {message}")
+        failed += bool(result["failed"])
+    print(f"{len(report) - failed} of {len(report)} targets up to date.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
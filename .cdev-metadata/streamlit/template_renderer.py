@@ -0,0 +1,566 @@
+"""Offline renderer for cluster.dev stack templates.
+
+Implements the subset of Go text/template, sprig and cdev functions used by
+template.yaml and the examples, so a stack can be expanded and checked
+without running cdev:
+
+    result = render_stack_file("examples/stack-eks.yaml")
+    result.text        # the expanded units, as cdev would see them
+    result.missing     # variables the template reads but the stack lacks
+    result.references  # remoteState/output references between units
+
+remoteState and output references are rendered as ${remoteState:path}
+placeholders; cdev resolves them at apply time. Parsed templates are cached
+by source text, so re-rendering with new variables only pays for execution.
+"""
+import ipaddress
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import yaml
+
+from metrics import timed
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+# Template sources that refer to this repository
+LOCAL_TEMPLATE_SOURCES = ("github.com/shalb/cdev-aws-eks",)
+NO_VALUE = "<no value>"
+
+
+class TemplateError(Exception):
+    pass
+
+
+# -- parsing ----------------------------------------------------------------
+
+_ACTION_RE = re.compile(r"\{\{(-[ \t\r\n])?(.*?)([ \t\r\n]-)?\}\}", re.S)
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<raw>`[^`]*`)
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<declare>:=)
+  | (?P<assign>=)
+  | (?P<pipe>\|)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<comma>,)
+  | (?P<var>\$[A-Za-z0-9_]*(?:\.[A-Za-z0-9_]+)*)
+  | (?P<field>(?:\.[A-Za-z0-9_]+)+|\.)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+""", re.X)
+
+
+@dataclass
+class _Pipeline:
+    commands: list
+    decl: list = field(default_factory=list)
+    assign: bool = False
+
+
+@dataclass
+class _Node:
+    kind: str                      # text, action, if, range, with
+    value: object = None           # text or pipeline
+    body: list = field(default_factory=list)
+    else_body: list = field(default_factory=list)
+    line: int = 0
+
+
+def _tokenize(source, line):
+    tokens = []
+    pos = 0
+    while pos < len(source):
+        m = _TOKEN_RE.match(source, pos)
+        if not m:
+            raise TemplateError(f"line {line}: unexpected {source[pos:pos + 10]!r}")
+        pos = m.end()
+        if m.lastgroup != "space":
+            tokens.append((m.lastgroup, m.group()))
+    return tokens
+
+
+def _parse_pipeline(tokens, line):
+    decl, assign = [], False
+    for i, (kind, _) in enumerate(tokens):
+        if kind in ("declare", "assign"):
+            names = [value for k, value in tokens[:i] if k != "comma"]
+            if not names or any(k not in ("var", "comma") for k, _ in tokens[:i]):
+                raise TemplateError(f"line {line}: bad variable declaration")
+            decl, assign, tokens = names, kind == "assign", tokens[i + 1:]
+            break
+        if kind not in ("var", "comma"):
+            break
+    commands, _ = _parse_commands(tokens, 0, line)
+    if not commands:
+        raise TemplateError(f"line {line}: missing value")
+    return _Pipeline(commands, decl, assign)
+
+
+def _parse_commands(tokens, pos, line):
+    commands, operands = [], []
+    while pos < len(tokens):
+        kind, value = tokens[pos]
+        pos += 1
+        if kind == "pipe":
+            if not operands:
+                raise TemplateError(f"line {line}: empty command in pipeline")
+            commands.append(operands)
+            operands = []
+        elif kind == "rparen":
+            break
+        elif kind == "lparen":
+            sub, pos = _parse_commands(tokens, pos, line)
+            operands.append(("pipeline", _Pipeline(sub)))
+        elif kind == "string":
+            operands.append(("const", json.loads(value)))
+        elif kind == "raw":
+            operands.append(("const", value[1:-1]))
+        elif kind == "number":
+            operands.append(("const", float(value) if "." in value else int(value)))
+        elif kind == "ident" and value in ("true", "false"):
+            operands.append(("const", value == "true"))
+        elif kind == "ident" and value == "nil":
+            operands.append(("const", None))
+        elif kind in ("ident", "var", "field"):
+            operands.append((kind, value))
+        else:
+            raise TemplateError(f"line {line}: unexpected {value!r}")
+    if operands:
+        commands.append(operands)
+    return commands, pos
+
+
+def _lex(text):
+    """Split text into text and action items, applying {{- and -}} trimming."""
+    items = []
+    pos = 0
+    for m in _ACTION_RE.finditer(text):
+        items.append(["text", text[pos:m.start()], 0])
+        if m.group(1) and items[-1][0] == "text":
+            items[-1][1] = items[-1][1].rstrip()
+        items.append(["action", m.group(2).strip(), text.count("\n", 0, m.start()) + 1, bool(m.group(3))])
+        pos = m.end()
+    items.append(["text", text[pos:], 0])
+    for i, item in enumerate(items):
+        if item[0] == "action" and item[3]:
+            items[i + 1][1] = items[i + 1][1].lstrip()
+    return [item[:3] for item in items if item[0] == "action" or item[1]]
+
+
+class _Parser:
+
+    def __init__(self, items):
+        self.items = items
+        self.pos = 0
+
+    def parse_list(self, stop):
+        """Parse nodes until one of the stop keywords; returns (nodes, closing action text)."""
+        nodes = []
+        while self.pos < len(self.items):
+            kind, value, line = self.items[self.pos]
+            self.pos += 1
+            if kind == "text":
+                nodes.append(_Node("text", value))
+                continue
+            if value.startswith("/*"):
+                continue
+            keyword = value.split(None, 1)[0] if value else ""
+            if keyword in ("end", "else"):
+                if keyword not in stop:
+                    raise TemplateError(f"line {line}: unexpected {{{{{keyword}}}}}")
+                return nodes, value
+            if keyword in ("if", "range", "with"):
+                nodes.append(self.parse_branch(keyword, value[len(keyword):], line))
+                continue
+            nodes.append(_Node("action", _parse_pipeline(_tokenize(value, line), line), line=line))
+        if stop:
+            raise TemplateError(f"missing {{{{end}}}} (expected one of {stop})")
+        return nodes, None
+
+    def parse_branch(self, keyword, source, line):
+        node = _Node(keyword, _parse_pipeline(_tokenize(source, line), line), line=line)
+        node.body, closing = self.parse_list(("end", "else"))
+        if closing.startswith("else"):
+            rest = closing[4:].strip()
+            if rest.startswith("if ") or rest.startswith("with "):
+                # {{ else if ... }} is a nested branch sharing the outer {{ end }}
+                nested = rest.split(None, 1)[0]
+                node.else_body = [self.parse_branch(nested, rest[len(nested):], line)]
+            else:
+                node.else_body, _ = self.parse_list(("end",))
+        return node
+
+
+@lru_cache(maxsize=64)
+def parse_template(text):
+    """Parse template text into a node tree; cached by text."""
+    nodes, _ = _Parser(_lex(text)).parse_list(())
+    return nodes
+
+
+@lru_cache(maxsize=64)
+def _load_template(path, mtime):
+    with open(path) as f:
+        return parse_template(f.read())
+
+
+def load_template(path):
+    """Parse the template file at path; re-parsed only when the file changes."""
+    return _load_template(os.path.abspath(path), os.path.getmtime(path))
+
+
+# -- execution --------------------------------------------------------------
+
+@dataclass
+class RenderResult:
+    text: str
+    missing: list = field(default_factory=list)
+    references: list = field(default_factory=list)
+
+
+def go_str(value):
+    """Format a value the way text/template prints it."""
+    if value is None:
+        return NO_VALUE
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (list, tuple)):
+        return "[" + " ".join(go_str(v) for v in value) + "]"
+    if isinstance(value, dict):
+        return "map[" + " ".join(f"{k}:{go_str(v)}" for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))) + "]"
+    return str(value)
+
+
+def truthy(value):
+    if isinstance(value, bool):
+        return value
+    return value not in (None, 0, "") and not (isinstance(value, (list, tuple, dict)) and not value)
+
+
+def _printf(fmt, *args):
+    args = iter(args)
+
+    def verb(m):
+        spec = m.group()
+        if spec == "%%":
+            return "%"
+        value = next(args, None)
+        kind = spec[-1]
+        if kind == "q":
+            return json.dumps(go_str(value))
+        if kind in "dfeg" and isinstance(value, (int, float)):
+            return spec % value
+        return (spec[:-1] + "s") % go_str(value)
+
+    return re.sub(r"%[-+# 0]*\d*(?:\.\d+)?[a-zA-Z%]", verb, fmt)
+
+
+def _cidr_subnet(prefix, newbits, netnum):
+    network = ipaddress.ip_network(prefix)
+    new_prefix = network.prefixlen + int(newbits)
+    size = 2 ** (network.max_prefixlen - new_prefix)
+    if int(netnum) >= 2 ** int(newbits):
+        raise TemplateError(f"cidrSubnet: prefix extension of {newbits} does not accommodate subnet number {netnum}")
+    return str(ipaddress.ip_network((int(network.network_address) + int(netnum) * size, new_prefix)))
+
+
+def _indent(spaces, text):
+    pad = " " * int(spaces)
+    return pad + str(text).replace("\n", "\n" + pad)
+
+
+def _to_yaml(value):
+    return yaml.safe_dump(value, default_flow_style=False, sort_keys=True).rstrip("\n")
+
+
+def _eq(a, *others):
+    return any(a == b for b in others)
+
+
+class _Context:
+
+    def __init__(self, data, base_dir):
+        self.root = data
+        self.base_dir = base_dir
+        self.missing = []
+        # Missing lookups of the pipeline being evaluated; only kept if its value is printed
+        self.lookups = []
+        self.references = []
+        self.scopes = [{"$": data}]
+        self.functions = {
+            "list": lambda *args: list(args),
+            "dict": lambda *args: dict(zip(args[::2], args[1::2])),
+            "printf": _printf,
+            "print": lambda *args: "".join(go_str(a) for a in args),
+            "len": lambda value: len(value or ()),
+            "add": lambda *args: sum(int(a) for a in args),
+            "sub": lambda a, b: int(a) - int(b),
+            "mul": lambda *args: _product(args),
+            "div": lambda a, b: int(a) // int(b),
+            "mod": lambda a, b: int(a) % int(b),
+            "eq": _eq,
+            "ne": lambda a, b: a != b,
+            "lt": lambda a, b: a < b,
+            "le": lambda a, b: a <= b,
+            "gt": lambda a, b: a > b,
+            "ge": lambda a, b: a >= b,
+            "not": lambda value: not truthy(value),
+            "and": lambda *args: next((a for a in args if not truthy(a)), args[-1]),
+            "or": lambda *args: next((a for a in args if truthy(a)), args[-1]),
+            "default": lambda default, value=None: value if truthy(value) else default,
+            "empty": lambda value: not truthy(value),
+            "hasKey": lambda mapping, key: key in (mapping or {}),
+            "quote": lambda *args: " ".join(json.dumps(go_str(a)) for a in args if a is not None),
+            "squote": lambda *args: " ".join(f"'{go_str(a)}'" for a in args if a is not None),
+            "upper": lambda s: go_str(s).upper(),
+            "lower": lambda s: go_str(s).lower(),
+            "trim": lambda s: go_str(s).strip(),
+            "replace": lambda old, new, s: go_str(s).replace(old, new),
+            "join": lambda sep, values: sep.join(go_str(v) for v in values or ()),
+            "indent": _indent,
+            "nindent": lambda spaces, text: "\n" + _indent(spaces, text),
+            "toYaml": _to_yaml,
+            "toJson": lambda value: json.dumps(value, sort_keys=True),
+            "cidrSubnet": _cidr_subnet,
+            "insertYAML": lambda value: json.dumps(value, sort_keys=True),
+            "readFile": self._read_file,
+            "remoteState": lambda path: self._reference("remoteState", path),
+            "output": lambda path: self._reference("output", path),
+        }
+
+    def _read_file(self, path):
+        with open(os.path.join(self.base_dir, path)) as f:
+            return f.read()
+
+    def _reference(self, kind, path):
+        self.references.append((kind, path))
+        return f"${{{kind}:{path}}}"
+
+    def lookup_var(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        raise TemplateError(f"undefined variable {name}")
+
+    def set_var(self, name, value, declare):
+        if declare:
+            self.scopes[-1][name] = value
+            return
+        for scope in reversed(self.scopes):
+            if name in scope:
+                scope[name] = value
+                return
+        raise TemplateError(f"undefined variable {name}")
+
+    def fields(self, value, path, label):
+        for name in path:
+            if isinstance(value, dict) and name in value:
+                value = value[name]
+                label += "." + name
+                continue
+            self.lookups.append(label + "." + name)
+            return None
+        return value
+
+
+def _product(args):
+    result = 1
+    for a in args:
+        result *= int(a)
+    return result
+
+
+def _eval_operand(ctx, operand, dot):
+    kind, value = operand
+    if kind == "const":
+        return value
+    if kind == "pipeline":
+        return _eval_pipeline(ctx, value, dot)
+    if kind == "field":
+        if value == ".":
+            return dot
+        return ctx.fields(dot, value[1:].split("."), "")
+    if kind == "var":
+        name, *path = value.split(".")
+        return ctx.fields(ctx.lookup_var(name), path, name)
+    if kind == "ident":
+        return _call(ctx, value, [])
+    raise TemplateError(f"cannot evaluate {value!r}")
+
+
+def _call(ctx, name, args):
+    function = ctx.functions.get(name)
+    if function is None:
+        raise TemplateError(f'function "{name}" not defined')
+    try:
+        return function(*args)
+    except TemplateError:
+        raise
+    except Exception as e:
+        raise TemplateError(f"error calling {name}: {e}")
+
+
+def _eval_pipeline(ctx, pipeline, dot):
+    value = None
+    for i, command in enumerate(pipeline.commands):
+        first_kind, first_value = command[0]
+        if first_kind == "ident" and first_value not in ("true", "false", "nil"):
+            args = [_eval_operand(ctx, operand, dot) for operand in command[1:]]
+            if i > 0:
+                args.append(value)
+            value = _call(ctx, first_value, args)
+        else:
+            if len(command) > 1 or i > 0:
+                raise TemplateError(f"can't give argument to non-function {first_value}")
+            value = _eval_operand(ctx, command[0], dot)
+    for name in pipeline.decl[-1:] if pipeline.decl else ():
+        ctx.set_var(name, value, not pipeline.assign)
+    return value
+
+
+def _execute(ctx, nodes, dot, out):
+    for node in nodes:
+        try:
+            _execute_node(ctx, node, dot, out)
+        except TemplateError as e:
+            if node.line and not str(e).startswith("line "):
+                raise TemplateError(f"line {node.line}: {e}") from None
+            raise
+
+
+def _execute_node(ctx, node, dot, out):
+    if node.kind == "text":
+        out.append(node.value)
+    elif node.kind == "action":
+        ctx.lookups = []
+        value = _eval_pipeline(ctx, node.value, dot)
+        if not node.value.decl:
+            out.append(go_str(value))
+            ctx.missing.extend(ctx.lookups)
+    elif node.kind in ("if", "with"):
+        ctx.scopes.append({})
+        value = _eval_pipeline(ctx, node.value, dot)
+        if truthy(value):
+            _execute(ctx, node.body, value if node.kind == "with" else dot, out)
+        else:
+            _execute(ctx, node.else_body, dot, out)
+        ctx.scopes.pop()
+    elif node.kind == "range":
+        pipeline = node.value
+        ctx.scopes.append({})
+        collection = _eval_pipeline(ctx, _Pipeline(pipeline.commands), dot)
+        if isinstance(collection, dict):
+            pairs = sorted(collection.items(), key=lambda kv: str(kv[0]))
+        elif isinstance(collection, int):
+            pairs = [(i, i) for i in range(collection)]
+        else:
+            pairs = list(enumerate(collection or ()))
+        for key, item in pairs:
+            if len(pipeline.decl) == 2:
+                ctx.scopes[-1][pipeline.decl[0]] = key
+                ctx.scopes[-1][pipeline.decl[1]] = item
+            elif pipeline.decl:
+                ctx.scopes[-1][pipeline.decl[0]] = item
+            _execute(ctx, node.body, item, out)
+        if not pairs:
+            _execute(ctx, node.else_body, dot, out)
+        ctx.scopes.pop()
+
+
+def render(nodes, data, base_dir="."):
+    """Execute a parsed template against data and return a RenderResult."""
+    ctx = _Context(data, base_dir)
+    out = []
+    _execute(ctx, nodes, data, out)
+    return RenderResult("".join(out), sorted(set(ctx.missing)), ctx.references)
+
+
+def render_text(text, data, base_dir="."):
+    return render(parse_template(text), data, base_dir)
+
+
+# -- stacks -----------------------------------------------------------------
+
+def resolve_template_dir(source, base_dir):
+    """Map a stack's template: source to a local directory."""
+    if any(s in source for s in LOCAL_TEMPLATE_SOURCES):
+        return REPO_ROOT
+    if "://" in source or source.startswith("github.com/"):
+        raise TemplateError(f"remote template {source} is not available offline")
+    return os.path.normpath(os.path.join(base_dir, source))
+
+
+def load_project(project_dir):
+    """Return the Project object (as a dict) from the first kind: Project file in project_dir."""
+    for name in sorted(os.listdir(project_dir)):
+        if name.endswith((".yaml", ".yml")):
+            with open(os.path.join(project_dir, name)) as f:
+                text = f.read()
+            if re.search(r"^kind:\s*Project\s*$", text, re.M):
+                return yaml.safe_load(render_text(text, {}, project_dir).text)
+    return {}
+
+
+@timed()
+def render_stack(stack_text, project, base_dir):
+    """Render a stack file and the stack template it points to.
+
+    Returns a RenderResult for the expanded template; its missing and
+    references cover both the stack file and the template.
+    """
+    stack_result = render_text(stack_text, {"project": project}, base_dir)
+    stack = yaml.safe_load(stack_result.text)
+    template_dir = resolve_template_dir(stack["template"], base_dir)
+    template_path = os.path.join(template_dir, "template.yaml")
+    data = {"name": stack.get("name"), "variables": stack.get("variables") or {}}
+    result = render(load_template(template_path), data, template_dir)
+    result.missing = sorted(set(stack_result.missing + result.missing))
+    result.references = stack_result.references + result.references
+    return result
+
+
+def render_stack_file(path, project=None):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if project is None:
+        project = load_project(base_dir)
+    with open(path) as f:
+        return render_stack(f.read(), project, base_dir)
+
+
+def find_stack_files(project_dir):
+    stacks = []
+    for name in sorted(os.listdir(project_dir)):
+        path = os.path.join(project_dir, name)
+        if name.endswith((".yaml", ".yml")) and os.path.isfile(path):
+            with open(path) as f:
+                if re.search(r"^kind:\s*Stack\s*$", f.read(), re.M):
+                    stacks.append(path)
+    return stacks
+
+
+@timed()
+def render_project(project_dir, workers=None):
+    """Render every stack in project_dir in a process pool; returns {stack file: RenderResult}."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    project = load_project(project_dir)
+    stacks = find_stack_files(project_dir)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(render_stack_file, stacks, [project] * len(stacks))
+        return dict(zip(stacks, results))
+
+
+if __name__ == "__main__":
+    import sys
+
+    for stack_path, result in render_project(sys.argv[1] if len(sys.argv) > 1 else os.path.join(REPO_ROOT, "examples")).items():
+        print(f"# --- {os.path.relpath(stack_path)}")
+        for name in result.missing:
+            print(f"# missing variable: {name}")
+        print(result.text)
@@ -0,0 +1,30 @@
+"""The performance budgets of benchmark.py, checked on every test run.
+
+    python -m pytest -q test_budgets.py
+"""
+import benchmark
+
+
+def test_flows_within_budgets():
+    results = benchmark.bench_flows()
+    assert set(results) == set(benchmark.FLOW_BUDGETS)
+    assert benchmark.check_budgets(results) == []
+
+
+def test_flows_recover_from_errors():
+    # A 5xx on a GET and a secondary rate limit on the PR cost calls, not the flows
+    results = benchmark.bench_flows(errors=True)
+    assert set(results) == set(benchmark.FLOW_BUDGETS)
+    assert results["push"]["api_calls"] > benchmark.FLOW_BUDGETS["push"]["api_calls"]
+
+
+def test_flows_restore_globals():
+    saved = benchmark.github_utils.API_URL, benchmark.watcher.POLL_INITIAL, benchmark.watcher.POLL_MAXIMUM
+    benchmark.bench_flows()
+    assert (benchmark.github_utils.API_URL, benchmark.watcher.POLL_INITIAL, benchmark.watcher.POLL_MAXIMUM) == saved
+
+
+def test_imports_within_budgets():
+    # A heavy top-level import in interface.py or a library module shows up here
+    results = benchmark.bench_imports(repeat=3)
+    assert benchmark.check_budgets(results, benchmark.IMPORT_BUDGETS) == []
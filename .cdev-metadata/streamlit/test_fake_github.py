@@ -0,0 +1,72 @@
+"""The fake API behaviours the benchmarks and budgets rely on."""
+import pytest
+import requests
+
+from fake_github import FakeGitHub
+
+
+@pytest.fixture
+def fake():
+    with FakeGitHub(rate_limit=10) as fake:
+        yield fake
+
+
+def get(fake, path, **kwargs):
+    return requests.get(f"{fake.url}/repos/{fake.repo}/{path}", **kwargs)
+
+
+def test_pagination_follows_github(fake):
+    for i in range(5):
+        fake.add_run(f"cluster.dev-{i}")
+    first = get(fake, "actions/runs", params={"per_page": 2})
+    assert first.json()["total_count"] == 5
+    assert len(first.json()["workflow_runs"]) == 2
+    assert set(first.links) == {"next", "last"}
+    assert first.links["last"]["url"].endswith("page=3")
+    last = requests.get(first.links["last"]["url"])
+    assert len(last.json()["workflow_runs"]) == 1
+    assert "next" not in last.links
+
+
+def test_etag_answers_304_without_counting(fake):
+    first = get(fake, "git/ref/heads/main")
+    remaining = int(first.headers["X-RateLimit-Remaining"])
+    again = get(fake, "git/ref/heads/main", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert int(again.headers["X-RateLimit-Remaining"]) == remaining
+    assert fake.stats()["not_modified"] == 1
+    fake.refs["main"] = "0" * 40
+    assert get(fake, "git/ref/heads/main", headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
+
+
+def test_rate_limit_headers_and_exhaustion(fake):
+    r = get(fake, "git/ref/heads/main")
+    assert r.headers["X-RateLimit-Limit"] == "10"
+    assert r.headers["X-RateLimit-Remaining"] == "9"
+    assert r.headers["X-RateLimit-Used"] == "1"
+    assert r.headers["X-RateLimit-Resource"] == "core"
+    assert requests.post(f"{fake.url}/graphql", json={"query": "{}"}).headers["X-RateLimit-Resource"] == "graphql"
+    for _ in range(8):
+        get(fake, "git/ref/heads/main")
+    r = get(fake, "git/ref/heads/main")
+    assert r.status_code == 403
+    assert r.headers["X-RateLimit-Remaining"] == "0"
+    assert float(r.headers["X-RateLimit-Reset"]) > 0
+    assert fake.stats()["rate_limited"] == 1
+
+
+def test_injected_errors_count_down(fake):
+    fake.inject_error("GET", r"/git/ref/heads/main$", status=503, count=2, retry_after=3)
+    answers = [get(fake, "git/ref/heads/main") for _ in range(3)]
+    assert [r.status_code for r in answers] == [503, 503, 200]
+    assert answers[0].headers["Retry-After"] == "3"
+    assert answers[0].json() == {"message": "Server Error"}
+
+
+def test_lost_error_carries_out_the_request(fake):
+    fake.inject_error("POST", r"/git/refs$", lost=True)
+    r = requests.post(f"{fake.url}/repos/{fake.repo}/git/refs",
+                      json={"ref": "refs/heads/lost", "sha": fake.refs["main"]})
+    assert r.status_code == 502
+    assert fake.refs["lost"] == fake.refs["main"]
+    assert fake.stats()["calls"] == 1
@@ -0,0 +1,30 @@
+"""Fleet specs: every project ends up with its own cluster."""
+import fleet
+
+
+def names(clusters):
+    return [(project.name, stack.cluster_name) for project, stack in clusters]
+
+
+def test_csv_cluster_name_defaults_to_project(tmp_path):
+    spec = tmp_path / "fleet.csv"
+    spec.write_text("name,region,cluster_name\nteam-a,eu-west-1,\nteam-b,eu-west-1,shared-b\n")
+    _, clusters = fleet.load_fleet_spec(str(spec))
+    assert names(clusters) == [("team-a", "team-a"), ("team-b", "shared-b")]
+
+
+def test_csv_without_cluster_name_column(tmp_path):
+    spec = tmp_path / "fleet.csv"
+    spec.write_text("name,region\nteam-a,eu-west-1\nteam-b,eu-west-1\n")
+    _, clusters = fleet.load_fleet_spec(str(spec))
+    assert names(clusters) == [("team-a", "team-a"), ("team-b", "team-b")]
+
+
+def test_yaml_regions_get_their_own_names(tmp_path):
+    spec = tmp_path / "fleet.yaml"
+    spec.write_text("defaults:\n  region: eu-west-1\nprojects:\n"
+                    "  - name: team-a\n    regions: [eu-west-1, us-east-1]\n"
+                    "  - name: team-b\n    cluster_name: b\n")
+    _, clusters = fleet.load_fleet_spec(str(spec))
+    assert names(clusters) == [("team-a-eu-west-1", "team-a-eu-west-1"), ("team-a-us-east-1", "team-a-us-east-1"),
+                               ("team-b", "b")]
@@ -0,0 +1,47 @@
+"""GitHubClient against the fake API: what is retried and what is sent once."""
+import pytest
+
+import github_utils
+from fake_github import FakeGitHub
+from github_utils import GitHubClient, get_workflow_status
+
+
+@pytest.fixture
+def fake():
+    with FakeGitHub() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(fake):
+    client = GitHubClient("test-token", base_url=fake.url, backoff_factor=0, limiter=False)
+    yield client
+    client.close()
+
+
+def test_get_retried_on_5xx(fake, client):
+    fake.inject_error("GET", r"/git/ref/heads/main$", status=502, count=2)
+    assert client.get(f"repos/{fake.repo}/git/ref/heads/main").status_code == 200
+    assert fake.stats()["calls"] == 3
+
+
+def test_merge_put_sent_once_on_5xx(fake, client):
+    fake.inject_error("PUT", r"/pulls/1/merge$", status=502)
+    assert client.put(f"repos/{fake.repo}/pulls/1/merge").status_code == 502
+    assert fake.stats()["by_route"] == {"PUT injected error": 1}
+
+
+def test_secret_put_sent_once_on_5xx(fake, client):
+    fake.inject_error("PUT", r"/actions/secrets/\w+$", status=502)
+    r = client.put(f"repos/{fake.repo}/actions/secrets/AWS_ACCESS_KEY_ID", json={"encrypted_value": "x", "key_id": "1"})
+    assert r.status_code == 502
+    assert fake.stats()["calls"] == 1
+
+
+def test_workflow_status_follows_the_pull_request_run(fake, monkeypatch):
+    monkeypatch.setattr(github_utils, "API_URL", fake.url)
+    plan = fake.add_run("feature", status="completed", conclusion="success")
+    fake.add_run("feature", status="completed", conclusion="failure", event="push")
+    jobs = get_workflow_status(fake.repo, "test-token", "feature", timeout=5)
+    assert {job["run_id"] for job in jobs} == {plan["id"]}
+    assert {job["status"] for job in jobs} == {"success"}
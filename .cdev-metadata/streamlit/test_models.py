@@ -0,0 +1,35 @@
+"""The generated workflow: which plan an apply may reuse."""
+import yaml
+
+import models
+
+
+def steps(job):
+    workflow = yaml.safe_load(models.render_workflow_file(models.ProjectConfig()))
+    return {step["name"]: step for step in workflow["jobs"][job]["steps"]}
+
+
+def test_plan_artifact_names_tree_and_template():
+    saved = steps("plan")["Save the plan"]["with"]["name"]
+    assert saved.endswith("${{ steps.tree.outputs.sha }}-${{ steps.tree.outputs.template }}")
+    assert steps("apply")["Download the plan"]["with"]["name"] == saved
+    assert f"name: '{saved}'" in steps("apply")["Find the plan of this tree"]["with"]["script"]
+
+
+def test_template_version_resolved_from_the_stack_template_ref():
+    repo, _, ref = models.STACK_TEMPLATE.partition("?ref=")
+    for job in ("plan", "apply"):
+        assert f"git ls-remote {repo} {ref}" in steps(job)["Find the project tree and template version"]["run"]
+
+
+def test_apply_reuses_only_the_merged_pull_requests_recent_plan():
+    script = steps("apply")["Find the plan of this tree"]["with"]["script"]
+    assert "pull.merge_commit_sha === context.sha" in script
+    assert "artifact.workflow_run.head_sha === pull.head.sha" in script
+    assert f"< {models.PLAN_REUSE_MAX_AGE_HOURS} * 3600 * 1000" in script
+
+
+def test_apply_skips_only_on_a_clean_successful_plan():
+    run = steps("apply")["Run ClusterDev Apply"]["run"]
+    assert "s/^status=//p" in run and "s/^changes=//p" in run
+    assert "No changes" not in run
@@ -0,0 +1,126 @@
+"""Resuming the bootstrap pipeline after a failed stage, against the fake API.
+
+Every stage fails once, either outright or with lost=True (GitHub did the
+work, the answer never arrived). The retry has to continue from the
+checkpoint: no second branch, PR or plan run, and only the calls that are
+left to make.
+"""
+import pytest
+
+import github_utils
+import models
+import pipeline
+import watcher
+from fake_github import FakeGitHub
+from run_state import RunStateStore
+
+TOKEN = "pipeline-token"
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    with FakeGitHub() as fake:
+        monkeypatch.setattr(github_utils, "API_URL", fake.url)
+        monkeypatch.setattr(watcher, "POLL_INITIAL", 0.05)
+        monkeypatch.setattr(watcher, "POLL_MAXIMUM", 0.1)
+        yield fake
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RunStateStore(str(tmp_path / "run_state.sqlite3"))
+
+
+@pytest.fixture
+def files():
+    return models.render_files(models.ProjectConfig(), models.StackConfig())
+
+
+def calls(fake, method=None, route=""):
+    """Calls since the last look, optionally only those of method on a route pattern ending in route."""
+    by_route = fake.stats()["by_route"]
+    fake.reset_stats()
+    return sum(count for key, count in by_route.items()
+               if method is None or (key.startswith(method + " ") and key.endswith(route)))
+
+
+def branches(fake):
+    return sorted(branch for branch in fake.refs if branch.startswith("cluster.dev-"))
+
+
+def push(fake, files, store):
+    return pipeline.push(fake.repo, TOKEN, files, "main", store=store)
+
+
+def test_commit_failure_then_retry(fake, files, store):
+    fake.inject_error("POST", r"/git/refs$")
+    assert push(fake, files, store)["status"] == "failed"
+    assert branches(fake) == []
+    calls(fake)
+    result = push(fake, files, store)
+    assert result["status"] == "created"
+    assert branches(fake) == [result["branch"]]
+    assert len(fake.pulls) == 1 and len(fake.runs) == 1
+
+
+def test_lost_branch_is_taken_over(fake, files, store):
+    fake.inject_error("POST", r"/git/refs$", lost=True)
+    result = push(fake, files, store)
+    assert result["status"] == "created"
+    assert branches(fake) == [result["branch"]]
+    assert len(fake.pulls) == 1 and len(fake.runs) == 1
+
+
+def test_pull_request_failure_resumes_after_commit(fake, files, store):
+    fake.inject_error("POST", r"/pulls$")
+    failed = push(fake, files, store)
+    assert failed["status"] == "failed"
+    assert fake.runs == []
+    calls(fake)
+    result = push(fake, files, store)
+    assert result["status"] == "created"
+    assert result["resumed_from"] == "commit"
+    assert result["branch"] == failed["branch"]
+    # Only the PR is left to open
+    assert calls(fake) == 1
+    assert branches(fake) == [failed["branch"]]
+    assert len(fake.pulls) == 1 and len(fake.runs) == 1
+
+
+def test_lost_pull_request_is_found(fake, files, store):
+    fake.inject_error("POST", r"/pulls$", lost=True)
+    result = push(fake, files, store)
+    assert result["status"] == "created"
+    assert len(fake.pulls) == 1 and len(fake.runs) == 1
+    calls(fake)
+    again = push(fake, files, store)
+    assert again["status"] == "reused"
+    assert again["resumed_from"] == "pull_request"
+    assert again["pr_url"] == result["pr_url"]
+    # Only the PR's state is read
+    assert calls(fake) == 1
+    assert branches(fake) == [result["branch"]]
+    assert len(fake.pulls) == 1 and len(fake.runs) == 1
+
+
+@pytest.mark.parametrize("lost", [False, True])
+def test_merge_failure_then_retry(fake, files, store, lost):
+    pushed = push(fake, files, store)
+    pr_url = pushed["pr_url"]
+    number = pipeline.pr_number(pr_url)
+    fake.inject_error("PUT", r"/merge$", lost=lost)
+    calls(fake)
+    first = pipeline.merge(fake.repo, TOKEN, number, "main", timeout=5, store=store)
+    assert calls(fake, "PUT") == 1
+    if not lost:
+        assert first[0] is False
+        first = pipeline.merge(fake.repo, TOKEN, number, "main", timeout=5, store=store)
+        assert calls(fake, "PUT") == 1
+    success, _, apply_run = first
+    assert success and apply_run
+    # Everything is in the checkpoint now: no further calls, no second merge
+    again = pipeline.merge(fake.repo, TOKEN, number, "main", timeout=5, store=store)
+    assert again[2] == {"id": apply_run["id"], "html_url": apply_run["html_url"]}
+    assert calls(fake) == 0
+    assert [run["event"] for run in fake.runs] == ["push", "pull_request"]
+    assert branches(fake) == [pushed["branch"]]
@@ -0,0 +1,81 @@
+"""The renderer functions template.yaml relies on, pinned to known expansions of examples/."""
+import os
+
+import pytest
+import yaml
+
+import models
+from template_renderer import REPO_ROOT, TemplateError, render_stack_file, render_text
+
+EXAMPLES = os.path.join(REPO_ROOT, "examples")
+
+
+def text(template, data=None):
+    return render_text(template, data or {}).text
+
+
+@pytest.fixture(scope="module")
+def units():
+    result = render_stack_file(os.path.join(EXAMPLES, "stack-eks.yaml"))
+    return {unit["name"]: unit for unit in yaml.safe_load(result.text)["units"]}
+
+
+@pytest.mark.parametrize("prefix, newbits, netnum, expected", [
+    ("10.8.0.0/18", 4, 0, "10.8.0.0/22"),
+    ("10.8.0.0/18", 4, 3, "10.8.12.0/22"),
+    ("10.8.0.0/18", 4, 15, "10.8.60.0/22"),
+    ("10.0.0.0/16", 8, 255, "10.0.255.0/24"),
+])
+def test_cidr_subnet(prefix, newbits, netnum, expected):
+    assert text(f'{{{{ cidrSubnet "{prefix}" {newbits} {netnum} }}}}') == expected
+
+
+def test_cidr_subnet_out_of_range():
+    with pytest.raises(TemplateError):
+        text('{{ cidrSubnet "10.8.0.0/18" 4 16 }}')
+
+
+def test_insert_yaml_is_flow_yaml():
+    assert text("{{ insertYAML .v }}", {"v": ["a", "b"]}) == '["a", "b"]'
+    assert yaml.safe_load(text("x: {{ insertYAML .v }}", {"v": {"b": 1, "a": [True]}})) == {"x": {"a": [True], "b": 1}}
+
+
+def test_to_yaml_nindent():
+    assert text("k:{{ .v | toYaml | nindent 2 }}", {"v": {"b": 1, "a": "x"}}) == "k:\n  a: x\n  b: 1"
+
+
+def test_azs_default_to_three_of_the_region(units):
+    assert units["vpc"]["inputs"]["azs"] == ["eu-central-1a", "eu-central-1b", "eu-central-1c"]
+
+
+def test_vpc_subnets_of_the_example(units):
+    inputs = units["vpc"]["inputs"]
+    assert inputs["cidr"] == "10.8.0.0/18"
+    assert inputs["public_subnets"] == ["10.8.0.0/22", "10.8.4.0/22", "10.8.8.0/22"]
+    assert inputs["private_subnets"] == ["10.8.12.0/22", "10.8.16.0/22", "10.8.20.0/22"]
+    assert inputs["database_subnets"] == ["10.8.24.0/22", "10.8.28.0/22", "10.8.32.0/22"]
+
+
+def test_node_groups_inserted_as_given(units):
+    with open(os.path.join(EXAMPLES, "stack-eks.yaml")) as f:
+        workers = yaml.safe_load(render_text(f.read(), {"project": {}}).text)["variables"]["eks_managed_node_groups"]
+    assert units["eks"]["inputs"]["eks_managed_node_groups"] == workers
+    assert workers["workers"]["subnet_ids"] == "${remoteState:cluster.vpc.private_subnets}"
+
+
+def test_explicit_azs_set_the_subnet_count():
+    project, stack = models.ProjectConfig(), models.StackConfig()
+    with open(os.path.join(REPO_ROOT, "template.yaml")) as f:
+        template = f.read()
+    result = render_text(template, {"name": "cluster", "variables": {
+        **stack.to_dict(project)["variables"], "azs": ["eu-west-1a", "eu-west-1b"]}}, REPO_ROOT)
+    vpc = next(unit for unit in yaml.safe_load(result.text)["units"] if unit["name"] == "vpc")
+    assert vpc["inputs"]["azs"] == ["eu-west-1a", "eu-west-1b"]
+    assert vpc["inputs"]["private_subnets"] == ["10.8.8.0/22", "10.8.12.0/22"]
+
+
+def test_preview_stack_is_cached_across_reruns():
+    project, stack = models.ProjectConfig(), models.StackConfig()
+    first = models.preview_stack(project, stack)
+    # A rerun builds equal but new config objects
+    assert models.preview_stack(models.ProjectConfig(), models.StackConfig()) is first
@@ -0,0 +1,191 @@
+"""Per-unit apply timings from workflow logs, kept across runs.
+
+profile_lines() reads a cdev apply log one line at a time. It uses the
+timestamps GitHub Actions puts on every line and cdev's "Applying unit"
+messages to work out how long each unit took. Terraform's "Creation/
+Modifications/Destruction complete after ..." lines are attributed to the
+unit running at the time. TimingStore keeps the results in a small SQLite
+file so percentiles and trends show whether a change to the template,
+module versions or addons made the bootstrap faster or slower.
+"""
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+
+from logs import APPLY_LOG_PATTERN, iter_log_lines, spooled_run_logs
+from metrics import timed
+
+TIMINGS_DB = os.environ.get(
+    "CDEV_TIMINGS_DB", os.path.join(os.path.expanduser("~"), ".cache", "cdev-streamlit", "timings.sqlite3"))
+PERCENTILES = (50, 90, 99)
+
+_STAMP_RE = re.compile(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?Z ")
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+_UNIT_DONE_RE = re.compile(r"(?:Applying|Destroying) unit '?(?P<unit>[\w.-]+?)'?:? (?:done|finished|complete)", re.I)
+_UNIT_START_RE = re.compile(r"(?:Applying|Destroying) unit '?(?P<unit>[\w.-]+?)'?:?\s*$")
+_RESOURCE_RE = re.compile(r"(?P<address>\S+): (?P<action>Creation|Modifications|Destruction) complete after "
+                          r"(?P<elapsed>(?:\d+h)?(?:\d+m)?\d+s)")
+_ELAPSED_RE = re.compile(r"(\d+)([hms])")
+_SECONDS = {"h": 3600, "m": 60, "s": 1}
+NO_UNIT = "(no unit)"
+
+
+def _stamp(match):
+    # Actions timestamps carry 7 fractional digits, datetime takes 6
+    stamp = datetime.fromisoformat(match.group(1)).timestamp()
+    return stamp + float(match.group(2) or 0)
+
+
+def _elapsed(text):
+    return sum(int(n) * _SECONDS[unit] for n, unit in _ELAPSED_RE.findall(text))
+
+
+def profile_lines(lines):
+    """Return {unit: {"seconds": wall time or None, "resources": [(address, action, seconds)]}} for log lines.
+
+    A unit ends at its "done" message, or else at the last timestamp seen
+    while it was the most recently started unit.
+    """
+    units = {}
+    running = []  # started and not done yet, most recent last
+    current = None  # the most recently started unit until it is done
+    for line in lines:
+        match = _STAMP_RE.match(line)
+        stamp = None
+        if match:
+            stamp = _stamp(match)
+            line = line[match.end():]
+        line = _ANSI_RE.sub("", line).strip()
+
+        match = _UNIT_DONE_RE.search(line) or _UNIT_START_RE.search(line)
+        if match:
+            name = match.group("unit").rsplit(".", 1)[-1]  # cluster.vpc -> vpc
+            unit = units.setdefault(name, {"start": stamp, "end": None, "last": stamp, "resources": []})
+            if match.re is _UNIT_DONE_RE:
+                unit["end"] = stamp
+                if name in running:
+                    running.remove(name)
+                current = None if current == name else current
+            else:
+                if name not in running:
+                    running.append(name)
+                current = name
+            continue
+
+        if stamp is not None and current is not None:
+            units[current]["last"] = stamp
+        match = _RESOURCE_RE.search(line)
+        if match:
+            owner = current or (running[-1] if running else NO_UNIT)
+            unit = units.setdefault(owner, {"start": None, "end": None, "last": None, "resources": []})
+            unit["resources"].append((match.group("address"), match.group("action"), _elapsed(match.group("elapsed"))))
+
+    profile = {}
+    for name, unit in units.items():
+        end = unit["end"] if unit["end"] is not None else unit["last"]
+        seconds = end - unit["start"] if unit["start"] is not None and end is not None else None
+        profile[name] = {"seconds": seconds, "resources": unit["resources"]}
+    return profile
+
+
+@timed()
+def profile_run_logs(repo, run_id, token, pattern=APPLY_LOG_PATTERN):
+    """Profile the apply step log of a finished run; None if the logs are unavailable."""
+    with spooled_run_logs(repo, run_id, token) as archive:
+        if archive is None:
+            return None
+        return profile_lines(line for _, line in iter_log_lines(archive, pattern))
+
+
+class TimingStore:
+    """SQLite file of unit and resource timings per repository and run."""
+
+    def __init__(self, path=TIMINGS_DB):
+        self.path = path
+
+    def _connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS unit_timings (
+                repo TEXT, run_id TEXT, unit TEXT, seconds REAL, label TEXT, recorded_at REAL,
+                PRIMARY KEY (repo, run_id, unit));
+            CREATE TABLE IF NOT EXISTS resource_timings (
+                repo TEXT, run_id TEXT, unit TEXT, address TEXT, action TEXT, seconds REAL,
+                PRIMARY KEY (repo, run_id, unit, address, action));
+        """)
+        return db
+
+    def record(self, repo, run_id, profile, label=None, recorded_at=None):
+        """Store one run's profile; recording the same run again replaces it."""
+        recorded_at = recorded_at or time.time()
+        db = self._connect()
+        try:
+            with db:
+                db.execute("DELETE FROM unit_timings WHERE repo = ? AND run_id = ?", (repo, str(run_id)))
+                db.execute("DELETE FROM resource_timings WHERE repo = ? AND run_id = ?", (repo, str(run_id)))
+                db.executemany("INSERT INTO unit_timings VALUES (?, ?, ?, ?, ?, ?)", [
+                    (repo, str(run_id), unit, timing["seconds"], label, recorded_at)
+                    for unit, timing in profile.items() if timing["seconds"] is not None])
+                db.executemany("INSERT OR REPLACE INTO resource_timings VALUES (?, ?, ?, ?, ?, ?)", [
+                    (repo, str(run_id), unit, address, action, seconds)
+                    for unit, timing in profile.items() for address, action, seconds in timing["resources"]])
+        finally:
+            db.close()
+
+    def percentiles(self, repo, q=PERCENTILES, label=None):
+        """{unit: {"runs": n, "p50": s, ...}} over all recorded runs (or those with label)."""
+        query = "SELECT unit, seconds FROM unit_timings WHERE repo = ?"
+        args = [repo]
+        if label is not None:
+            query += " AND label = ?"
+            args.append(label)
+        db = self._connect()
+        try:
+            rows = db.execute(query, args).fetchall()
+        finally:
+            db.close()
+        by_unit = {}
+        for unit, seconds in rows:
+            by_unit.setdefault(unit, []).append(seconds)
+        result = {}
+        for unit, values in by_unit.items():
+            values = np.percentile(np.array(values), q)
+            result[unit] = {"runs": len(by_unit[unit]), **{f"p{p}": round(float(v), 1) for p, v in zip(q, values)}}
+        return result
+
+    def history(self, repo, limit=50):
+        """[(run_id, recorded_at, label, {unit: seconds})] for the last limit runs, oldest first."""
+        db = self._connect()
+        try:
+            rows = db.execute("""
+                SELECT run_id, recorded_at, label, unit, seconds FROM unit_timings
+                WHERE repo = ? AND run_id IN (
+                    SELECT run_id FROM unit_timings WHERE repo = ?
+                    GROUP BY run_id ORDER BY MAX(recorded_at) DESC LIMIT ?)
+                ORDER BY recorded_at""", (repo, repo, limit)).fetchall()
+        finally:
+            db.close()
+        runs = {}
+        for run_id, recorded_at, label, unit, seconds in rows:
+            runs.setdefault(run_id, (run_id, recorded_at, label, {}))[3][unit] = seconds
+        return list(runs.values())
+
+    def slowest_resources(self, repo, top=10):
+        """[(unit, address, action, median seconds, runs)] of the slowest resources, slowest first."""
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT unit, address, action, seconds FROM resource_timings WHERE repo = ?",
+                              (repo,)).fetchall()
+        finally:
+            db.close()
+        by_resource = {}
+        for unit, address, action, seconds in rows:
+            by_resource.setdefault((unit, address, action), []).append(seconds)
+        medians = [(*key, float(np.median(values)), len(values)) for key, values in by_resource.items()]
+        return sorted(medians, key=lambda row: row[3], reverse=True)[:top]
@@ -0,0 +1,265 @@
+"""Dependency graph of the units in template.yaml.
+
+The graph comes from the expanded template itself: an edge for every
+remoteState/output reference from one unit to another and for every
+depends_on. From it, waves() groups units that can run side by side and
+schedule() lays out the graph for given per-unit durations. The result has
+earliest starts, slack and the critical path. It also reports how much
+longer a wave-by-wave run takes than the critical path, which is the
+parallelism lost to waiting for the slowest unit of each wave. Graphs are
+cached by the hash of the expanded text.
+
+    python unit_graph.py                       # waves and critical path for examples/stack-eks.yaml
+    python unit_graph.py --destroy --durations eks=900,eks-addons=300
+    python unit_graph.py --diagram ../../docs/diagram.py
+"""
+import argparse
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import yaml
+
+import template_renderer
+
+# ${remoteState:this.vpc.vpc_id}, ${output:cluster.eks-addons.kubeconfig}
+_REFERENCE_RE = re.compile(r"\$\{(?:remoteState|output):([\w-]+)\.([\w-]+)\.")
+_SLEEP_RE = re.compile(r"\bsleep\s+(\d+)")
+
+# Rough apply times in seconds, used until measured ones are passed in
+DEFAULT_DURATIONS = {"route53": 60, "vpc": 180, "eks": 720, "eks-addons": 480, "kubeconfig": 5, "outputs": 1}
+DEFAULT_DURATION = 30
+DIAGRAM_PATH = os.path.join(template_renderer.REPO_ROOT, "docs", "diagram.py")
+GRAPH_CACHE_SIZE = 64
+
+_graphs = OrderedDict()
+_graphs_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class UnitGraph:
+    units: tuple  # unit names in template order
+    types: dict  # unit -> type
+    deps: dict  # unit -> frozenset of units it needs
+    hook_sleep: dict  # unit -> (apply seconds, destroy seconds) slept in pre/post hooks
+    template_hash: str
+
+
+def _strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def _hook_sleep(unit):
+    apply_s = destroy_s = 0
+    for hook in ("pre_hook", "post_hook"):
+        spec = unit.get(hook) or {}
+        seconds = sum(int(s) for s in _SLEEP_RE.findall(spec.get("command", "")))
+        if spec.get("on_apply", True):
+            apply_s += seconds
+        if spec.get("on_destroy", False):
+            destroy_s += seconds
+    return apply_s, destroy_s
+
+
+def parse_units(expanded_text, stack_name="cluster"):
+    """Build the UnitGraph of an expanded stack template; cached by the text's hash."""
+    key = hashlib.sha256(f"{stack_name}\0{expanded_text}".encode()).hexdigest()
+    with _graphs_lock:
+        graph = _graphs.get(key)
+        if graph is not None:
+            _graphs.move_to_end(key)
+            return graph
+
+    units = yaml.safe_load(expanded_text).get("units") or []
+    names = tuple(unit["name"] for unit in units)
+    deps = {}
+    for unit in units:
+        needs = set()
+        for text in _strings(unit):
+            for stack, name in _REFERENCE_RE.findall(text):
+                if stack in ("this", stack_name):
+                    needs.add(name)
+        depends_on = unit.get("depends_on") or []
+        for ref in [depends_on] if isinstance(depends_on, str) else depends_on:
+            needs.add(ref.split(".", 1)[-1])
+        needs.discard(unit["name"])
+        unknown = needs - set(names)
+        if unknown:
+            raise ValueError(f"unit {unit['name']} depends on unknown units: {', '.join(sorted(unknown))}")
+        deps[unit["name"]] = frozenset(needs)
+
+    graph = UnitGraph(units=names, types={u["name"]: u.get("type", "") for u in units}, deps=deps,
+                      hook_sleep={u["name"]: _hook_sleep(u) for u in units}, template_hash=key)
+    with _graphs_lock:
+        _graphs[key] = graph
+        while len(_graphs) > GRAPH_CACHE_SIZE:
+            _graphs.popitem(last=False)
+    return graph
+
+
+def _edges(graph, destroy):
+    # Destroy runs the graph backwards: a unit goes once everything that needs it is gone
+    if not destroy:
+        return graph.deps
+    reverse = {name: set() for name in graph.units}
+    for name, needs in graph.deps.items():
+        for need in needs:
+            reverse[need].add(name)
+    return {name: frozenset(needs) for name, needs in reverse.items()}
+
+
+def waves(graph, destroy=False):
+    """Lists of units that can run at the same time, in order; ValueError on a cycle."""
+    deps = _edges(graph, destroy)
+    done, result = set(), []
+    while len(done) < len(graph.units):
+        wave = [name for name in graph.units if name not in done and deps[name] <= done]
+        if not wave:
+            raise ValueError("dependency cycle between units: " + ", ".join(n for n in graph.units if n not in done))
+        result.append(wave)
+        done.update(wave)
+    return result
+
+
+def schedule(graph, durations=None, destroy=False):
+    """Earliest start/finish, slack and the critical path for per-unit durations in seconds.
+
+    Hook sleeps (the 2 minute wait before destroying eks) are added on top
+    of the durations.
+    """
+    durations = {**DEFAULT_DURATIONS, **(durations or {})}
+    deps = _edges(graph, destroy)
+    order = [name for wave in waves(graph, destroy) for name in wave]
+    cost = {name: durations.get(name, DEFAULT_DURATION) + graph.hook_sleep[name][1 if destroy else 0]
+            for name in graph.units}
+
+    start, finish = {}, {}
+    for name in order:
+        start[name] = max((finish[need] for need in deps[name]), default=0)
+        finish[name] = start[name] + cost[name]
+    total = max(finish.values(), default=0)
+
+    # Latest finish without delaying the end, walking the graph backwards
+    latest = {name: total for name in graph.units}
+    for name in reversed(order):
+        for need in deps[name]:
+            latest[need] = min(latest[need], latest[name] - cost[name])
+    slack = {name: latest[name] - finish[name] for name in graph.units}
+
+    path, current = [], max(order, key=lambda name: (finish[name], -slack[name])) if order else None
+    while current is not None:
+        path.append(current)
+        current = max(deps[current], key=lambda need: finish[need], default=None)
+    path.reverse()
+
+    # Wave by wave every unit waits for the slowest one of the wave before
+    wave_total = sum(max(cost[name] for name in wave) for wave in waves(graph, destroy))
+    return {
+        "duration": cost,
+        "start": start,
+        "finish": finish,
+        "slack": slack,
+        "critical_path": path,
+        "total": total,
+        "wave_total": wave_total,
+        "lost_to_waves": wave_total - total,
+    }
+
+
+# diagrams node class per unit name, then per unit type
+NODE_CLASSES = {
+    "route53": ("diagrams.aws.network", "Route53"),
+    "vpc": ("diagrams.aws.network", "VPC"),
+    "eks": ("diagrams.aws.compute", "EKS"),
+    "eks-addons": ("diagrams.aws.compute", "EKS"),
+}
+TYPE_CLASSES = {
+    "tfmodule": ("diagrams.onprem.iac", "Terraform"),
+    "shell": ("diagrams.programming.language", "Bash"),
+    "printer": ("diagrams.programming.flowchart", "Document"),
+}
+EKS_CLUSTER_UNITS = ("eks", "eks-addons", "kubeconfig")
+_HASH_LINE = "# expanded template sha256: "
+
+
+def render_diagram(graph):
+    """Source of docs/diagram.py for graph: one node per unit, one edge per real dependency."""
+    classes = {name: NODE_CLASSES.get(name) or TYPE_CLASSES.get(graph.types[name], TYPE_CLASSES["tfmodule"])
+               for name in graph.units}
+    imports = {}
+    for module, cls in classes.values():
+        imports.setdefault(module, set()).add(cls)
+    var = {name: name.replace("-", "_") for name in graph.units}
+
+    lines = ["# Generated by .cdev-metadata/streamlit/unit_graph.py from template.yaml, do not edit.",
+             _HASH_LINE + graph.template_hash,
+             "from diagrams import Diagram, Cluster"]
+    lines += [f"from {module} import {', '.join(sorted(names))}" for module, names in sorted(imports.items())]
+    lines += ["", 'with Diagram("AWS EKS Cluster", show=False, direction="TB"):']
+    clustered = [name for name in graph.units if name in EKS_CLUSTER_UNITS]
+    for name in graph.units:
+        if name not in clustered:
+            lines.append(f'    {var[name]} = {classes[name][1]}("{name}\\n{graph.types[name]}")')
+    if clustered:
+        lines += ["", '    with Cluster("EKS Cluster"):']
+        lines += [f'        {var[name]} = {classes[name][1]}("{name}\\n{graph.types[name]}")' for name in clustered]
+    lines += ["", "    # remoteState, output and depends_on between units"]
+    for name in graph.units:
+        for need in sorted(graph.deps[name], key=graph.units.index):
+            lines.append(f"    {var[need]} >> {var[name]}")
+    return "\n".join(lines) + "\n"
+
+
+def regenerate_diagram(graph, path=DIAGRAM_PATH):
+    """Rewrite the diagram source if the template changed since it was generated; True if written."""
+    if os.path.exists(path):
+        with open(path) as f:
+            if any(line.strip() == _HASH_LINE + graph.template_hash for line in f):
+                return False
+    with open(path, "w") as f:
+        f.write(render_diagram(graph))
+    return True
+
+
+def stack_graph(stack_path):
+    """UnitGraph of a stack file (with its project.yaml next to it) expanded against its template."""
+    with open(stack_path) as f:
+        stack_text = f.read()
+    project = template_renderer.load_project(os.path.dirname(stack_path))
+    expanded = template_renderer.render_stack(stack_text, project, os.path.dirname(stack_path))
+    # The stack file itself may hold template actions, so read its name without parsing it
+    name = re.search(r"^name:\s*(\S+)", stack_text, re.M)
+    return parse_units(expanded.text, name.group(1) if name else "cluster")
+
+
+def _parse_durations(text):
+    return {name: float(seconds) for name, _, seconds in (item.partition("=") for item in text.split(",") if item)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stack", nargs="?", default=os.path.join(template_renderer.REPO_ROOT, "examples", "stack-eks.yaml"))
+    parser.add_argument("--durations", default="", help="unit=seconds,... overriding DEFAULT_DURATIONS")
+    parser.add_argument("--destroy", action="store_true", help="schedule a destroy instead of an apply")
+    parser.add_argument("--diagram", help="regenerate this diagrams source file if the template changed")
+    args = parser.parse_args()
+
+    graph = stack_graph(args.stack)
+    plan = schedule(graph, _parse_durations(args.durations), destroy=args.destroy)
+    for number, wave in enumerate(waves(graph, args.destroy), 1):
+        print(f"wave {number}: " + ", ".join(f"{name} ({plan['duration'][name]:g}s, slack {plan['slack'][name]:g}s)"
+                                             for name in wave))
+    print("critical path: " + " -> ".join(plan["critical_path"]) + f" = {plan['total']:g}s")
+    print(f"wave by wave: {plan['wave_total']:g}s ({plan['lost_to_waves']:g}s lost waiting on the slowest unit per wave)")
+    if args.diagram:
+        print(("regenerated " if regenerate_diagram(graph, args.diagram) else "up to date: ") + args.diagram)
@@ -0,0 +1,113 @@
+"""Validate project/stack configs before they reach GitHub.
+
+Field patterns come from the cdev generator options in
+.cdev-metadata/generator/minimal/config.yaml and are compiled once. On top of
+them come the structural rules template.yaml relies on (node group sizes,
+instance types, subnet lists for an existing VPC). Field checks are memoized
+on (field, value), so a rerun only re-checks the fields that changed.
+"""
+import os
+import re
+from functools import lru_cache
+
+import yaml
+
+GENERATOR_CONFIG = os.path.join(os.path.dirname(__file__), "..", "generator", "minimal", "config.yaml")
+
+# Generator option name -> config field it validates
+OPTION_FIELDS = {
+    "name": "name",
+    "organization": "organization",
+    "region": "region",
+    "domain": "domain",
+    "bucket_name": "state_bucket_name",
+}
+
+# Checks template.yaml needs that the generator options do not cover
+EXTRA_PATTERNS = {
+    "cluster_name": (r"^[0-9A-Za-z][A-Za-z0-9\-_]{0,99}$", "EKS cluster name"),
+    "eks_version": (r"^1\.\d+$", "EKS version"),
+    "vpc_id": (r"^vpc-[0-9a-f]{8,17}$", "VPC ID"),
+    "subnet": (r"^subnet-[0-9a-f]{8,17}$", "subnet ID"),
+}
+
+
+@lru_cache(maxsize=None)
+def field_rules(config_path=GENERATOR_CONFIG):
+    """Return {field: (compiled regex, description)} built from the generator options."""
+    with open(config_path) as f:
+        options = yaml.safe_load(f).get("options", [])
+    rules = {}
+    for option in options:
+        field = OPTION_FIELDS.get(option["name"])
+        if field and option.get("regex"):
+            rules[field] = (re.compile(option["regex"]), option.get("description", field))
+    for field, (pattern, description) in EXTRA_PATTERNS.items():
+        rules.setdefault(field, (re.compile(pattern), description))
+    return rules
+
+
+@lru_cache(maxsize=4096)
+def validate_field(field, value):
+    """Return an error message for one field value, or None if it is valid."""
+    rule = field_rules().get(field)
+    if rule is None:
+        return None
+    pattern, description = rule
+    if value is None or not pattern.match(str(value)):
+        return f"{description} {value!r} does not match {pattern.pattern}"
+    return None
+
+
+def _subnet_errors(label, subnets, required):
+    errors = []
+    if required and not any(s.strip() for s in subnets):
+        errors.append(f"{label} must list at least one subnet")
+        return errors
+    if any(not s.strip() for s in subnets) and any(s.strip() for s in subnets):
+        errors.append(f"{label} contain a blank entry (check for stray or trailing commas)")
+    for subnet in subnets:
+        if subnet.strip():
+            error = validate_field("subnet", subnet.strip())
+            if error:
+                errors.append(f"{label}: {error}")
+    return errors
+
+
+def validate_config(project, stack):
+    """Return {field: [messages]} for a ProjectConfig/StackConfig pair; empty when valid."""
+    errors = {}
+
+    def add(field, message):
+        if message:
+            errors.setdefault(field, []).append(message)
+
+    for field in ("name", "organization", "region", "state_bucket_name"):
+        add(field, validate_field(field, getattr(project, field)))
+    for field in ("cluster_name", "domain", "eks_version"):
+        add(field, validate_field(field, getattr(stack, field)))
+
+    if not stack.instance_types:
+        add("instance_types", "Select at least one instance type")
+    if stack.min_size < 1:
+        add("min_size", "Min size must be at least 1")
+    if stack.max_size < stack.min_size:
+        add("max_size", f"Max size {stack.max_size} is smaller than min size {stack.min_size}")
+
+    if stack.vpc_id is not None:
+        add("vpc_id", validate_field("vpc_id", stack.vpc_id.strip()))
+        for field, required in (("public_subnets", True), ("private_subnets", True), ("database_subnets", False)):
+            label = field.replace("_", " ").capitalize()
+            for message in _subnet_errors(label, getattr(stack, field), required):
+                add(field, message)
+    return errors
+
+
+def validate_fleet(clusters):
+    """Validate [(ProjectConfig, StackConfig), ...]; returns {project name: {field: [messages]}} for invalid ones."""
+    report = {}
+    for project, stack in clusters:
+        errors = validate_config(project, stack)
+        if errors:
+            report[project.name] = errors
+    return report
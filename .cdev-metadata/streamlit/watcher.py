@@ -0,0 +1,275 @@
+"""Watch GitHub Actions runs and check runs for one branch or commit.
+
+RunWatcher asks the API only for the runs it cares about (branch, head_sha and
+event filters) and polls with an adaptive backoff: quick while a run is being
+queued, slower the longer it stays in the same state. If a WebhookReceiver is
+running, the watcher waits for workflow_run/check_run deliveries instead and
+only falls back to a rare safety poll.
+"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+from github_utils import get_client
+from ratelimit import BACKGROUND
+
+# Default poll intervals in seconds; overridable for local runs against fake_github
+POLL_INITIAL = float(os.environ.get("CDEV_POLL_INITIAL", 2.0))
+POLL_MAXIMUM = float(os.environ.get("CDEV_POLL_MAXIMUM", 30.0))
+
+class Backoff:
+    """Poll interval that grows by factor up to maximum and resets on progress."""
+
+    def __init__(self, initial=None, maximum=None, factor=1.5):
+        self.initial = POLL_INITIAL if initial is None else initial
+        self.maximum = POLL_MAXIMUM if maximum is None else maximum
+        self.factor = factor
+        self.current = self.initial
+
+    def next(self):
+        delay = self.current
+        self.current = min(self.current * self.factor, self.maximum)
+        return delay
+
+    def reset(self):
+        self.current = self.initial
+
+
+class WebhookReceiver:
+    """Local endpoint for GitHub workflow_run/check_run webhook deliveries.
+
+    Point a repository webhook (content type application/json) at
+    http://<host>:<port>/ and give it the same secret. Deliveries are kept in
+    memory and handed to whoever is waiting on a matching event.
+
+    Without a secret anyone who can reach the port could forge deliveries, so
+    the receiver then only listens on a loopback address.
+    """
+
+    EVENTS = ("workflow_run", "check_run")
+
+    def __init__(self, host="127.0.0.1", port=8765, secret=None, max_events=500):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.max_events = max_events
+        # (sequence number, event, payload); sequence numbers only grow, the list keeps the last max_events
+        self.events = []
+        self._next_seq = 0
+        self._cond = threading.Condition()
+        self._server = None
+
+    def start(self):
+        if not self.secret and not _is_loopback(self.host):
+            raise ValueError(f"Refusing to receive webhooks on {self.host} without a secret; "
+                             f"set GITHUB_WEBHOOK_SECRET or listen on 127.0.0.1.")
+        receiver = self
+
+        class Handler(_WebhookHandler):
+            webhook = receiver
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def verify(self, body, signature):
+        if not self.secret:
+            return True
+        expected = "sha256=" + hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or "")
+
+    def deliver(self, event, payload):
+        if event not in self.EVENTS:
+            return
+        with self._cond:
+            self.events.append((self._next_seq, event, payload))
+            self._next_seq += 1
+            del self.events[:-self.max_events]
+            self._cond.notify_all()
+
+    def wait(self, predicate, timeout, since=0):
+        """Return (sequence number, payload) of the first delivery numbered since or later matching predicate, or None."""
+        end_time = time.time() + timeout
+        with self._cond:
+            while True:
+                # Sequence number of self.events[0]; older deliveries were dropped
+                base = self._next_seq - len(self.events)
+                for seq, event, payload in self.events[max(since - base, 0):]:
+                    if predicate(event, payload):
+                        return seq, payload
+                since = self._next_seq
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    webhook = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.webhook.verify(body, self.headers.get("X-Hub-Signature-256")):
+            self.send_response(401)
+            self.end_headers()
+            return
+        self.webhook.deliver(self.headers.get("X-GitHub-Event"), json.loads(body or b"{}"))
+        self.send_response(204)
+        self.end_headers()
+
+
+def _is_loopback(host):
+    import ipaddress
+
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+_receiver = None
+_receiver_lock = threading.Lock()
+
+
+def default_webhook_receiver():
+    """Start the shared receiver when GITHUB_WEBHOOK_PORT is set, else return None.
+
+    GITHUB_WEBHOOK_HOST picks the address (default 127.0.0.1); any other than
+    loopback requires GITHUB_WEBHOOK_SECRET.
+    """
+    global _receiver
+    port = os.environ.get("GITHUB_WEBHOOK_PORT")
+    if not port:
+        return None
+    with _receiver_lock:
+        if _receiver is None:
+            _receiver = WebhookReceiver(host=os.environ.get("GITHUB_WEBHOOK_HOST", "127.0.0.1"), port=int(port),
+                                        secret=os.environ.get("GITHUB_WEBHOOK_SECRET")).start()
+        return _receiver
+
+
+class RunWatcher:
+
+    def __init__(self, repo, token, webhook=None, backoff=None, webhook_fallback=120.0):
+        self.repo = repo
+        self.client = get_client(token)
+        self.webhook = webhook
+        self.backoff = backoff or Backoff()
+        self.webhook_fallback = webhook_fallback
+
+    def find_run(self, branch=None, head_sha=None, event=None):
+        params = {"per_page": 5}
+        for key, value in (("branch", branch), ("head_sha", head_sha), ("event", event)):
+            if value:
+                params[key] = value
+        r = self.client.get(f"repos/{self.repo}/actions/runs", params=params, priority=BACKGROUND)
+        if r.status_code != 200:
+            print(f"Failed to list workflow runs. Status code: {r.status_code}")
+            return None
+        for run in r.json().get("workflow_runs", []):
+            # The filters are applied server side; re-check in case an API version ignores one.
+            if (branch and run["head_branch"] != branch) or (head_sha and run["head_sha"] != head_sha):
+                continue
+            return run
+        return None
+
+    def jobs(self, run):
+        r = self.client.get(run["jobs_url"], priority=BACKGROUND)
+        if r.status_code != 200:
+            print(f"Failed to list jobs for run {run['id']}. Status code: {r.status_code}")
+            return []
+        return r.json().get("jobs", [])
+
+    def find_check_run(self, commit_sha, match):
+        r = self.client.get(f"repos/{self.repo}/commits/{commit_sha}/check-runs", priority=BACKGROUND)
+        if r.status_code != 200:
+            print(f"Failed to list check runs for {commit_sha}. Status code: {r.status_code}")
+            return None
+        for check_run in r.json().get("check_runs", []):
+            if match(check_run):
+                return check_run
+        return None
+
+    def wait_for_run(self, branch=None, head_sha=None, event=None, timeout=1500, callback=None, status="completed"):
+        """Wait until the newest matching run reaches status; returns the run or None on timeout."""
+
+        def matches(hook_event, payload):
+            run = payload.get("workflow_run") or {}
+            return (hook_event == "workflow_run"
+                    and (not branch or run.get("head_branch") == branch)
+                    and (not head_sha or run.get("head_sha") == head_sha)
+                    and (not event or run.get("event") == event))
+
+        return self._wait("workflow_run", lambda: self.find_run(branch, head_sha, event), matches,
+                          lambda payload: payload["workflow_run"],
+                          lambda run: run["status"] == status, timeout, callback)
+
+    def wait_for_check_run(self, commit_sha, match, timeout=60, callback=None):
+        """Wait until a check run on commit_sha satisfies match; returns it or None on timeout."""
+
+        def matches(hook_event, payload):
+            check_run = payload.get("check_run") or {}
+            return hook_event == "check_run" and check_run.get("head_sha") == commit_sha and match(check_run)
+
+        return self._wait("check_run", lambda: self.find_check_run(commit_sha, match), matches,
+                          lambda payload: payload["check_run"], lambda check_run: True, timeout, callback)
+
+    def _wait(self, kind, poll, hook_matches, hook_object, done, timeout, callback):
+        # The whole wait, its polls and its sleeps go to metrics separately: time asleep is not GitHub's
+        with metrics.span("watcher_wait", kind=kind, outcome="timeout") as labels:
+            obj = self._wait_loop(kind, poll, hook_matches, hook_object, done, timeout, callback)
+            if obj is not None:
+                labels["outcome"] = "found"
+            return obj
+
+    def _wait_loop(self, kind, poll, hook_matches, hook_object, done, timeout, callback):
+        poll = metrics.timed("watcher_poll", kind=kind)(poll)
+        start = time.time()
+        end_time = start + timeout
+        self.backoff.reset()
+        last_status = None
+        since = 0
+        obj = poll()
+        while True:
+            if obj is not None:
+                if done(obj):
+                    return obj
+                if obj.get("status") != last_status:
+                    # Progress: poll quickly again, the next transition often follows soon.
+                    last_status = obj.get("status")
+                    self.backoff.reset()
+            if callback:
+                callback(min((time.time() - start) / timeout, 1.0))
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return None
+            if self.webhook is not None:
+                with metrics.span("watcher_webhook_wait", kind=kind):
+                    found = self.webhook.wait(hook_matches, min(self.webhook_fallback, remaining), since)
+                if found is not None:
+                    since = found[0] + 1
+                    obj = hook_object(found[1])
+                    continue
+            else:
+                delay = min(self.backoff.next(), remaining)
+                metrics.observe("watcher_sleep", delay, kind=kind)
+                time.sleep(delay)
+            obj = poll()
@@ -1,29 +1,27 @@
+# Generated by .cdev-metadata/streamlit/unit_graph.py from template.yaml, do not edit.
+# expanded template sha256: 7b1f63e5c6d498eb2a2d81e94dc9750bf986e8c428dcc132e0a18b470a517199
 from diagrams import Diagram, Cluster
 from diagrams.aws.compute import EKS
 from diagrams.aws.network import Route53, VPC
-from diagrams.programming.language import Bash
 from diagrams.programming.flowchart import Document
+from diagrams.programming.language import Bash
 
 with Diagram("AWS EKS Cluster", show=False, direction="TB"):
     route53 = Route53("route53\ntfmodule")
     vpc = VPC("vpc\ntfmodule")
+    outputs = Document("outputs\nprinter")
 
     with Cluster("EKS Cluster"):
         eks = EKS("eks\ntfmodule")
         eks_addons = EKS("eks-addons\ntfmodule")
         kubeconfig = Bash("kubeconfig\nshell")
 
-    outputs = Document("outputs\nprinter")
-
-    # Connections
-    route53 >> vpc
+    # remoteState, output and depends_on between units
     vpc >> eks
+    route53 >> eks_addons
+    vpc >> eks_addons
     eks >> eks_addons
     eks_addons >> kubeconfig
+    route53 >> outputs
+    eks_addons >> outputs
     kubeconfig >> outputs
-
-    # Dependencies based on remoteState
-    eks - vpc
-    eks_addons - eks
-    eks_addons - vpc
-    eks_addons - route53